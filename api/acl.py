@@ -0,0 +1,163 @@
+import os
+import threading
+import time
+from . import queries
+from .db import connect
+
+# Per-process cache of who may see a project room or an application thread,
+# and of who hears about a project's comments.
+# The chat socket events ask on every message, so the answers are kept here
+# and dropped by the writes that change them (team membership, a team's
+# project, a student's instructor, deleting a user or group). The TTL is a
+# backstop for changes made by another worker process or outside these paths.
+ACL_CACHE_TTL = float(os.getenv("ACL_CACHE_TTL", "60"))
+ACL_CACHE_MAX_ENTRIES = int(os.getenv("ACL_CACHE_MAX_ENTRIES", "50000"))
+
+class AclCache:
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = {}
+        self.by_user = {}
+        self.by_object = {}
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    # users maps a computed value to the user ids whose invalidation should
+    # drop it; by default that is just the user it was asked for.
+    def get(self, kind, user_id, object_id, compute, users=None):
+        key = (kind, user_id, object_id)
+        entry = self.entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+
+        generation = self.generation
+        value = compute()
+        with self.lock:
+            # An invalidation ran while we were computing; the answer may
+            # predate it, so hand it back without caching it.
+            if generation != self.generation:
+                return value
+            self._discard(key)
+            if len(self.entries) >= self.max_entries:
+                self._purge_expired()
+            if len(self.entries) >= self.max_entries:
+                self._clear()
+            owners = tuple(users(value)) if users else (user_id,)
+            self.entries[key] = (time.monotonic() + self.ttl, value, owners)
+            for owner in owners:
+                self.by_user.setdefault(owner, set()).add(key)
+            self.by_object.setdefault((kind, object_id), set()).add(key)
+        return value
+
+    # Removes an entry and its key from both indexes, so entries that are
+    # replaced or dropped through one index leave nothing behind in the other.
+    def _discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        kind, _, object_id = key
+        for owner in entry[2]:
+            self._unindex(self.by_user, owner, key)
+        self._unindex(self.by_object, (kind, object_id), key)
+
+    @staticmethod
+    def _unindex(index, index_key, key):
+        keys = index.get(index_key)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del index[index_key]
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        for key in [key for key, entry in self.entries.items() if entry[0] <= now]:
+            self._discard(key)
+
+    def _drop(self, keys):
+        self.generation += 1
+        for key in keys:
+            self._discard(key)
+
+    def _clear(self):
+        self.generation += 1
+        self.entries.clear()
+        self.by_user.clear()
+        self.by_object.clear()
+
+    def invalidate_user(self, user_id):
+        with self.lock:
+            self._drop(self.by_user.pop(user_id, ()))
+
+    def invalidate_object(self, kind, object_id):
+        with self.lock:
+            self._drop(self.by_object.pop((kind, object_id), ()))
+
+    def clear(self):
+        with self.lock:
+            self._clear()
+
+acl_cache = AclCache(ACL_CACHE_TTL, ACL_CACHE_MAX_ENTRIES)
+
+def _as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+def project_access(user_id, project_id, engine):
+    user_id, project_id = _as_int(user_id), _as_int(project_id)
+
+    def compute():
+        with connect(engine) as conn:
+            row = conn.execute(queries.PROJECT_ACCESS, {"user_id": user_id, "project_id": project_id}).mappings().first()
+        return {"owner": bool(row['owner']), "member": bool(row['member']), "instructor": bool(row['instructor'])}
+
+    return acl_cache.get("project", user_id, project_id, compute)
+
+def application_access(user_id, application_id, engine):
+    user_id, application_id = _as_int(user_id), _as_int(application_id)
+
+    def compute():
+        with connect(engine) as conn:
+            return conn.execute(queries.APPLICATION_ACCESS, {"user_id": user_id, "application_id": application_id}).first() is not None
+
+    return acl_cache.get("application", user_id, application_id, compute)
+
+# Everyone a project's comment notifications go to: the owner, team members,
+# the project's instructors and the instructors of its team members. The set
+# is filed under each of those users as well as the project, so removing a
+# member or changing a student's instructor drops it like their own entries.
+def project_participants(project_id, engine):
+    project_id = _as_int(project_id)
+
+    def compute():
+        with connect(engine) as conn:
+            return frozenset(conn.execute(queries.PROJECT_PARTICIPANTS, {"project_id": project_id}).scalars())
+
+    return acl_cache.get("participants", None, project_id, compute, users=lambda user_ids: user_ids)
+
+# Who may read and post in a chat room: a project's owner, team members and
+# their instructors, or the two sides of a job application.
+def chat_access(kind, user_id, room_id, engine):
+    if not user_id:
+        return False
+    if kind == 'project':
+        access = project_access(user_id, room_id, engine)
+        return access['owner'] or access['member'] or access['instructor']
+    if kind == 'application':
+        return application_access(user_id, room_id, engine)
+    return False
+
+def invalidate_user(user_id):
+    if user_id is not None:
+        acl_cache.invalidate_user(_as_int(user_id))
+
+def invalidate_project(project_id):
+    if project_id is not None:
+        acl_cache.invalidate_object("project", _as_int(project_id))
+        acl_cache.invalidate_object("participants", _as_int(project_id))
+
+def invalidate_application(application_id):
+    if application_id is not None:
+        acl_cache.invalidate_object("application", _as_int(application_id))
@@ -1,71 +1,21 @@
-from sqlalchemy import text
+from . import queries
+from .db import write
+from .blobs import release_uploads
+from .listing import LISTINGS, fetch_page, invalidate_counts
 
-def get_jobs_paginated(engine, page: int = 1, per_page: int = 6, q: str | None = None, status: str | None = None):
-    page = max(int(page or 1), 1)
-    per_page = max(int(per_page or 1), 1)
-    offset = (page - 1) * per_page
-
-    where = []
-    params = {}
-
-    if q:
-        where.append("(title LIKE :q OR description LIKE :q)")
-        params["q"] = f"%{q}%"
-
-    if status is not None and status != "":
-        where.append("status = :status")
-        params["status"] = status
-
-    where_sql = ("WHERE " + " AND ".join(where)) if where else ""
-
-    try:
-        with engine.connect() as conn:
-            total = conn.execute(text(f"SELECT COUNT(*) FROM jobs {where_sql}"), params).scalar() or 0
-
-            counts = conn.execute(text(
-                """
-                SELECT 
-                  SUM(CASE WHEN status = 0 THEN 1 ELSE 0 END) AS pending_count,
-                  SUM(CASE WHEN status = 1 THEN 1 ELSE 0 END) AS approved_count,
-                  SUM(CASE WHEN status = 2 THEN 1 ELSE 0 END) AS taken_count
-                FROM jobs
-                """
-            )).mappings().first() or {"pending_count": 0, "approved_count": 0, "taken_count": 0}
-
-            rows = conn.execute(
-                text(f"""
-                    SELECT *
-                    FROM jobs
-                    {where_sql}
-                    ORDER BY id ASC
-                    LIMIT :limit OFFSET :offset
-                """),
-                {**params, "limit": per_page, "offset": offset},
-            ).mappings().all()
-
-            total_pages = max(1, (total + per_page - 1) // per_page)
-            return (
-                rows,
-                total,
-                total_pages,
-                counts.get("pending_count", 0),
-                counts.get("approved_count", 0),
-                counts.get("taken_count", 0),
-            )
-    except Exception:
-        return [], 0, 1, 0, 0, 0
+def get_jobs_paginated(engine, per_page: int = 6, cursor: str | None = None, q: str | None = None, status: str | None = None):
+    return fetch_page(engine, LISTINGS["jobs"], per_page=per_page, cursor=cursor, q=q, status=status)
 
 
 def admin_update_job_status(engine, job_id: int, status: int) -> bool:
     if engine is None:
         return False
     try:
-        with engine.connect() as conn:
-            conn.execute(
-                text("UPDATE jobs SET status = :status WHERE id = :job_id"),
-                {"status": int(status), "job_id": int(job_id)},
-            )
-            conn.commit()
+        write(engine, lambda conn: conn.execute(
+            queries.UPDATE_JOB_STATUS,
+            {"status": int(status), "job_id": int(job_id)},
+        ))
+        invalidate_counts("jobs")
         return True
     except Exception:
         return False
@@ -74,10 +24,14 @@ def admin_update_job_status(engine, job_id: int, status: int) -> bool:
 def admin_delete_job(engine, job_id: int) -> bool:
     if engine is None:
         return False
+    def delete(conn):
+        paths = conn.execute(queries.JOB_UPLOAD_PATHS, {"job_id": int(job_id)}).scalars().all()
+        conn.execute(queries.ADMIN_DELETE_JOB, {"job_id": int(job_id)})
+        return paths
+
     try:
-        with engine.connect() as conn:
-            conn.execute(text("DELETE FROM jobs WHERE id = :job_id"), {"job_id": int(job_id)})
-            conn.commit()
+        release_uploads(engine, write(engine, delete))
+        invalidate_counts("jobs")
         return True
     except Exception:
         return False
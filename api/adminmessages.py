@@ -1,18 +1,13 @@
-from sqlalchemy import text
+from . import queries
+from .db import connect
 
 def get_admin_messages(engine):
     if engine is None:
         return []
     try:
-        with engine.connect() as conn:
+        with connect(engine) as conn:
             rows = conn.execute(
-                text(
-                    """
-                    SELECT id, user_id, message, timestamp
-                    FROM admin_messages
-                    ORDER BY timestamp DESC, id DESC
-                    """
-                )
+                queries.ADMIN_MESSAGES
             ).mappings().all()
         return rows
     except Exception:
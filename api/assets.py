@@ -0,0 +1,268 @@
+import os
+import re
+import sys
+import json
+import gzip
+import hashlib
+import mimetypes
+from flask import current_app, request, send_file, abort
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Static assets are built once per deploy with `python -m api.assets`:
+#
+#   - lucide.js is cut down to the icons that templates/ and static/ name in
+#     data-lucide="..." attributes (the full bundle carries ~1600 of them);
+#   - every asset is copied to static/dist/ under a content-hashed name, so
+#     its URL changes whenever its bytes do and it can be cached forever;
+#   - each copy gets .gz and, when the brotli package is installed, .br
+#     siblings, compressed at the highest level once instead of per request.
+#
+# static/dist/manifest.json maps the source name to the built file. Templates
+# link assets with asset_url('output.css'), which falls back to the plain
+# /static/ file when there is no manifest or the app runs in debug mode, so
+# `npm run tw` edits show up without a rebuild.
+ASSET_SOURCES = ("output.css", "lucide.js", "theme.js", "chat-upload.js")
+ASSET_DIR_NAME = "dist"
+ASSET_HASH_LENGTH = 12
+ASSET_MAX_AGE = 365 * 24 * 3600
+ICON_RE = re.compile(r'data-lucide="([a-z0-9-]+)"')
+
+_manifests = {}
+
+def _asset_dir(static_dir):
+    return os.path.join(static_dir, ASSET_DIR_NAME)
+
+def _manifest_path(static_dir):
+    return os.path.join(_asset_dir(static_dir), "manifest.json")
+
+# Icon names used in data-lucide attributes, including those written into
+# HTML strings by inline scripts.
+def used_icons(template_dir, static_dir):
+    names = set()
+    sources = [os.path.join(static_dir, name) for name in ASSET_SOURCES if name.endswith(".js") and name != "lucide.js"]
+    for root, _, files in os.walk(template_dir):
+        sources.extend(os.path.join(root, name) for name in files if name.endswith(".html"))
+    for path in sources:
+        with open(path, encoding="utf-8") as f:
+            names.update(ICON_RE.findall(f.read()))
+    return sorted(names)
+
+def _pascal_case(name):
+    return "".join(part[:1].upper() + part[1:] for part in name.split("-"))
+
+# Reads the JS literal at text[start:] (arrays, objects with bare keys,
+# strings and numbers: the shape of Lucide's icon nodes) and returns
+# (value, end).
+def _parse_literal(text, start):
+    char = text[start]
+    if char == "[":
+        items, position = [], start + 1
+        while text[position] != "]":
+            item, position = _parse_literal(text, position)
+            items.append(item)
+            if text[position] == ",":
+                position += 1
+        return items, position + 1
+    if char == "{":
+        entries, position = {}, start + 1
+        while text[position] != "}":
+            if text[position] == '"':
+                key, position = _parse_literal(text, position)
+            else:
+                key_end = text.index(":", position)
+                key = text[position:key_end]
+                position = key_end
+            value, position = _parse_literal(text, position + 1)
+            entries[key] = value
+            if text[position] == ",":
+                position += 1
+        return entries, position + 1
+    if char == '"':
+        end = text.index('"', start + 1)
+        return text[start + 1:end], end + 1
+    match = re.compile(r"-?[0-9.]+").match(text, start)
+    if not match:
+        raise ValueError(f"Unexpected {text[start:start + 20]!r} in lucide.js")
+    return float(match.group()) if "." in match.group() else int(match.group()), match.end()
+
+# Icon nodes for the given names, read out of the full Lucide UMD bundle.
+# Its icons object maps each PascalCase name (aliases such as Edit2
+# included) to a variable holding the node array.
+def extract_icons(bundle, names):
+    registry_start = bundle.index("Object.freeze({__proto__:null,") + len("Object.freeze({__proto__:null,")
+    registry = dict(re.findall(r"([A-Za-z0-9]+):([\w$]+)", bundle[registry_start:bundle.index("})", registry_start)]))
+
+    icons, missing = {}, []
+    for name in names:
+        variable = registry.get(_pascal_case(name))
+        if not variable:
+            missing.append(name)
+            continue
+        definition = re.search(r"(?<![\w$.])" + re.escape(variable) + r"=\[\[", bundle)
+        icons[_pascal_case(name)], _ = _parse_literal(bundle, definition.end() - 2)
+    return icons, missing
+
+# Same DOM output as lucide.createIcons(): each [data-lucide] element is
+# replaced by an <svg> carrying the default attributes, the element's own
+# attributes and the lucide / lucide-<name> classes.
+ICON_RUNTIME = """/**
+ * @license lucide v%(version)s - ISC
+ *
+ * This source code is licensed under the ISC license.
+ * See the LICENSE file in the root directory of this source tree.
+ *
+ * Subset of %(count)d icons built by `python -m api.assets`.
+ */
+(function (global) {
+  "use strict";
+  const defaultAttributes = { xmlns: "http://www.w3.org/2000/svg", width: 24, height: 24, viewBox: "0 0 24 24", fill: "none", stroke: "currentColor", "stroke-width": 2, "stroke-linecap": "round", "stroke-linejoin": "round" };
+  const icons = %(icons)s;
+  const createNode = ([tag, attrs, children]) => {
+    const element = document.createElementNS("http://www.w3.org/2000/svg", tag);
+    Object.keys(attrs).forEach((name) => element.setAttribute(name, String(attrs[name])));
+    (children || []).forEach((child) => element.appendChild(createNode(child)));
+    return element;
+  };
+  const createElement = (iconNode, attrs = {}) => createNode(["svg", { ...defaultAttributes, ...attrs }, iconNode]);
+  const toPascalCase = (name) => name.replace(/(\\w)(\\w*)(_|-|\\s*)/g, (match, first, rest) => first.toUpperCase() + rest.toLowerCase());
+  const classNames = (values) => values.flatMap((value) => (typeof value === "string" ? value.split(" ") : Array.isArray(value) ? value : [])).map((name) => name.trim()).filter((name, index, all) => name && all.indexOf(name) === index).join(" ");
+  const replaceElement = (element, { nameAttr, icons, attrs }) => {
+    const name = element.getAttribute(nameAttr);
+    if (name == null) return;
+    const iconNode = icons[toPascalCase(name)];
+    if (!iconNode) return console.warn(`${element.outerHTML} icon name was not found in the provided icons object.`);
+    const elementAttrs = Array.from(element.attributes).reduce((all, attr) => ((all[attr.name] = attr.value), all), {});
+    const svgAttrs = { ...defaultAttributes, "data-lucide": name, ...attrs, ...elementAttrs };
+    const className = classNames(["lucide", `lucide-${name}`, elementAttrs.class, attrs.class]);
+    if (className) svgAttrs.class = className;
+    element.parentNode?.replaceChild(createElement(iconNode, svgAttrs), element);
+  };
+  const createIcons = ({ icons: set = icons, nameAttr = "data-lucide", attrs = {}, root = document } = {}) => {
+    Array.from(root.querySelectorAll(`[${nameAttr}]`)).forEach((element) => replaceElement(element, { nameAttr, icons: set, attrs }));
+  };
+  global.lucide = { icons, createIcons, createElement };
+})(typeof globalThis !== "undefined" ? globalThis : self);
+"""
+
+def build_icon_subset(bundle, names):
+    version = re.search(r"lucide v([0-9.]+)", bundle)
+    icons, missing = extract_icons(bundle, names)
+    script = ICON_RUNTIME % {
+        "version": version.group(1) if version else "",
+        "count": len(icons),
+        "icons": json.dumps(icons, separators=(",", ":")),
+    }
+    return script.encode("utf-8"), missing
+
+def _hashed_name(name, content):
+    stem, extension = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha256(content).hexdigest()[:ASSET_HASH_LENGTH]}{extension}"
+
+def _write(path, content):
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(content)
+    os.replace(temporary_path, path)
+
+def _compressed(content):
+    variants = {"gzip": (".gz", gzip.compress(content, compresslevel=9, mtime=0))}
+    if brotli is not None:
+        variants["br"] = (".br", brotli.compress(content, quality=11))
+    return variants
+
+def build_assets(static_dir, template_dir):
+    asset_dir = _asset_dir(static_dir)
+    os.makedirs(asset_dir, exist_ok=True)
+
+    manifest, report, missing = {}, [], []
+    for name in ASSET_SOURCES:
+        with open(os.path.join(static_dir, name), "rb") as f:
+            content = f.read()
+        source_size = len(content)
+        if name == "lucide.js":
+            content, missing = build_icon_subset(content.decode("utf-8"), used_icons(template_dir, static_dir))
+
+        file_name = _hashed_name(name, content)
+        _write(os.path.join(asset_dir, file_name), content)
+        entry = {"file": file_name, "size": len(content), "encodings": {}}
+        for encoding, (suffix, compressed) in _compressed(content).items():
+            if len(compressed) < len(content):
+                _write(os.path.join(asset_dir, file_name + suffix), compressed)
+                entry["encodings"][encoding] = {"file": file_name + suffix, "size": len(compressed)}
+        manifest[name] = entry
+        report.append((name, source_size, entry))
+
+    _write(_manifest_path(static_dir), json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"))
+
+    # Builds from earlier deploys are no longer linked from any page.
+    current = {os.path.basename(_manifest_path(static_dir))}
+    for entry in manifest.values():
+        current.add(entry["file"])
+        current.update(variant["file"] for variant in entry["encodings"].values())
+    for file_name in os.listdir(asset_dir):
+        if file_name not in current:
+            os.remove(os.path.join(asset_dir, file_name))
+
+    _manifests.pop(static_dir, None)
+    return report, missing
+
+def _load_manifest(static_dir):
+    if static_dir not in _manifests:
+        try:
+            with open(_manifest_path(static_dir), encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+        _manifests[static_dir] = (manifest, {entry["file"]: entry for entry in manifest.values()})
+    return _manifests[static_dir]
+
+# URL of a static asset for templates (a Jinja global).
+def asset_url(name):
+    if not current_app.debug:
+        manifest, _ = _load_manifest(current_app.static_folder)
+        if name in manifest:
+            return f"/assets/{manifest[name]['file']}"
+    return f"/static/{name}"
+
+# Serves a built asset, picking the smallest encoding the client accepts.
+# The names change with the content, so clients may keep them forever.
+def send_asset(file_name):
+    _, files = _load_manifest(current_app.static_folder)
+    entry = files.get(file_name)
+    if not entry:
+        abort(404)
+
+    served, encoding = file_name, None
+    for candidate in ("br", "gzip"):
+        if candidate in entry["encodings"] and request.accept_encodings[candidate]:
+            served, encoding = entry["encodings"][candidate]["file"], candidate
+            break
+
+    response = send_file(
+        os.path.join(_asset_dir(current_app.static_folder), served),
+        mimetype=mimetypes.guess_type(file_name)[0],
+        conditional=True,
+        max_age=ASSET_MAX_AGE,
+    )
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+if __name__ == "__main__":
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    report, missing = build_assets(os.path.join(root, "static"), os.path.join(root, "templates"))
+    for name, source_size, entry in report:
+        sizes = ", ".join(f"{encoding} {variant['size']:,}" for encoding, variant in sorted(entry["encodings"].items()))
+        print(f"{name} -> {entry['file']}: {source_size:,} bytes, built {entry['size']:,}" + (f", {sizes}" if sizes else ""))
+    if brotli is None:
+        print("brotli is not installed; built gzip variants only.")
+    if missing:
+        print(f"Unknown icons: {', '.join(missing)}", file=sys.stderr)
+        sys.exit(1)
@@ -1,16 +1,13 @@
-import bcrypt
-from sqlalchemy import text
+from . import queries
+from .db import connect
 from flask import request, flash, redirect, url_for, session, render_template
 from .projects import get_projects_for_user, get_projects_for_student
 from .job import get_my_applications
-import os
-import resend
+from .outbox import email_enabled, enqueue_email, notify_outbox
+from .passwords import hash_password, check_password, PasswordPoolBusy
 import secrets
 from datetime import datetime, timedelta
 
-SENDGRID_KEY = os.environ.get('SENDGRID_KEY')
-SENDGRID_EMAIL = os.environ.get('SENDGRID_EMAIL') 
-
 def register_user(request, engine):
     email = request.form.get('email')
     password = request.form.get('password')
@@ -35,34 +32,28 @@ def register_user(request, engine):
         return redirect(url_for('register'))
 
     try:
-        db_password = ""
-        db_password = password
-        password_bytes = password.encode('utf-8')
-        salt = bcrypt.gensalt()
-        db_password = bcrypt.hashpw(password_bytes, salt).decode('utf-8')
+        db_password = hash_password(password)
 
-        with engine.connect() as connection:
-            query = text("SELECT email FROM users WHERE email = :email")
-            result = connection.execute(query, {"email": email}).fetchone()
+        with connect(engine) as connection:
+            result = connection.execute(queries.USER_EMAIL_EXISTS, {"email": email}).fetchone()
 
             if result:
                 flash('An account with this email already exists.', 'warning')
             else:
-                insert_query = text(
-                    "INSERT INTO users (email, password, role, permission) VALUES (:email, :password, :role, :permission)"
-                )
                 params = {
                     "email": email,
                     "password": db_password,
                     "role": int(role),
                     "permission": int(permission)
                 }
-                connection.execute(insert_query, params)
+                connection.execute(queries.INSERT_USER, params)
                 connection.commit()
                 
                 flash(f"Account for {email} created successfully! You can now log in.", "success")
                 return redirect(url_for('login'))
 
+    except PasswordPoolBusy:
+        raise
     except Exception as e:
         print(f"Database error during registration: {e}")
         flash("An error occurred during registration. Please try again later.", "danger")
@@ -83,17 +74,11 @@ def login_user(request, engine):
         return redirect(url_for('login'))
 
     try:
-        with engine.connect() as connection:
-            query = text("SELECT id, email, password, role, permission FROM users WHERE email = :email")
-            result = connection.execute(query, {"email": email}).mappings().first()
+        with connect(engine) as connection:
+            result = connection.execute(queries.USER_BY_EMAIL, {"email": email}).mappings().first()
 
             if result:
-                password_matches = False
-                hashed_password_from_db = result.password.encode('utf-8')
-                submitted_password_bytes = password.encode('utf-8')
-                password_matches = bcrypt.checkpw(submitted_password_bytes, hashed_password_from_db)
-
-                if password_matches:
+                if check_password(password, result.password):
                     session.clear()
                     session['user_id'] = result.id
                     session['email'] = result.email
@@ -104,6 +89,8 @@ def login_user(request, engine):
                 
             flash("Invalid email or password. Please try again.", "danger")
 
+    except PasswordPoolBusy:
+        raise
     except Exception as e:
         print(f"Database error during login: {e}")
         flash("An error occurred during login. Please try again later.", "danger")
@@ -117,30 +104,24 @@ def handle_forgot_password(request, engine):
             flash("Email address is required.", "danger")
             return redirect(url_for('forgot_password'))
 
-        if not SENDGRID_KEY:
-            print("SENDGRID_KEY environment variable not set. Cannot send password reset email.")
+        if not email_enabled():
+            print("No email transport configured (SENDGRID_KEY or EMAIL_TRANSPORT). Cannot send password reset email.")
             flash("Email service is not configured. Please contact support.", "danger")
             return redirect(url_for('forgot_password'))
 
         try:
-            with engine.connect() as conn:
+            with connect(engine) as conn:
                 with conn.begin():
-                    user_query = text("SELECT id FROM users WHERE email = :email")
-                    user = conn.execute(user_query, {"email": email}).mappings().first()
+                    user = conn.execute(queries.USER_ID_BY_EMAIL, {"email": email}).mappings().first()
 
                     if user:
                         token = secrets.token_urlsafe(32)
                         expires_at = datetime.utcnow() + timedelta(hours=1)
                         user_id = user.id
 
-                        delete_old_tokens = text("DELETE FROM password_reset_tokens WHERE user_id = :user_id")
-                        conn.execute(delete_old_tokens, {"user_id": user_id})
+                        conn.execute(queries.DELETE_USER_RESET_TOKENS, {"user_id": user_id})
                         
-                        insert_token = text("""
-                            INSERT INTO password_reset_tokens (user_id, token, expires_at)
-                            VALUES (:user_id, :token, :expires_at)
-                        """)
-                        conn.execute(insert_token, {"user_id": user_id, "token": token, "expires_at": expires_at})
+                        token_id = conn.execute(queries.INSERT_RESET_TOKEN, {"user_id": user_id, "token": token, "expires_at": expires_at}).scalar()
 
                         reset_url = url_for('reset_password', token=token, _external=True)
 
@@ -152,20 +133,9 @@ def handle_forgot_password(request, engine):
                         <p>If you did not request this, please ignore this email.</p>
                         """
                         
-                        try:
-                            resend.api_key = SENDGRID_KEY
-                            r = resend.Emails.send({
-                                "from": SENDGRID_EMAIL,
-                                "to": email,
-                                "subject": "Your Password Reset Request",
-                                "html": html_content
-                            })
-                        
-                        except Exception as e:
-                            print(f"Error sending email via Resend: {e}")
-                            flash("Could not send password reset email. Please try again later.", "danger")
-                            return redirect(url_for('forgot_password'))
+                        enqueue_email(conn, f"password-reset-{token_id}", [email], "Your Password Reset Request", html_content)
 
+            notify_outbox()
             flash("If an account with that email exists, a password reset link has been sent.", "info")
             return redirect(url_for('login'))
 
@@ -178,13 +148,9 @@ def handle_forgot_password(request, engine):
 
 def handle_reset_password(request, engine, token):
     try:
-        with engine.connect() as conn:
+        with connect(engine) as conn:
             
-            query = text("""
-                SELECT user_id, expires_at FROM password_reset_tokens
-                WHERE token = :token
-            """)
-            token_data = conn.execute(query, {"token": token}).mappings().first()
+            token_data = conn.execute(queries.RESET_TOKEN, {"token": token}).mappings().first()
 
             if not token_data:
                 flash("Invalid password reset link.", "danger")
@@ -193,8 +159,7 @@ def handle_reset_password(request, engine, token):
             if datetime.utcnow() > token_data.expires_at:
                 flash("Your password reset link has expired. Please request a new one.", "danger")
                 
-                delete_query = text("DELETE FROM password_reset_tokens WHERE token = :token")
-                conn.execute(delete_query, {"token": token})
+                conn.execute(queries.DELETE_RESET_TOKEN, {"token": token})
                 conn.commit()
                 
                 return redirect(url_for('login'))
@@ -213,15 +178,11 @@ def handle_reset_password(request, engine, token):
                     flash("Passwords do not match.", "danger")
                     return render_template('reset_password.html', token=token)
 
-                password_bytes = password.encode('utf-8')
-                salt = bcrypt.gensalt()
-                db_password = bcrypt.hashpw(password_bytes, salt).decode('utf-8')
+                db_password = hash_password(password)
 
-                update_pass_query = text("UPDATE users SET password = :password WHERE id = :user_id")
-                conn.execute(update_pass_query, {"password": db_password, "user_id": user_id})
+                conn.execute(queries.UPDATE_USER_PASSWORD, {"password": db_password, "user_id": user_id})
 
-                delete_token_query = text("DELETE FROM password_reset_tokens WHERE token = :token")
-                conn.execute(delete_token_query, {"token": token})
+                conn.execute(queries.DELETE_RESET_TOKEN, {"token": token})
                 
                 conn.commit()
                 
@@ -230,6 +191,8 @@ def handle_reset_password(request, engine, token):
 
             return render_template('reset_password.html', token=token)
 
+    except PasswordPoolBusy:
+        raise
     except Exception as e:
         print(f"Error during password reset: {e}")
         flash("An error occurred while resetting your password. Please try again.", "danger")
@@ -237,26 +200,14 @@ def handle_reset_password(request, engine, token):
 
 def get_business_profile_data(user_id, engine):
     try:
-        with engine.connect() as conn:
-            user_query = text("""
-                SELECT id, name, bio
-                FROM users
-                WHERE id = :user_id AND role = 1
-            """)
-            business_user = conn.execute(user_query, {"user_id": user_id}).mappings().first()
+        with connect(engine) as conn:
+            business_user = conn.execute(queries.BUSINESS_USER, {"user_id": user_id}).mappings().first()
 
             if not business_user:
                 flash("Business profile not found.", "warning")
                 return None
 
-            projects_query = text("""
-                SELECT p.id, p.name, p.description, p.status, u.name AS business_name
-                FROM projects p
-                JOIN users u ON p.user_id = u.id
-                WHERE p.user_id = :user_id
-                ORDER BY p.id DESC
-            """)
-            projects = conn.execute(projects_query, {"user_id": user_id}).mappings().all()
+            projects = conn.execute(queries.BUSINESS_PROJECTS, {"user_id": user_id}).mappings().all()
 
             return render_template(
                 'business_profile.html',
@@ -279,20 +230,17 @@ def update_profile(engine):
     name = request.form.get('name', '').strip()
 
     try:
-        with engine.connect() as conn:
+        with connect(engine) as conn:
             with conn.begin(): 
-                query_name = text("UPDATE users SET name = :name WHERE id = :user_id")
-                conn.execute(query_name, {"name": name, "user_id": user_id})
+                conn.execute(queries.UPDATE_USER_NAME, {"name": name, "user_id": user_id})
 
                 if user_role == 1: 
                     bio = request.form.get('bio', '').strip()
-                    query_bio = text("UPDATE users SET bio = :bio WHERE id = :user_id")
-                    conn.execute(query_bio, {"bio": bio, "user_id": user_id})
+                    conn.execute(queries.UPDATE_USER_BIO, {"bio": bio, "user_id": user_id})
 
                 elif user_role == 3: 
                     graduation = request.form.get('graduation', '').strip()
-                    query_grad = text("UPDATE users SET graduation = :graduation WHERE id = :user_id")
-                    conn.execute(query_grad, {"graduation": graduation, "user_id": user_id})
+                    conn.execute(queries.UPDATE_USER_GRADUATION, {"graduation": graduation, "user_id": user_id})
 
             flash("Profile updated successfully!", "success")
     except Exception as e:
@@ -305,33 +253,21 @@ def get_profile_data(engine):
     user_role = session.get('role')
     user_id = session.get('user_id')
 
-    with engine.connect() as conn:
-        user_data_query = text("SELECT name, bio FROM users WHERE id = :user_id")
-        user_data = conn.execute(user_data_query, {"user_id": user_id}).mappings().first()
+    with connect(engine) as conn:
+        user_data = conn.execute(queries.PROFILE_USER, {"user_id": user_id}).mappings().first()
 
     if user_role == 3:
-        with engine.connect() as conn:
-            student_query = text("""
-                SELECT s.instructor_id, i.name AS instructor_email, s.graduation
-                FROM users s LEFT JOIN users i ON s.instructor_id = i.id
-                WHERE s.id = :student_id
-            """)
-            student_info = conn.execute(student_query, {"student_id": user_id}).first()
+        with connect(engine) as conn:
+            student_info = conn.execute(queries.PROFILE_STUDENT, {"student_id": user_id}).first()
 
             pending_request = None
             instructors = []
             
             if not student_info.instructor_id:
-                req_query = text("""
-                    SELECT r.id, u.email AS instructor_email
-                    FROM instructor_requests r JOIN users u ON r.instructor_id = u.id
-                    WHERE r.student_id = :student_id AND r.status = 0
-                """)
-                pending_request = conn.execute(req_query, {"student_id": user_id}).first()
+                pending_request = conn.execute(queries.PROFILE_PENDING_REQUESTS, {"student_id": user_id}).first()
 
                 if not pending_request:
-                    inst_query = text("SELECT id, email FROM users WHERE role = 0 ORDER BY email")
-                    instructors = conn.execute(inst_query).all()
+                    instructors = conn.execute(queries.INSTRUCTORS).all()
         
         assignments = get_projects_for_student(engine)
         applications = get_my_applications(user_id, engine)
@@ -344,17 +280,9 @@ def get_profile_data(engine):
                                applications=applications) 
 
     elif user_role == 0:
-        with engine.connect() as conn:
-            approved_projects_query = text("""
-                SELECT p.id, p.name, p.description, p.status, u.name
-                FROM instructor_projects ip
-                JOIN projects p ON ip.project_id = p.id
-                JOIN users u ON p.user_id = u.id
-                WHERE ip.instructor_id = :instructor_id
-                ORDER BY p.id DESC
-            """)
+        with connect(engine) as conn:
             approved_projects = conn.execute(
-                approved_projects_query, 
+                queries.PROFILE_INSTRUCTOR_PROJECTS, 
                 {"instructor_id": user_id}
             ).mappings().all()
         created_projects = get_projects_for_user(engine)
@@ -385,9 +313,8 @@ def create_admin_message(request, engine):
     user_id = session['user_id']
     
     try:
-        with engine.connect() as conn:
-            query = text("INSERT INTO admin_messages (user_id, message) VALUES (:user_id, :message)")
-            conn.execute(query, {"user_id": user_id, "message": message.strip()})
+        with connect(engine) as conn:
+            conn.execute(queries.INSERT_ADMIN_MESSAGE, {"user_id": user_id, "message": message.strip()})
             conn.commit()
             flash("Your message has been sent to the administrators.", "success")
     except Exception as e:
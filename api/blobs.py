@@ -0,0 +1,240 @@
+import os
+import hashlib
+import secrets
+from datetime import datetime
+from urllib.parse import quote
+from flask import current_app, request, abort
+from werkzeug.utils import secure_filename, send_file
+from . import queries
+from .db import connect, write
+
+# Uploaded files are stored once per content. A file is hashed (sha256) while
+# it is streamed to a spool file, then moved to BLOB_DIR/ab/cd/<hash>. Public
+# URLs keep the /uploads/<folder>/... shape, with the first hash characters as
+# a path segment so that two different files with the same name never
+# collide and no directory has to be probed for a free name:
+#
+#   /uploads/<folder>/<hash[:12]>/<filename>
+#
+# blob_names maps each such URL to its blob and counts the references to it
+# (a project, comment, chat message or application that lists the URL);
+# blobs.refcount counts the names pointing at a blob. The same file uploaded
+# again to the same place reuses its name, and the same file anywhere else
+# (a resume sent with several applications) reuses the blob. When the last
+# reference goes, the name and then the blob file are removed.
+#
+# Renames of blob files into place happen inside the write transaction,
+# which holds SQLite's write lock, so they are ordered against every other
+# process's stores and releases. A blob file is unlinked only after the
+# transaction that deleted its row has committed, in a second write job that
+# checks nothing has stored the same content again in between.
+STREAM_BLOCK_BYTES = 64 * 1024
+HASH_PREFIX_LENGTH = 12
+
+# How send_upload hands a file to the client once Flask has decided to serve
+# it. By default the worker sends it. With "x-accel", nginx does: the
+# response carries X-Accel-Redirect to UPLOAD_ACCEL_PREFIX + blobs/... or
+# uploads/..., which nginx must map to BLOB_DIR and UPLOAD_DIR in internal
+# locations. "x-sendfile" does the same for Apache or lighttpd with the
+# absolute file path.
+UPLOAD_OFFLOAD = os.getenv("UPLOAD_OFFLOAD", "").lower()
+UPLOAD_ACCEL_PREFIX = os.getenv("UPLOAD_ACCEL_PREFIX", "/protected/")
+
+def _blob_dir():
+    return current_app.config['BLOB_DIR']
+
+def _blob_path(blob_dir, digest):
+    return os.path.join(blob_dir, digest[:2], digest[2:4], digest)
+
+def upload_path(folder, filename, digest):
+    return f"/uploads/{folder}/{digest[:HASH_PREFIX_LENGTH]}/{secure_filename(filename)}"
+
+# Streams blocks into a new spool file, created with O_EXCL so concurrent
+# uploads never share one. Returns (spool path, sha256 hex digest, size).
+def _spool(blob_dir, read_block):
+    spool_dir = os.path.join(blob_dir, 'tmp')
+    os.makedirs(spool_dir, exist_ok=True)
+    spool_path = os.path.join(spool_dir, secrets.token_hex(16))
+    digest = hashlib.sha256()
+    size = 0
+    fd = os.open(spool_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                block = read_block(STREAM_BLOCK_BYTES)
+                if not block:
+                    break
+                digest.update(block)
+                size += len(block)
+                f.write(block)
+    except Exception:
+        _remove(spool_path)
+        raise
+    return spool_path, digest.hexdigest(), size
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+# Adds one reference to path, creating the name and, with a spool file, the
+# blob. Without one the blob must already exist (a rename).
+def _add_reference(conn, blob_dir, digest, path, spool_path=None, size=None):
+    now = datetime.utcnow()
+    if spool_path:
+        conn.execute(queries.INSERT_BLOB, {"hash": digest, "size": size, "now": now})
+    name = conn.execute(queries.ADD_BLOB_NAME_REF, {"path": path, "hash": digest, "now": now}).one()
+    if name.hash != digest:
+        raise ValueError(f"{path} already names a different file")
+    if name.refs == 1:
+        conn.execute(queries.ADD_BLOB_REF, {"hash": digest})
+
+    if spool_path:
+        target = _blob_path(blob_dir, digest)
+        if os.path.exists(target):
+            _remove(spool_path)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(spool_path, target)
+    return path
+
+def _store(engine, blob_dir, spool_path, digest, size, folder, filename):
+    path = upload_path(folder, filename, digest)
+    try:
+        return write(engine, lambda conn: _add_reference(conn, blob_dir, digest, path, spool_path, size))
+    except Exception:
+        _remove(spool_path)
+        raise
+
+# Stores an uploaded werkzeug FileStorage and returns its URL path.
+def store_upload(engine, file, folder):
+    blob_dir = _blob_dir()
+    spool_path, digest, size = _spool(blob_dir, file.stream.read)
+    return _store(engine, blob_dir, spool_path, digest, size, folder, file.filename)
+
+# Stores a file already on disk (a finished chat upload), consuming it.
+def store_file(engine, source_path, folder, filename):
+    blob_dir = _blob_dir()
+    with open(source_path, 'rb') as f:
+        spool_path, digest, size = _spool(blob_dir, f.read)
+    path = _store(engine, blob_dir, spool_path, digest, size, folder, filename)
+    _remove(source_path)
+    return path
+
+# Adds a name for content that is already referenced by another URL, as a
+# rename does; the caller releases the old URL once nothing lists it. Legacy
+# files from before the blob store are moved into it.
+def rename_upload(engine, old_path, folder, new_filename):
+    blob_dir = _blob_dir()
+    with connect(engine) as conn:
+        name = conn.execute(queries.BLOB_NAME, {"path": old_path}).first()
+
+    if not name:
+        legacy_path = _legacy_file(old_path)
+        if not legacy_path or not os.path.exists(legacy_path):
+            return None
+        return store_file(engine, legacy_path, folder, new_filename)
+
+    new_path = upload_path(folder, new_filename, name.hash)
+    return write(engine, lambda conn: _add_reference(conn, blob_dir, name.hash, new_path))
+
+def _legacy_file(path):
+    if not path or not path.startswith('/uploads/'):
+        return None
+    upload_dir = current_app.config['UPLOAD_DIR']
+    legacy_path = os.path.normpath(os.path.join(upload_dir, path[len('/uploads/'):]))
+    if not legacy_path.startswith(upload_dir + os.sep):
+        return None
+    return legacy_path
+
+# Returns the paths that are not in the store and the hashes of the blobs
+# whose last reference went.
+def _drop_references(conn, paths):
+    unknown, deleted = [], []
+    for path in paths:
+        name = conn.execute(queries.DROP_BLOB_NAME_REF, {"path": path}).first()
+        if not name:
+            unknown.append(path)
+            continue
+        if name.refs > 0:
+            continue
+        conn.execute(queries.DELETE_BLOB_NAME, {"path": path})
+        blob = conn.execute(queries.DROP_BLOB_REF, {"hash": name.hash}).first()
+        if blob and blob.refcount <= 0:
+            conn.execute(queries.DELETE_BLOB, {"hash": name.hash})
+            deleted.append(name.hash)
+    return unknown, deleted
+
+def _unlink_deleted_blobs(conn, blob_dir, hashes):
+    for digest in hashes:
+        if not conn.execute(queries.BLOB_EXISTS, {"hash": digest}).first():
+            _remove(_blob_path(blob_dir, digest))
+
+# Drops one reference to each URL path. Paths that are not in the blob
+# store are files saved before it existed and are deleted directly.
+def release_uploads(engine, paths):
+    paths = [path for path in paths if path]
+    if not paths:
+        return
+    blob_dir = _blob_dir()
+    try:
+        unknown, deleted = write(engine, lambda conn: _drop_references(conn, paths))
+    except Exception as e:
+        print(f"Error releasing uploads {paths}: {e}")
+        return
+    if deleted:
+        try:
+            write(engine, lambda conn: _unlink_deleted_blobs(conn, blob_dir, deleted))
+        except Exception as e:
+            print(f"Error removing blob files {deleted}: {e}")
+    for path in unknown:
+        legacy_path = _legacy_file(path)
+        if legacy_path:
+            _remove(legacy_path)
+
+# Responds with the file behind a URL path. A blob's ETag is its sha256, so
+# it is strong and stays valid across renames, workers and restores; legacy
+# files get werkzeug's mtime/size tag. Conditional requests get a 304 and
+# Range requests a 206 without reading the rest of the file. Responses are
+# private and revalidated, so every request still passes through Flask.
+def send_upload(engine, path):
+    with connect(engine) as conn:
+        name = conn.execute(queries.BLOB_NAME, {"path": path}).first()
+    if name:
+        blob_dir = _blob_dir()
+        file_path = _blob_path(blob_dir, name.hash)
+        accel_path = "blobs/" + os.path.relpath(file_path, blob_dir).replace(os.sep, "/")
+        etag = name.hash
+    else:
+        file_path = _legacy_file(path)
+        if not file_path:
+            abort(404)
+        accel_path = "uploads/" + os.path.relpath(file_path, current_app.config['UPLOAD_DIR']).replace(os.sep, "/")
+        etag = True
+    if not os.path.isfile(file_path):
+        abort(404)
+
+    offload = UPLOAD_OFFLOAD in ("x-accel", "x-sendfile")
+    response = send_file(
+        file_path,
+        request.environ,
+        download_name=path.rsplit('/', 1)[-1],
+        etag=etag,
+        conditional=not offload,
+        use_x_sendfile=offload,
+        response_class=current_app.response_class,
+    )
+    response.cache_control.private = True
+
+    if offload:
+        # The front end serves the bytes and answers Range itself; Flask only
+        # answers If-None-Match / If-Modified-Since.
+        response = response.make_conditional(request.environ)
+        if response.status_code == 304:
+            response.headers.pop("X-Sendfile", None)
+        elif UPLOAD_OFFLOAD == "x-accel":
+            response.headers.pop("X-Sendfile", None)
+            response.headers.pop("Content-Length", None)
+            response.headers["X-Accel-Redirect"] = quote(UPLOAD_ACCEL_PREFIX + accel_path)
+    return response
@@ -1,10 +1,25 @@
-import os
-import base64
-from flask import session, current_app
+from flask import session
 from flask_socketio import emit, join_room
-from sqlalchemy import text
-from .projects import check_if_user_can_chat, get_project_by_id, _get_upload_paths
-from .job import check_if_user_can_chat_application, _get_application_upload_path
+from . import queries
+from .db import connect, write
+from .acl import chat_access
+from .projects import check_if_user_can_chat, get_project_by_id, _upload_folder
+from .job import check_if_user_can_chat_application, _application_upload_folder
+from .history import history_page, parse_before, format_timestamp
+from .uploads import claim_chat_upload, discard_claimed_upload
+from .blobs import store_file, release_uploads
+
+def get_chat_history(kind, room_id, user_id, before, limit, engine):
+    if not chat_access(kind, user_id, room_id, engine):
+        return None
+
+    try:
+        with connect(engine) as conn:
+            messages, has_more = history_page(conn, kind, room_id, parse_before(before), limit)
+    except Exception as e:
+        print(f"Error fetching {kind} chat history: {e}")
+        return None
+    return {"messages": messages, "has_more": has_more}
 
 def init_chat(socketio, engine):
     @socketio.on('join')
@@ -17,6 +32,14 @@ def init_chat(socketio, engine):
             room = f'project-{project_id}'
             join_room(room)
 
+    @socketio.on('history_before')
+    def on_history_before(data):
+        project_id = data.get('project_id')
+        user_id = session.get('user_id')
+        if not project_id or not user_id:
+            return None
+        return get_chat_history('project', project_id, user_id, data.get('before'), data.get('limit'), engine)
+
     @socketio.on('new_message')
     def on_new_message(data):
         project_id = data.get('project_id')
@@ -24,66 +47,54 @@ def init_chat(socketio, engine):
         user_id = session.get('user_id')
         email = session.get('email')
         
-        file_data = data.get('file')
-        original_filename = data.get('filename')
+        upload_id = data.get('upload_id')
 
         if not all([project_id, user_id, email]):
             return
-        if not message_text and not file_data:
+        if not message_text and not upload_id:
             return 
         if not check_if_user_can_chat(user_id, project_id, engine):
             return
 
         attachment_path = None
 
-        if file_data and original_filename:
+        if upload_id:
+            claimed = None
             try:
                 project = get_project_by_id(project_id, engine)
                 if not project:
                     return
-                
-                with current_app.app_context(): 
-                    fs_save_path, url_path = _get_upload_paths(project.name, original_filename)
-                
-                if ',' in file_data:
-                    file_content = base64.b64decode(file_data.split(',')[1])
-                else:
-                    file_content = base64.b64decode(file_data)
-                
-                with open(fs_save_path, 'wb') as f:
-                    f.write(file_content)
-                
-                attachment_path = url_path
+
+                claimed = claim_chat_upload(upload_id, user_id, 'project', project_id, engine)
+                if not claimed:
+                    return
+                partial_path, original_filename = claimed
+
+                attachment_path = store_file(engine, partial_path, _upload_folder(project.name), original_filename)
             except Exception as e:
                 print(f"Error saving chat file: {e}")
+                discard_claimed_upload(claimed)
+                return
 
         try:
-            with engine.connect() as conn:
-                with conn.begin():
-                    query = text("""
-                        INSERT INTO chat_messages (project_id, user_id, message_text, attachment_path)
-                        VALUES (:project_id, :user_id, :message_text, :attachment_path)
-                    """)
-                    result = conn.execute(query, {
-                        "project_id": project_id,
-                        "user_id": user_id,
-                        "message_text": message_text,
-                        "attachment_path": attachment_path
-                    })
-                    
-                    last_id = result.lastrowid
-                    ts_query = text("SELECT timestamp FROM chat_messages WHERE id = :id")
-                    timestamp = conn.execute(ts_query, {"id": last_id}).scalar_one()
-
-                room = f'project-{project_id}'
-                emit('message_broadcast', {
-                    'message_id': last_id,
-                    'email': email,
-                    'message': message_text,
-                    'attachment_path': attachment_path,
-                    'timestamp': timestamp.strftime('%b %d, %Y %I:%M %p')
-                }, to=room)
+            params = {
+                "project_id": project_id,
+                "user_id": user_id,
+                "message_text": message_text,
+                "attachment_path": attachment_path
+            }
+            last_id, timestamp = write(engine, lambda conn: conn.execute(queries.INSERT_CHAT_MESSAGE, params).one())
+
+            room = f'project-{project_id}'
+            emit('message_broadcast', {
+                'message_id': last_id,
+                'email': email,
+                'message': message_text,
+                'attachment_path': attachment_path,
+                'timestamp': format_timestamp(timestamp)
+            }, to=room)
         except Exception as e:
+            release_uploads(engine, [attachment_path])
             print(f"Error saving chat message to DB: {e}")
 
     @socketio.on('delete_message')
@@ -93,29 +104,21 @@ def init_chat(socketio, engine):
         if not message_id or not user_id:
             return
 
+        def delete_own_message(conn):
+            message = conn.execute(queries.CHAT_MESSAGE, {"id": message_id}).first()
+            if not message or message.user_id != user_id:
+                return None
+            conn.execute(queries.DELETE_CHAT_MESSAGE, {"id": message_id})
+            return message
+
         try:
-            with engine.connect() as conn:
-                with conn.begin():
-                    msg_query = text("SELECT user_id, project_id, attachment_path FROM chat_messages WHERE id = :id")
-                    message = conn.execute(msg_query, {"id": message_id}).first()
-
-                    if message and message.user_id == user_id:
-                        if message.attachment_path:
-                            try:
-                                base_upload_dir = current_app.config['UPLOAD_DIR']
-                                if '/uploads/' in message.attachment_path:
-                                    relative_path = message.attachment_path.split('/uploads/', 1)[-1]
-                                    file_path = os.path.join(base_upload_dir, relative_path)
-                                    if os.path.exists(file_path):
-                                        os.remove(file_path)
-                            except Exception as e:
-                                print(f"Error deleting file: {e}")
-                                
-                        delete_query = text("DELETE FROM chat_messages WHERE id = :id")
-                        conn.execute(delete_query, {"id": message_id})
-
-                        room = f'project-{message.project_id}'
-                        emit('message_deleted', {'message_id': message_id}, to=room)
+            message = write(engine, delete_own_message)
+            if not message:
+                return
+
+            release_uploads(engine, [message.attachment_path])
+            room = f'project-{message.project_id}'
+            emit('message_deleted', {'message_id': message_id}, to=room)
         except Exception as e:
             print(f"Error deleting message: {e}")
 
@@ -131,6 +134,14 @@ def init_application_chat(socketio, engine):
             room = f'application-{application_id}'
             join_room(room)
 
+    @socketio.on('application_history_before')
+    def on_application_history_before(data):
+        application_id = data.get('application_id')
+        user_id = session.get('user_id')
+        if not application_id or not user_id:
+            return None
+        return get_chat_history('application', application_id, user_id, data.get('before'), data.get('limit'), engine)
+
     @socketio.on('new_application_message')
     def on_new_application_message(data):
         application_id = data.get('application_id')
@@ -138,13 +149,12 @@ def init_application_chat(socketio, engine):
         user_id = session.get('user_id')
         email = session.get('email')
         
-        file_data = data.get('file')
-        original_filename = data.get('filename')
+        upload_id = data.get('upload_id')
         
         if not all([application_id, user_id, email]):
             return
         
-        if not message_text and not file_data:
+        if not message_text and not upload_id:
             return
 
         if not check_if_user_can_chat_application(user_id, application_id, engine):
@@ -152,54 +162,43 @@ def init_application_chat(socketio, engine):
 
         attachment_path = None 
         
-        if file_data and original_filename:
+        if upload_id:
+            claimed = None
             try:
-                with current_app.app_context():
-                    with engine.connect() as conn:
-                        res = conn.execute(text("SELECT job_id FROM job_applications WHERE id = :id"), {"id": application_id}).first()
-                        job_id = res.job_id if res else 0
-
-                    fs_save_path, url_path = _get_application_upload_path(job_id, user_id, original_filename)
-                    
-                    if ',' in file_data:
-                        file_content = base64.b64decode(file_data.split(',')[1])
-                    else:
-                        file_content = base64.b64decode(file_data)
-                        
-                    with open(fs_save_path, 'wb') as f:
-                        f.write(file_content)
-                    
-                    attachment_path = url_path
+                claimed = claim_chat_upload(upload_id, user_id, 'application', application_id, engine)
+                if not claimed:
+                    return
+                partial_path, original_filename = claimed
+
+                with connect(engine) as conn:
+                    res = conn.execute(queries.APPLICATION_JOB_ID, {"id": application_id}).first()
+                    job_id = res.job_id if res else 0
+
+                attachment_path = store_file(engine, partial_path, _application_upload_folder(job_id, user_id), original_filename)
             except Exception as e:
                 print(f"Error saving application chat file: {e}")
+                discard_claimed_upload(claimed)
+                return
 
         try:
-            with engine.connect() as conn:
-                with conn.begin():
-                    query = text("""
-                        INSERT INTO application_messages (application_id, user_id, message_text, attachment_path)
-                        VALUES (:application_id, :user_id, :message_text, :attachment_path)
-                    """)
-                    result = conn.execute(query, {
-                        "application_id": application_id,
-                        "user_id": user_id,
-                        "message_text": message_text,
-                        "attachment_path": attachment_path
-                    })
-                    
-                    last_id = result.lastrowid
-                    ts_query = text("SELECT timestamp FROM application_messages WHERE id = :id")
-                    timestamp = conn.execute(ts_query, {"id": last_id}).scalar_one()
-
-                room = f'application-{application_id}'
-                emit('application_message_broadcast', {
-                    'message_id': last_id,
-                    'email': email,
-                    'message': message_text,
-                    'attachment_path': attachment_path,
-                    'timestamp': timestamp.strftime('%b %d, %Y %I:%M %p')
-                }, to=room)
+            params = {
+                "application_id": application_id,
+                "user_id": user_id,
+                "message_text": message_text,
+                "attachment_path": attachment_path
+            }
+            last_id, timestamp = write(engine, lambda conn: conn.execute(queries.INSERT_APPLICATION_MESSAGE, params).one())
+
+            room = f'application-{application_id}'
+            emit('application_message_broadcast', {
+                'message_id': last_id,
+                'email': email,
+                'message': message_text,
+                'attachment_path': attachment_path,
+                'timestamp': format_timestamp(timestamp)
+            }, to=room)
         except Exception as e:
+            release_uploads(engine, [attachment_path])
             print(f"Error saving application chat message: {e}")
 
     @socketio.on('delete_application_message')
@@ -209,28 +208,20 @@ def init_application_chat(socketio, engine):
         if not message_id or not user_id:
             return
 
+        def delete_own_message(conn):
+            message = conn.execute(queries.APPLICATION_MESSAGE, {"id": message_id}).first()
+            if not message or message.user_id != user_id:
+                return None
+            conn.execute(queries.DELETE_APPLICATION_MESSAGE, {"id": message_id})
+            return message
+
         try:
-            with engine.connect() as conn:
-                with conn.begin():
-                    msg_query = text("SELECT user_id, application_id, attachment_path FROM application_messages WHERE id = :id")
-                    message = conn.execute(msg_query, {"id": message_id}).first()
-
-                    if message and message.user_id == user_id:
-                        if message.attachment_path:
-                            try:
-                                base_upload_dir = current_app.config['UPLOAD_DIR']
-                                if '/uploads/' in message.attachment_path:
-                                    relative_path = message.attachment_path.split('/uploads/', 1)[-1]
-                                    file_path = os.path.join(base_upload_dir, relative_path)
-                                    if os.path.exists(file_path):
-                                        os.remove(file_path)
-                            except Exception as e:
-                                print(f"Error deleting file: {e}")
-
-                        delete_query = text("DELETE FROM application_messages WHERE id = :id")
-                        conn.execute(delete_query, {"id": message_id})
-
-                        room = f'application-{message.application_id}'
-                        emit('application_message_deleted', {'message_id': message_id}, to=room)
+            message = write(engine, delete_own_message)
+            if not message:
+                return
+
+            release_uploads(engine, [message.attachment_path])
+            room = f'application-{message.application_id}'
+            emit('application_message_deleted', {'message_id': message_id}, to=room)
         except Exception as e:
             print(f"Error deleting application message: {e}")
@@ -0,0 +1,216 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from flask import g, has_app_context
+from sqlalchemy import event
+
+# Per-connection SQLite tuning. DB_PRAGMA_PROFILE picks a profile and the
+# individual DB_* variables override single values from it.
+SQLITE_PROFILES = {
+    "default": {
+        "foreign_keys": "ON",
+    },
+    "wal": {
+        "foreign_keys": "ON",
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "mmap_size": 268435456,
+        "cache_size": -16000,
+        "temp_store": "MEMORY",
+    },
+}
+
+PRAGMA_ENV_OVERRIDES = {
+    "journal_mode": "DB_JOURNAL_MODE",
+    "synchronous": "DB_SYNCHRONOUS",
+    "busy_timeout": "DB_BUSY_TIMEOUT_MS",
+    "mmap_size": "DB_MMAP_SIZE",
+    "cache_size": "DB_CACHE_SIZE",
+    "temp_store": "DB_TEMP_STORE",
+}
+
+def get_sqlite_pragmas():
+    profile_name = os.getenv("DB_PRAGMA_PROFILE", "wal")
+    if profile_name not in SQLITE_PROFILES:
+        print(f"Unknown DB_PRAGMA_PROFILE '{profile_name}', falling back to 'default'.")
+        profile_name = "default"
+
+    pragmas = dict(SQLITE_PROFILES[profile_name])
+    for pragma, env_name in PRAGMA_ENV_OVERRIDES.items():
+        value = os.getenv(env_name)
+        if value:
+            pragmas[pragma] = value
+    return pragmas
+
+def configure_sqlite(engine):
+    if engine.dialect.name != "sqlite":
+        return
+
+    pragmas = get_sqlite_pragmas()
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragma(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in pragmas.items():
+            cursor.execute(f"PRAGMA {pragma}={value}")
+        cursor.close()
+
+def run_maintenance(engine):
+    with engine.connect() as conn:
+        conn.exec_driver_sql("PRAGMA optimize")
+        if get_sqlite_pragmas().get("journal_mode", "").upper() == "WAL":
+            conn.exec_driver_sql("PRAGMA wal_checkpoint(PASSIVE)")
+
+def start_maintenance(engine):
+    if engine.dialect.name != "sqlite":
+        return None
+
+    interval = int(os.getenv("DB_MAINTENANCE_INTERVAL", "300"))
+    if interval <= 0:
+        return None
+
+    def maintenance_loop():
+        while True:
+            time.sleep(interval)
+            try:
+                run_maintenance(engine)
+            except Exception as e:
+                print(f"Database maintenance failed: {e}")
+
+    thread = threading.Thread(target=maintenance_loop, name="db-maintenance", daemon=True)
+    thread.start()
+    return thread
+
+# Request-scoped reads. Inside an app context (an HTTP request, or one
+# Socket.IO event, which Flask-SocketIO runs in its own request context)
+# every connect(engine) block shares one pooled connection, kept on flask.g
+# until close_request_connections runs at teardown. The outermost block
+# still ends its transaction on the way out, as closing the connection used
+# to, so no snapshot is held between helpers. A block nested inside one that
+# is mid-transaction gets a connection of its own, so its conn.begin() can't
+# collide with the enclosing one. Outside an app context (threads, CLI) it
+# is plain engine.connect().
+@contextmanager
+def connect(engine):
+    if not has_app_context():
+        with engine.connect() as conn:
+            yield conn
+        return
+
+    scopes = g.setdefault('db_connections', {})
+    scope = scopes.get(engine)
+    if scope is None:
+        scope = scopes[engine] = {"conn": engine.connect(), "depth": 0}
+    elif scope["depth"] and scope["conn"].in_transaction():
+        with engine.connect() as conn:
+            yield conn
+        return
+
+    conn = scope["conn"]
+    scope["depth"] += 1
+    try:
+        yield conn
+    finally:
+        scope["depth"] -= 1
+        if not scope["depth"] and conn.in_transaction():
+            conn.rollback()
+
+def close_request_connections(exception=None):
+    for scope in g.pop('db_connections', {}).values():
+        try:
+            scope["conn"].close()
+        except Exception as e:
+            print(f"Error closing request connection: {e}")
+
+def init_request_connections(app):
+    app.teardown_appcontext(close_request_connections)
+
+# All writes that go through write()/submit_write() are executed by a single
+# thread per process on its own connection. Jobs that arrive together are run
+# in one transaction (each inside a SAVEPOINT, so one failing job does not
+# undo the others) and committed with a single fsync.
+class WriteQueue:
+    def __init__(self, engine, max_batch=64, batch_window=0.002):
+        self.engine = engine
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.jobs = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, fn):
+        future = Future()
+        self.jobs.put((fn, future))
+        return future
+
+    def depth(self):
+        return self.jobs.qsize()
+
+    def _next_batch(self):
+        batch = [self.jobs.get()]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self.jobs.get(timeout=max(0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                with self.engine.connect() as conn:
+                    self._run_batch(conn, batch)
+            except Exception as e:
+                print(f"Database writer failed: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _run_batch(self, conn, batch):
+        outcomes = []
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        for fn, future in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                with conn.begin_nested():
+                    outcomes.append((future, fn(conn), None))
+            except Exception as e:
+                outcomes.append((future, None, e))
+        conn.commit()
+
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+_write_queues = {}
+_write_queues_lock = threading.Lock()
+
+def get_write_queue(engine):
+    key = (id(engine), os.getpid())
+    write_queue = _write_queues.get(key)
+    if write_queue is None:
+        with _write_queues_lock:
+            write_queue = _write_queues.get(key)
+            if write_queue is None:
+                write_queue = WriteQueue(
+                    engine,
+                    max_batch=int(os.getenv("DB_WRITE_BATCH_SIZE", "64")),
+                    batch_window=int(os.getenv("DB_WRITE_BATCH_WINDOW_MS", "2")) / 1000,
+                )
+                _write_queues[key] = write_queue
+    return write_queue
+
+def submit_write(engine, fn):
+    return get_write_queue(engine).submit(fn)
+
+def write(engine, fn):
+    return submit_write(engine, fn).result()
@@ -0,0 +1,59 @@
+import os
+from . import queries
+
+# Chat rooms render only their newest page; older messages are fetched on
+# scroll with history_before, keyed on the message id (ids only grow, so
+# "id < before" pages never skip or repeat a message while people keep
+# posting). Pages are read newest-first off the (room, id) index and flipped
+# so callers always get them oldest-first.
+CHAT_PAGE_SIZE = int(os.getenv("CHAT_PAGE_SIZE", "50"))
+CHAT_PAGE_MAX = 200
+
+TIMESTAMP_FORMAT = '%b %d, %Y %I:%M %p'
+
+ROOMS = {
+    'project': (queries.PROJECT_CHAT_LATEST, queries.PROJECT_CHAT_BEFORE),
+    'application': (queries.APPLICATION_CHAT_LATEST, queries.APPLICATION_CHAT_BEFORE),
+}
+
+def page_size(limit):
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return CHAT_PAGE_SIZE
+    return min(max(limit, 1), CHAT_PAGE_MAX)
+
+def parse_before(before):
+    try:
+        before = int(before)
+    except (TypeError, ValueError):
+        return None
+    return before if before > 0 else None
+
+def format_timestamp(timestamp):
+    return timestamp.strftime(TIMESTAMP_FORMAT) if timestamp else ''
+
+# Same shape as the message_broadcast payloads, so the page and the socket
+# render history and live messages with the same code.
+def serialize_message(row):
+    return {
+        'message_id': row['message_id'],
+        'email': row['email'],
+        'message': row['message_text'],
+        'attachment_path': row['attachment_path'],
+        'timestamp': format_timestamp(row['timestamp']),
+    }
+
+def history_page(conn, kind, room_id, before=None, limit=None):
+    limit = page_size(limit)
+    latest, older = ROOMS[kind]
+    params = {"room_id": room_id, "limit": limit + 1}
+    if before:
+        params["before"] = before
+        rows = conn.execute(older, params).mappings().all()
+    else:
+        rows = conn.execute(latest, params).mappings().all()
+
+    has_more = len(rows) > limit
+    messages = [serialize_message(row) for row in reversed(rows[:limit])]
+    return messages, has_more
@@ -1,5 +1,7 @@
 from flask import request, redirect, url_for, flash, session
-from sqlalchemy import text
+from . import queries
+from .db import write
+from .acl import invalidate_user
 
 def send_instructor_request(engine):
     if 'user_id' not in session or session.get('role') != 3:
@@ -13,23 +15,20 @@ def send_instructor_request(engine):
         flash("You must select an instructor.", "warning")
         return redirect(url_for('profile'))
 
+    # Returns the message to show, and its category.
+    def send_request(conn):
+        user_result = conn.execute(queries.STUDENT_INSTRUCTOR, {"student_id": student_id}).first()
+        if user_result and user_result.instructor_id:
+            return "You are already assigned to an instructor.", "info"
+
+        if conn.execute(queries.PENDING_INSTRUCTOR_REQUEST, {"student_id": student_id}).first():
+            return "You already have a pending request.", "info"
+        
+        conn.execute(queries.INSERT_INSTRUCTOR_REQUEST, {"student_id": student_id, "instructor_id": instructor_id})
+        return "Your request has been sent successfully!", "success"
+
     try:
-        with engine.connect() as conn:
-            user_check_query = text("SELECT instructor_id FROM users WHERE id = :student_id")
-            user_result = conn.execute(user_check_query, {"student_id": student_id}).first()
-            if user_result and user_result.instructor_id:
-                flash("You are already assigned to an instructor.", "info")
-                return redirect(url_for('profile'))
-
-            request_check_query = text("SELECT id FROM instructor_requests WHERE student_id = :student_id AND status = 0")
-            if conn.execute(request_check_query, {"student_id": student_id}).first():
-                flash("You already have a pending request.", "info")
-                return redirect(url_for('profile'))
-            
-            query = text("INSERT INTO instructor_requests (student_id, instructor_id) VALUES (:student_id, :instructor_id)")
-            conn.execute(query, {"student_id": student_id, "instructor_id": instructor_id})
-            conn.commit()
-            flash("Your request has been sent successfully!", "success")
+        flash(*write(engine, send_request))
 
     except Exception as e:
         flash(f"An error occurred: {e}", "danger")
@@ -44,11 +43,8 @@ def cancel_instructor_request(engine):
 
     student_id = session['user_id']
     try:
-        with engine.connect() as conn:
-            query = text("DELETE FROM instructor_requests WHERE student_id = :student_id AND status = 0")
-            conn.execute(query, {"student_id": student_id})
-            conn.commit()
-            flash("Your request has been canceled.", "info")
+        write(engine, lambda conn: conn.execute(queries.CANCEL_INSTRUCTOR_REQUEST, {"student_id": student_id}))
+        flash("Your request has been canceled.", "info")
     except Exception as e:
         flash(f"An error occurred: {e}", "danger")
 
@@ -63,36 +59,46 @@ def handle_instructor_request(request_id, engine):
     action = request.form.get('action')
     instructor_id = session['user_id']
 
+    # Returns (student id, their previous instructor id), or None if the
+    # request is not open.
+    def handle_request(conn):
+        req_result = conn.execute(queries.OPEN_INSTRUCTOR_REQUEST, {"request_id": request_id, "instructor_id": instructor_id}).first()
+
+        if not req_result:
+            return None
+        
+        student_id = req_result.student_id
+        previous_instructor_id = None
+
+        if action == 'accept':
+            previous_instructor_id = conn.execute(queries.STUDENT_INSTRUCTOR, {"student_id": student_id}).scalar()
+
+            conn.execute(queries.UPDATE_STUDENT_INSTRUCTOR, {"instructor_id": instructor_id, "student_id": student_id})
+
+            conn.execute(queries.ACCEPT_INSTRUCTOR_REQUEST, {"request_id": request_id})
+        
+        elif action == 'deny':
+            conn.execute(queries.DENY_INSTRUCTOR_REQUEST, {"request_id": request_id})
+        return student_id, previous_instructor_id
+
     try:
-        with engine.connect() as conn:
-            with conn.begin():
-                req_query = text("""
-                    SELECT student_id FROM instructor_requests 
-                    WHERE id = :request_id 
-                    AND instructor_id = :instructor_id 
-                    AND status IN (0, 2)
-                """)
-                req_result = conn.execute(req_query, {"request_id": request_id, "instructor_id": instructor_id}).first()
-
-                if not req_result:
-                    flash("Request not found or already handled.", "warning")
-                    return redirect(url_for('user_mgt'))
-                
-                student_id = req_result.student_id
-
-                if action == 'accept':
-                    update_user_query = text("UPDATE users SET instructor_id = :instructor_id WHERE id = :student_id")
-                    conn.execute(update_user_query, {"instructor_id": instructor_id, "student_id": student_id})
-
-                    update_req_query = text("UPDATE instructor_requests SET status = 1 WHERE id = :request_id")
-                    conn.execute(update_req_query, {"request_id": request_id})
-
-                    flash("Student request accepted.", "success")
-                
-                elif action == 'deny':
-                    update_req_query = text("UPDATE instructor_requests SET status = 2 WHERE id = :request_id")
-                    conn.execute(update_req_query, {"request_id": request_id})
-                    flash("Student request denied.", "info")
+        handled = write(engine, handle_request)
+        if not handled:
+            flash("Request not found or already handled.", "warning")
+            return redirect(url_for('user_mgt'))
+        student_id, previous_instructor_id = handled
+
+        if action == 'accept':
+            flash("Student request accepted.", "success")
+        elif action == 'deny':
+            flash("Student request denied.", "info")
+
+        # Changing a student's instructor moves which project rooms both
+        # instructors may see.
+        if action == 'accept':
+            invalidate_user(student_id)
+            invalidate_user(previous_instructor_id)
+            invalidate_user(instructor_id)
 
     except Exception as e:
         flash(f"An error occurred: {e}", "danger")
@@ -107,23 +113,16 @@ def dismiss_denied_request(request_id, engine):
     instructor_id = session['user_id']
     
     try:
-        with engine.connect() as conn:
-            query = text("""
-                DELETE FROM instructor_requests 
-                WHERE id = :request_id 
-                AND instructor_id = :instructor_id 
-                AND status = 2
-            """)
-            result = conn.execute(query, {
-                "request_id": request_id, 
-                "instructor_id": instructor_id
-            })
-            conn.commit()
-            
-            if result.rowcount > 0:
-                flash("Denied request has been dismissed.", "info")
-            else:
-                flash("Request not found or permission denied.", "warning")
+        params = {
+            "request_id": request_id, 
+            "instructor_id": instructor_id
+        }
+        dismissed = write(engine, lambda conn: conn.execute(queries.DISMISS_DENIED_REQUEST, params).rowcount)
+        
+        if dismissed > 0:
+            flash("Denied request has been dismissed.", "info")
+        else:
+            flash("Request not found or permission denied.", "warning")
 
     except Exception as e:
         flash(f"An error occurred: {e}", "danger")
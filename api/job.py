@@ -1,28 +1,12 @@
-import os
-from sqlalchemy import text
-from flask import flash, redirect, url_for, session, render_template, current_app
-from werkzeug.utils import secure_filename
-
-def _get_application_upload_path(job_id, user_id, original_filename):
-    safe_filename = secure_filename(original_filename)
-    path_segment = f"job_{job_id}/user_{user_id}"
-    base_upload_dir = current_app.config['UPLOAD_DIR']
-    fs_upload_dir = os.path.join(base_upload_dir, 'applications', path_segment)
-    os.makedirs(fs_upload_dir, exist_ok=True)
-    fs_save_path = os.path.join(fs_upload_dir, safe_filename)
-    if os.path.exists(fs_save_path):
-        filename_base, extension = os.path.splitext(safe_filename)
-        counter = 1
-        while True:
-            new_filename = f"{filename_base}({counter}){extension}"
-            new_fs_save_path = os.path.join(fs_upload_dir, new_filename)
-            if not os.path.exists(new_fs_save_path):
-                fs_save_path = new_fs_save_path
-                safe_filename = new_filename
-                break
-            counter += 1
-    url_path = f"/uploads/applications/{path_segment}/{safe_filename}"
-    return (fs_save_path, url_path)
+from . import queries
+from .db import connect, write
+from flask import flash, redirect, url_for, session, render_template
+from .acl import application_access
+from .history import history_page
+from .blobs import store_upload, release_uploads
+
+def _application_upload_folder(job_id, user_id):
+    return f"applications/job_{job_id}/user_{user_id}"
 
 def create_job(request, engine):
     if 'user_id' not in session:
@@ -48,10 +32,7 @@ def create_job(request, engine):
             link = 'https://' + link
 
     try:
-        with engine.connect() as connection:
-            insert_query = text(
-                "INSERT INTO jobs (user_id, title, description, link, status) VALUES (:user_id, :title, :description, :link, :status)"
-            )
+        with connect(engine) as connection:
             params = {
                 "user_id": user_id,
                 "title": title,
@@ -59,7 +40,7 @@ def create_job(request, engine):
                 "link": link,
                 "status": 0 
             }
-            connection.execute(insert_query, params)
+            connection.execute(queries.INSERT_JOB, params)
             connection.commit()
             flash("New job created successfully!", "success")
     except Exception as e:
@@ -69,16 +50,8 @@ def create_job(request, engine):
 
 def get_job_by_id(job_id, engine):
     try:
-        with engine.connect() as connection:
-            query = text("""
-                SELECT 
-                    j.id, j.title, j.description, j.link, j.status, j.user_id,
-                    u.name AS user_name, u.email
-                FROM jobs j
-                JOIN users u ON j.user_id = u.id
-                WHERE j.id = :job_id
-            """)
-            result = connection.execute(query, {"job_id": job_id}).mappings().first()
+        with connect(engine) as connection:
+            result = connection.execute(queries.JOB_BY_ID, {"job_id": job_id}).mappings().first()
             return result
     except Exception as e:
         print(f"Database error fetching job by ID: {e}")
@@ -108,10 +81,7 @@ def update_job(job_id, request, engine):
         return redirect(url_for('job_page', job_id=job_id))
 
     try:
-        with engine.connect() as connection:
-            update_query = text(
-                "UPDATE jobs SET title = :title, description = :description, link = :link, status = :status WHERE id = :job_id"
-            )
+        with connect(engine) as connection:
             params = {
                 "title": new_title,
                 "description": new_description,
@@ -119,7 +89,7 @@ def update_job(job_id, request, engine):
                 "status": new_status,
                 "job_id": job_id
             }
-            connection.execute(update_query, params)
+            connection.execute(queries.UPDATE_JOB, params)
             connection.commit()
             flash("Job updated successfully!", "success")
     except Exception as e:
@@ -137,12 +107,17 @@ def delete_job(job_id, engine):
         flash("You do not have permission to delete this job.", "danger")
         return redirect(url_for('job_page', job_id=job_id))
 
+    user_id = session['user_id']
+
+    def delete(conn):
+        paths = conn.execute(queries.JOB_UPLOAD_PATHS, {"job_id": job_id}).scalars().all()
+        if conn.execute(queries.DELETE_JOB, {"job_id": job_id, "user_id": user_id}).rowcount == 0:
+            return []
+        return paths
+
     try:
-        with engine.connect() as connection:
-            delete_query = text("DELETE FROM jobs WHERE id = :job_id AND user_id = :user_id")
-            connection.execute(delete_query, {"job_id": job_id, "user_id": session['user_id']})
-            connection.commit()
-            flash("Job deleted successfully.", "success")
+        release_uploads(engine, write(engine, delete))
+        flash("Job deleted successfully.", "success")
     except Exception as e:
         flash(f"An error occurred: {e}", "danger")
         return redirect(url_for('job_page', job_id=job_id))
@@ -151,17 +126,8 @@ def delete_job(job_id, engine):
 
 def get_open_jobs(engine):
     try:
-        with engine.connect() as connection:
-            query = text("""
-                SELECT 
-                    j.id, j.title, j.description, j.status, j.user_id,
-                    u.name AS user_name
-                FROM jobs j
-                JOIN users u ON j.user_id = u.id
-                WHERE j.status = 1
-                ORDER BY j.created_at DESC
-            """)
-            result = connection.execute(query).mappings().all()
+        with connect(engine) as connection:
+            result = connection.execute(queries.OPEN_JOBS).mappings().all()
             return result
     except Exception as e:
         print(f"Database error fetching open jobs: {e}")
@@ -169,26 +135,14 @@ def get_open_jobs(engine):
 
 def get_business_jobs_data(user_id, engine):
     try:
-        with engine.connect() as conn:
-            user_query = text("""
-                SELECT id, name, bio
-                FROM users
-                WHERE id = :user_id AND role = 1
-            """)
-            business_user = conn.execute(user_query, {"user_id": user_id}).mappings().first()
+        with connect(engine) as conn:
+            business_user = conn.execute(queries.BUSINESS_USER, {"user_id": user_id}).mappings().first()
 
             if not business_user:
                 flash("Business profile not found.", "warning")
                 return None
 
-            jobs_query = text("""
-                SELECT j.id, j.title, j.description, j.status, j.user_id, u.name AS user_name
-                FROM jobs j
-                JOIN users u ON j.user_id = u.id
-                WHERE j.user_id = :user_id
-                ORDER BY j.created_at DESC
-            """)
-            jobs = conn.execute(jobs_query, {"user_id": user_id}).mappings().all()
+            jobs = conn.execute(queries.BUSINESS_JOBS, {"user_id": user_id}).mappings().all()
 
             return render_template(
                 'business_jobs.html',
@@ -218,37 +172,30 @@ def apply_to_job(job_id, request, engine):
 
     if resume_file and resume_file.filename:
         try:
-            fs_save_path, url_path = _get_application_upload_path(job_id, user_id, resume_file.filename)
-            resume_file.save(fs_save_path)
-            resume_path = url_path
+            resume_path = store_upload(engine, resume_file, _application_upload_folder(job_id, user_id))
         except Exception as e:
             flash(f"Error saving resume: {e}", "danger")
             return redirect(url_for('job_page', job_id=job_id))
     
     if cover_letter_file and cover_letter_file.filename:
         try:
-            fs_save_path, url_path = _get_application_upload_path(job_id, user_id, cover_letter_file.filename)
-            cover_letter_file.save(fs_save_path)
-            cover_letter_path = url_path
+            cover_letter_path = store_upload(engine, cover_letter_file, _application_upload_folder(job_id, user_id))
         except Exception as e:
+            release_uploads(engine, [resume_path])
             flash(f"Error saving cover letter: {e}", "danger")
             return redirect(url_for('job_page', job_id=job_id))
 
     try:
-        with engine.connect() as conn:
-            query = text("""
-                INSERT INTO job_applications (job_id, user_id, resume_path, cover_letter_path)
-                VALUES (:job_id, :user_id, :resume_path, :cover_letter_path)
-            """)
-            conn.execute(query, {
-                "job_id": job_id,
-                "user_id": user_id,
-                "resume_path": resume_path,
-                "cover_letter_path": cover_letter_path
-            })
-            conn.commit()
+        params = {
+            "job_id": job_id,
+            "user_id": user_id,
+            "resume_path": resume_path,
+            "cover_letter_path": cover_letter_path
+        }
+        write(engine, lambda conn: conn.execute(queries.INSERT_JOB_APPLICATION, params))
         flash("You have successfully applied for this job!", "success")
     except Exception as e:
+        release_uploads(engine, [resume_path, cover_letter_path])
         error_str = str(e).lower()
         if 'unique' in error_str or 'duplicate' in error_str:
             flash("You have already applied for this job.", "warning")
@@ -259,30 +206,16 @@ def apply_to_job(job_id, request, engine):
 
 def get_job_applications(job_id, engine):
     try:
-        with engine.connect() as conn:
-            query = text("""
-                SELECT a.id, a.user_id, a.resume_path, a.cover_letter_path, u.name, u.email
-                FROM job_applications a
-                JOIN users u ON a.user_id = u.id
-                WHERE a.job_id = :job_id
-            """)
-            return conn.execute(query, {"job_id": job_id}).mappings().all()
+        with connect(engine) as conn:
+            return conn.execute(queries.JOB_APPLICATIONS, {"job_id": job_id}).mappings().all()
     except Exception as e:
         print(f"Error fetching job applications: {e}")
         return []
 
 def get_my_applications(user_id, engine):
     try:
-        with engine.connect() as conn:
-            query = text("""
-                SELECT a.id, a.job_id, j.title, u.name as business_name
-                FROM job_applications a
-                JOIN jobs j ON a.job_id = j.id
-                JOIN users u ON j.user_id = u.id
-                WHERE a.user_id = :user_id
-                ORDER BY a.created_at DESC
-            """)
-            return conn.execute(query, {"user_id": user_id}).mappings().all()
+        with connect(engine) as conn:
+            return conn.execute(queries.MY_APPLICATIONS, {"user_id": user_id}).mappings().all()
     except Exception as e:
         print(f"Error fetching my applications: {e}")
         return []
@@ -290,21 +223,8 @@ def get_my_applications(user_id, engine):
 def get_application_by_id(application_id, engine):
     user_id = session.get('user_id')
     try:
-        with engine.connect() as conn:
-            query = text("""
-                SELECT 
-                    a.id, a.job_id, a.user_id AS applicant_id,
-                    a.resume_path, a.cover_letter_path,
-                    j.user_id AS job_owner_id, j.title AS job_title,
-                    u_app.name AS applicant_name, u_app.email AS applicant_email,
-                    u_biz.name AS business_name
-                FROM job_applications a
-                JOIN jobs j ON a.job_id = j.id
-                JOIN users u_app ON a.user_id = u_app.id
-                JOIN users u_biz ON j.user_id = u_biz.id
-                WHERE a.id = :application_id
-            """)
-            app_data = conn.execute(query, {"application_id": application_id}).mappings().first()
+        with connect(engine) as conn:
+            app_data = conn.execute(queries.APPLICATION_BY_ID, {"application_id": application_id}).mappings().first()
             
             if not app_data:
                 return None 
@@ -322,20 +242,12 @@ def check_if_user_can_chat_application(user_id, application_id, engine):
     if not user_id:
         return False
     
-    app_data = get_application_by_id(application_id, engine) 
-    return app_data is not None
+    return application_access(user_id, application_id, engine)
 
 def get_application_chat_history(application_id, engine):
     try:
-        with engine.connect() as conn:
-            query = text("""
-                SELECT m.id AS message_id, u.email, m.message_text, m.timestamp, m.attachment_path
-                FROM application_messages m
-                JOIN users u ON m.user_id = u.id
-                WHERE m.application_id = :application_id
-                ORDER BY m.timestamp ASC
-            """)
-            return conn.execute(query, {"application_id": application_id}).mappings().all()
+        with connect(engine) as conn:
+            return history_page(conn, 'application', application_id)
     except Exception as e:
         print(f"Error fetching application chat: {e}")
-        return []
+        return [], False
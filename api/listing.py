@@ -0,0 +1,220 @@
+import os
+import threading
+import time
+from . import queries
+from .db import connect, write
+from .pagination import encode_cursor, decode_cursor
+from .search import fts_query
+
+# Admin table listings. A Listing names the columns a page renders (never
+# SELECT *), what ?q= searches (an FTS5 index, or LIKE over a few columns)
+# and the column the status filter and histogram group on. Pages are
+# keyset-paged on id, so the last page costs the same as the first. The
+# histogram is read from the trigger-maintained status_counts table and
+# searched totals from a short-lived cache, so no click aggregates the whole
+# table. Every variant is compiled into the statement registry at import.
+class Listing:
+    def __init__(self, name, table, columns, status_column, histogram, search_columns=None, fts=None):
+        self.name = name
+        self.table = table
+        self.columns = columns
+        self.search_columns = search_columns
+        self.fts = fts
+        self.status_column = status_column
+        self.histogram = histogram
+        self._statements = {
+            variant: queries.statement(self.statement_name(*variant), self.sql(*variant))
+            for variant in self.variants()
+        }
+
+    def sql(self, kind, has_q=False, has_status=False):
+        where = []
+        if has_q and self.fts:
+            where.append(f"id IN (SELECT rowid FROM {self.fts} WHERE {self.fts} MATCH :q)")
+        elif has_q:
+            where.append("(" + " OR ".join(f"{column} LIKE :q" for column in self.search_columns) + ")")
+        if has_status:
+            where.append(f"{self.status_column} = :status")
+
+        if kind == "histogram":
+            return f"SELECT value, count FROM status_counts WHERE table_name = '{self.table}'"
+        if kind == "recount":
+            return f"SELECT IFNULL({self.status_column}, -1) AS value, COUNT(*) AS count FROM {self.table} GROUP BY 1"
+        if kind == "count":
+            where_sql = ("WHERE " + " AND ".join(where)) if where else ""
+            return f"SELECT COUNT(*) FROM {self.table} {where_sql}"
+
+        if kind == "after":
+            where.append("id > :after")
+        elif kind == "before":
+            where.append("id < :before")
+        order = "DESC" if kind in ("before", "last") else "ASC"
+        where_sql = ("WHERE " + " AND ".join(where)) if where else ""
+        return f"SELECT {', '.join(self.columns)} FROM {self.table} {where_sql} ORDER BY id {order} LIMIT :limit"
+
+    def variants(self):
+        yield "histogram", False, False
+        yield "recount", False, False
+        for has_q in (False, True):
+            for has_status in (False, True):
+                # Unsearched totals are read off the histogram.
+                if has_q:
+                    yield "count", has_q, has_status
+                for kind in ("first", "after", "before", "last"):
+                    yield kind, has_q, has_status
+
+    def statement_name(self, kind, has_q=False, has_status=False):
+        return ".".join(["listing", self.name, kind] + (["q"] if has_q else []) + (["status"] if has_status else []))
+
+    def statement(self, kind, has_q=False, has_status=False):
+        return self._statements[(kind, has_q, has_status)]
+
+LISTINGS = {
+    "projects": Listing(
+        "projects", "projects",
+        columns=["id", "name", "description", "status", "created_at", "project_link", "github_link"],
+        status_column="status",
+        histogram={"pending_count": 0, "approved_count": 1, "taken_count": 2},
+        fts="projects_fts",
+    ),
+    "users": Listing(
+        "users", "users",
+        columns=["id", "name", "email", "role"],
+        status_column="role",
+        histogram={"pending_count": 0, "approved_count": 1, "taken_count": 2, "student_count": 3},
+        search_columns=["name", "email"],
+    ),
+    "jobs": Listing(
+        "jobs", "jobs",
+        columns=["id", "title", "description", "status", "created_at", "link AS apply_link"],
+        status_column="status",
+        histogram={"pending_count": 0, "approved_count": 1, "taken_count": 2},
+        fts="jobs_fts",
+    ),
+}
+
+COUNTS_TTL = float(os.getenv("ADMIN_COUNTS_TTL", "30"))
+
+_counts = {}
+_counts_lock = threading.Lock()
+
+def _cached_count(key, compute):
+    now = time.monotonic()
+    entry = _counts.get(key)
+    if entry and entry[0] > now:
+        return entry[1]
+    value = compute()
+    with _counts_lock:
+        _counts[key] = (now + COUNTS_TTL, value)
+    return value
+
+def invalidate_counts(name):
+    with _counts_lock:
+        for key in [key for key in _counts if key[0] == name]:
+            del _counts[key]
+
+# Rebuilds status_counts from the tables themselves and returns every
+# (table, value, stored, actual) that had drifted.
+def reconcile_counts(engine):
+    def rebuild(conn):
+        drift = []
+        for listing in LISTINGS.values():
+            stored = {row.value: row.count for row in conn.execute(listing.statement("histogram"))}
+            actual = {row.value: row.count for row in conn.execute(listing.statement("recount"))}
+            for value in sorted(set(stored) | set(actual)):
+                if stored.get(value, 0) != actual.get(value, 0):
+                    drift.append((listing.table, value, stored.get(value, 0), actual.get(value, 0)))
+
+            conn.execute(queries.DELETE_STATUS_COUNTS, {"table_name": listing.table})
+            if actual:
+                conn.execute(
+                    queries.INSERT_STATUS_COUNTS,
+                    [{"table_name": listing.table, "value": value, "count": count} for value, count in actual.items()],
+                )
+        return drift
+
+    return write(engine, rebuild)
+
+def _parse_status(status):
+    if status is None or status == "":
+        return None
+    try:
+        return int(status)
+    except (TypeError, ValueError):
+        return None
+
+def fetch_page(engine, listing, per_page=6, cursor=None, q=None, status=None):
+    per_page = max(int(per_page or 1), 1)
+    q = (q or "").strip() or None
+    status = _parse_status(status)
+    position = decode_cursor(cursor) or {}
+
+    params = {}
+    if q and listing.fts:
+        params["q"] = fts_query(q)
+    elif q:
+        params["q"] = f"%{q}%"
+    has_q, has_status = params.get("q") is not None, status is not None
+    if has_status:
+        params["status"] = status
+
+    page = {
+        "rows": [], "total": 0, "total_all": 0, "total_pages": 1, "page": 1, "per_page": per_page,
+        "next_cursor": None, "prev_cursor": None, "last_cursor": None, "q": q, "status": status,
+        **{name: 0 for name in listing.histogram},
+    }
+
+    try:
+        with connect(engine) as conn:
+            histogram = {row.value: row.count for row in conn.execute(listing.statement("histogram"))}
+            total_all = sum(histogram.values())
+            if has_q:
+                total = _cached_count(
+                    (listing.name, "count", q, status),
+                    lambda: conn.execute(listing.statement("count", has_q, has_status), params).scalar() or 0,
+                )
+            elif has_status:
+                total = histogram.get(status, 0)
+            else:
+                total = total_all
+            total_pages = max(1, (total + per_page - 1) // per_page)
+
+            if position.get("last"):
+                kind, limit = "last", total - (total_pages - 1) * per_page or per_page
+            elif "after" in position:
+                kind, limit = "after", per_page + 1
+                params["after"] = position["after"]
+            elif "before" in position:
+                kind, limit = "before", per_page + 1
+                params["before"] = position["before"]
+            else:
+                kind, limit = "first", per_page + 1
+
+            rows = conn.execute(listing.statement(kind, has_q, has_status), {**params, "limit": limit}).mappings().all()
+    except Exception as e:
+        print(f"Error fetching {listing.name}: {e}")
+        return page
+
+    number = position.get("page", 1) if isinstance(position.get("page"), int) else 1
+    if kind == "first":
+        number, has_prev, has_next = 1, False, len(rows) > per_page
+    elif kind == "after":
+        has_prev, has_next = True, len(rows) > per_page
+    elif kind == "before":
+        has_prev, has_next = len(rows) > per_page, True
+        if not has_prev:
+            number = 1
+    else:
+        number, has_prev, has_next = total_pages, total_pages > 1, False
+
+    rows = list(reversed(rows[:per_page])) if kind in ("before", "last") else rows[:per_page]
+    number = min(max(number, 1), total_pages)
+
+    page.update(
+        rows=rows, total=total, total_all=total_all, total_pages=total_pages, page=number,
+        next_cursor=encode_cursor({"after": rows[-1]["id"], "page": number + 1}) if rows and has_next else None,
+        prev_cursor=encode_cursor({"before": rows[0]["id"], "page": number - 1}) if rows and has_prev else None,
+        last_cursor=encode_cursor({"last": True}) if total_pages > 1 else None,
+        **{name: histogram.get(value, 0) for name, value in listing.histogram.items()},
+    )
+    return page
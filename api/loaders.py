@@ -0,0 +1,28 @@
+from . import queries
+
+# Batch loaders: fetch the rows for a whole set of keys with one IN (...)
+# query and group them in a single pass, so a page costs the same number of
+# queries whether it shows one team or a hundred. Every requested key is in
+# the result, mapped to an empty list when it has no rows.
+
+# Stays well under SQLite's bound-parameter limit.
+BATCH_SIZE = 500
+
+def _chunks(keys):
+    keys = list(dict.fromkeys(keys))
+    for start in range(0, len(keys), BATCH_SIZE):
+        yield keys[start:start + BATCH_SIZE]
+
+def load_team_members(conn, team_ids):
+    members = {team_id: [] for team_id in team_ids}
+    for chunk in _chunks(team_ids):
+        for row in conn.execute(queries.TEAM_MEMBERS, {"team_ids": chunk}).mappings():
+            members[row['team_id']].append(row)
+    return members
+
+def load_comment_attachments(conn, comment_ids):
+    attachments = {comment_id: [] for comment_id in comment_ids}
+    for chunk in _chunks(comment_ids):
+        for row in conn.execute(queries.COMMENT_ATTACHMENTS, {"comment_ids": chunk}).mappings():
+            attachments[row['comment_id']].append(row)
+    return attachments
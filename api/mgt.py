@@ -1,6 +1,24 @@
-import bcrypt
+import os
+import csv
+import io
+import re
+import secrets
+from datetime import datetime, timedelta
 from flask import request, redirect, url_for, flash, session, jsonify, render_template
-from sqlalchemy import text
+from . import queries
+from .acl import invalidate_project, invalidate_user
+from .db import connect, write
+from .loaders import load_team_members
+from .pagination import encode_cursor, decode_cursor
+from .passwords import hash_password
+from .blobs import release_uploads
+from .outbox import email_enabled, enqueue_email, notify_outbox
+
+ROSTER_PAGE_SIZES = {"teams": 10, "unassigned": 50}
+DEFAULT_STUDENT_PASSWORD = "changeme"
+ROSTER_IMPORT_MAX_ROWS = 1000
+ROSTER_INVITE_DAYS = int(os.getenv("ROSTER_INVITE_DAYS", "7"))
+EMAIL_RE = re.compile(r'[^@\s]+@[^@\s]+\.[^@\s]+')
 
 def instructor_only():
     if 'role' not in session or session['role'] != 0:
@@ -23,21 +41,16 @@ def create_user_by_instructor(engine):
         flash("Could not identify instructor. Please log in again.", "warning")
         return redirect(url_for('login'))
 
-    default_password = "changeme"
-    hashed_password = bcrypt.hashpw(default_password.encode('utf-8'), bcrypt.gensalt())
+    hashed_password = hash_password(DEFAULT_STUDENT_PASSWORD)
     
     try:
-        with engine.connect() as conn:
-            query = text(
-                "INSERT INTO users (email, password, role, instructor_id) "
-                "VALUES (:email, :password, 3, :instructor_id)"
-            )
+        with connect(engine) as conn:
             params = {
                 "email": email,
-                "password": hashed_password.decode('utf-8'),
+                "password": hashed_password,
                 "instructor_id": instructor_id
             }
-            conn.execute(query, params)
+            conn.execute(queries.INSERT_STUDENT, params)
             conn.commit()
         flash(f"Student {email} created and assigned to you successfully.", "success")
     except Exception as e:
@@ -45,6 +58,111 @@ def create_user_by_instructor(engine):
     
     return redirect(url_for('user_mgt'))
 
+# One email per line, or a CSV whose first column is the email (an "email"
+# header row is skipped). Returns [(line number, email)] without blank lines.
+def _parse_roster(text):
+    rows = []
+    for line_number, row in enumerate(csv.reader(io.StringIO(text)), start=1):
+        email = row[0].strip() if row else ""
+        if not email or (not rows and email.lower() == "email"):
+            continue
+        rows.append((line_number, email))
+    return rows
+
+# Bulk version of create_user_by_instructor for a pasted or uploaded roster.
+# Every row is checked before anything is written, and all the new students
+# are inserted with one executemany in one transaction. Hashing a password
+# per row would take bcrypt's quarter second a thousand times over, so the
+# students get no known password at all: their hash is of a random secret
+# that is thrown away, and each one gets a password reset token of their own
+# in the same transaction. The set-password links are emailed when email is
+# set up and returned in the report otherwise, for the instructor to hand
+# out. Rows that are invalid, repeated or already registered are skipped;
+# the response reports what happened to each one.
+def import_students_by_instructor(engine):
+    if not instructor_only():
+        return jsonify({"success": False, "message": "Permission denied."}), 403
+
+    instructor_id = session.get('user_id')
+    roster_file = request.files.get('roster_file')
+    if roster_file and roster_file.filename:
+        text = roster_file.read().decode('utf-8-sig', errors='replace')
+    else:
+        text = request.form.get('roster', '')
+
+    rows = _parse_roster(text)
+    if not rows:
+        return jsonify({"success": False, "message": "No email addresses found."}), 400
+    if len(rows) > ROSTER_IMPORT_MAX_ROWS:
+        return jsonify({"success": False, "message": f"Import at most {ROSTER_IMPORT_MAX_ROWS} students at a time."}), 400
+
+    report = []
+    seen = set()
+    for line_number, email in rows:
+        if not EMAIL_RE.fullmatch(email):
+            report.append({"line": line_number, "email": email, "status": "invalid", "message": "Not a valid email address."})
+        elif email in seen:
+            report.append({"line": line_number, "email": email, "status": "duplicate", "message": "Listed more than once."})
+        else:
+            seen.add(email)
+            report.append({"line": line_number, "email": email, "status": "created", "message": ""})
+
+    hashed_password = hash_password(secrets.token_urlsafe(32)) if seen else None
+    expires_at = datetime.utcnow() + timedelta(days=ROSTER_INVITE_DAYS)
+    send_invites = email_enabled()
+    invites = {}
+    for email in seen:
+        token = secrets.token_urlsafe(32)
+        invites[email] = (token, url_for('reset_password', token=token, _external=True))
+
+    # The existence check runs in the same write as the insert, so an email
+    # registered in the meantime cannot fail the whole batch.
+    def insert_students(conn):
+        existing = set(conn.execute(queries.EXISTING_USER_EMAILS, {"emails": sorted(seen)}).scalars()) if seen else set()
+        for entry in report:
+            if entry["status"] == "created" and entry["email"] in existing:
+                entry["status"] = "exists"
+                entry["message"] = "An account with this email already exists."
+        created = [entry["email"] for entry in report if entry["status"] == "created"]
+        if not created:
+            return 0
+        conn.execute(queries.INSERT_STUDENT, [
+            {"email": email, "password": hashed_password, "instructor_id": instructor_id}
+            for email in created
+        ])
+        conn.execute(queries.INSERT_STUDENT_RESET_TOKEN, [
+            {"email": email, "token": invites[email][0], "expires_at": expires_at}
+            for email in created
+        ])
+        if send_invites:
+            for email in created:
+                reset_url = invites[email][1]
+                html_content = f"""
+                <p>Hello,</p>
+                <p>Your instructor has created an account for you. Click the link below to choose your password:</p>
+                <p><a href="{reset_url}">{reset_url}</a></p>
+                <p>This link will expire in {ROSTER_INVITE_DAYS} days.</p>
+                """
+                enqueue_email(conn, f"roster-invite-{email}-{expires_at.isoformat()}", [email], "Your new account", html_content)
+        return len(created)
+
+    try:
+        created = write(engine, insert_students)
+    except Exception as e:
+        print(f"Error importing roster: {e}")
+        return jsonify({"success": False, "message": "The roster could not be imported."}), 500
+
+    if send_invites:
+        notify_outbox()
+    for entry in report:
+        if entry["status"] == "created":
+            if send_invites:
+                entry["message"] = "A set-password link was emailed."
+            else:
+                entry["reset_url"] = invites[entry["email"]][1]
+
+    return jsonify({"success": True, "created": created, "skipped": len(report) - created, "rows": report}), 200
+
 def create_group(engine):
     if not instructor_only():
         return redirect(url_for('user_mgt'))
@@ -57,10 +175,8 @@ def create_group(engine):
         return redirect(url_for('user_mgt'))
     
     try:
-        with engine.connect() as conn:
-            insert_team_query = text("INSERT INTO teams (name, user_id) VALUES (:name, :user_id)")
-            conn.execute(insert_team_query, {"name": group_name, "user_id": user_id})
-            conn.commit()
+        params = {"name": group_name, "user_id": user_id}
+        write(engine, lambda conn: conn.execute(queries.INSERT_TEAM, params))
         flash("Group created successfully.", "success")
     except Exception as e:
         flash(f"Error creating group: {e}", "danger")
@@ -76,22 +192,23 @@ def assign_project_to_group(team_id, engine):
         flash("No project selected.", "warning")
         return redirect(url_for('user_mgt'))
 
-    try:
-        with engine.connect() as conn:
-            with conn.begin():
-                old_project_query = text("SELECT project_id FROM teams WHERE id = :team_id")
-                result = conn.execute(old_project_query, {"team_id": team_id}).scalar_one_or_none()
+    # Returns the team's previous project.
+    def assign_project(conn):
+        result = conn.execute(queries.TEAM_PROJECT_ID, {"team_id": team_id}).scalar_one_or_none()
 
-                if result:
-                    update_old_project = text("UPDATE projects SET status = 2 WHERE id = :project_id")
-                    conn.execute(update_old_project, {"project_id": result})
+        if result:
+            conn.execute(queries.RELEASE_PROJECT, {"project_id": result})
 
-                update_team_query = text("UPDATE teams SET project_id = :project_id WHERE id = :team_id")
-                conn.execute(update_team_query, {"project_id": project_id, "team_id": team_id})
+        conn.execute(queries.UPDATE_TEAM_PROJECT, {"project_id": project_id, "team_id": team_id})
 
-                update_new_project = text("UPDATE projects SET status = 3 WHERE id = :project_id")
-                conn.execute(update_new_project, {"project_id": project_id})
+        conn.execute(queries.TAKE_PROJECT, {"project_id": project_id})
+        return result
 
+    try:
+        result = write(engine, assign_project)
+
+        invalidate_project(result)
+        invalidate_project(project_id)
         flash("Project assigned to group successfully.", "success")
     except Exception as e:
         flash(f"Error assigning project: {e}", "danger")
@@ -105,27 +222,64 @@ def assign_user_to_team(engine):
     data = request.get_json()
     user_id = data.get('user_id')
     team_id = data.get('team_id')
+    instructor_id = session.get('user_id')
     
+    def move_member(conn):
+        student = conn.execute(queries.INSTRUCTOR_STUDENT, {"user_id": user_id, "instructor_id": instructor_id}).mappings().first()
+        if not student:
+            return None
+        project_id = None
+        if team_id is not None:
+            team = conn.execute(queries.INSTRUCTOR_TEAM_PROJECT, {"team_id": team_id, "instructor_id": instructor_id}).first()
+            if not team:
+                return None
+            project_id = team.project_id
+
+        conn.execute(queries.DELETE_USER_MEMBERSHIPS, {"user_id": user_id})
+        if team_id is not None:
+            conn.execute(queries.INSERT_TEAM_MEMBER, {"team_id": team_id, "user_id": user_id})
+        return dict(student), project_id
+
     try:
-        with engine.connect() as conn:
-            conn.execute(text("DELETE FROM team_members WHERE user_id = :user_id"), {"user_id": user_id})
-            if team_id is not None:
-                query = text("INSERT INTO team_members (team_id, user_id) VALUES (:team_id, :user_id)")
-                conn.execute(query, {"team_id": team_id, "user_id": user_id})
-            conn.commit()
-        return jsonify({"success": True}), 200
+        moved = write(engine, move_member)
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
+    if not moved:
+        return jsonify({"success": False, "message": "Student or group not found."}), 404
+    student, project_id = moved
+
+    invalidate_user(user_id)
+    invalidate_user(instructor_id)
+    # The student's old project dropped out with the student; the new one
+    # has not heard of them yet.
+    invalidate_project(project_id)
+
+    # The card is re-rendered the way the destination list shows it, so the
+    # page can swap it in place instead of reloading.
+    if team_id is not None:
+        html = render_template('partials/roster_member.html', member=student)
+    else:
+        html = render_template('partials/roster_student.html', student=student)
+    return jsonify({"success": True, "user": student, "team_id": team_id, "html": html}), 200
+
 def delete_user(user_id, engine):
     if not instructor_only():
         return redirect(url_for('user_mgt'))
     
+    # The delete cascades to the student's comments, messages and
+    # applications; the files they listed are released once it commits.
+    def delete_student(conn):
+        paths = conn.execute(queries.USER_UPLOAD_PATHS, {"user_id": user_id}).scalars().all()
+        if conn.execute(queries.DELETE_STUDENT, {"user_id": user_id}).rowcount == 0:
+            return []
+        return paths
+
     try:
-        with engine.connect() as conn:
-            query = text("DELETE FROM users WHERE id = :user_id AND role = 3")
-            conn.execute(query, {"user_id": user_id})
-            conn.commit()
+        upload_paths = write(engine, delete_student)
+        release_uploads(engine, upload_paths)
+        invalidate_user(user_id)
+        invalidate_user(session.get('user_id'))
         flash("User deleted successfully.", "success")
     except Exception as e:
         flash(f"Error deleting user: {e}", "danger")
@@ -136,26 +290,29 @@ def delete_group(team_id, engine):
     if not instructor_only():
         return redirect(url_for('user_mgt'))
 
+    # Returns the row holding the team's project, or None if there is no
+    # such team.
+    def delete_team(conn):
+        result = conn.execute(queries.TEAM_PROJECT_ID, {"team_id": team_id}).mappings().first()
+        if not result:
+            return None
+        project_id = result['project_id']
+
+        conn.execute(queries.DELETE_TEAM, {"team_id": team_id})
+
+        team_count_result = conn.execute(queries.PROJECT_TEAM_COUNT, {"project_id": project_id}).mappings().first()
+        
+        if team_count_result['team_count'] == 0:
+            conn.execute(queries.RELEASE_PROJECT, {"project_id": project_id})
+        return result
+
     try:
-        with engine.connect() as conn:
-            with conn.begin():
-                project_id_query = text("SELECT project_id FROM teams WHERE id = :team_id")
-                result = conn.execute(project_id_query, {"team_id": team_id}).mappings().first()
-                if not result:
-                    flash("Team not found.", "warning")
-                    return redirect(url_for('user_mgt'))
-                project_id = result['project_id']
-
-                delete_team_query = text("DELETE FROM teams WHERE id = :team_id")
-                conn.execute(delete_team_query, {"team_id": team_id})
-
-                count_query = text("SELECT COUNT(id) as team_count FROM teams WHERE project_id = :project_id")
-                team_count_result = conn.execute(count_query, {"project_id": project_id}).mappings().first()
-                
-                if team_count_result['team_count'] == 0:
-                    update_project_query = text("UPDATE projects SET status = 2 WHERE id = :project_id")
-                    conn.execute(update_project_query, {"project_id": project_id})
+        result = write(engine, delete_team)
+        if not result:
+            flash("Team not found.", "warning")
+            return redirect(url_for('user_mgt'))
         
+        invalidate_project(result['project_id'])
         flash("Group deleted successfully.", "success")
     except Exception as e:
         flash(f"Error deleting group: {e}", "danger")
@@ -172,75 +329,87 @@ def update_group(team_id, engine):
         return redirect(url_for('user_mgt'))
 
     try:
-        with engine.connect() as conn:
-            query = text("UPDATE teams SET name = :name WHERE id = :team_id")
-            conn.execute(query, {"name": new_name, "team_id": team_id})
-            conn.commit()
+        params = {"name": new_name, "team_id": team_id}
+        write(engine, lambda conn: conn.execute(queries.UPDATE_TEAM_NAME, params))
         flash("Group name updated successfully.", "success")
     except Exception as e:
         flash(f"Error updating group: {e}", "danger")
         
     return redirect(url_for('user_mgt'))
 
+def get_instructor_projects(conn, instructor_id):
+    return conn.execute(queries.INSTRUCTOR_APPROVED_PROJECTS, {"instructor_id": instructor_id}).mappings().all()
+
+def _after_id(cursor):
+    position = decode_cursor(cursor) or {}
+    return position["id"] if isinstance(position.get("id"), int) else 0
+
+def get_instructor_teams(conn, instructor_id, cursor=None, limit=ROSTER_PAGE_SIZES["teams"]):
+    teams = conn.execute(queries.INSTRUCTOR_TEAMS_PAGE, {"user_id": instructor_id, "after_id": _after_id(cursor), "limit": limit + 1}).mappings().all()
+
+    next_cursor = encode_cursor({"id": teams[limit - 1]['id']}) if len(teams) > limit else None
+    teams = teams[:limit]
+    members = load_team_members(conn, [team['id'] for team in teams])
+    return [{**team, 'members': members[team['id']]} for team in teams], next_cursor
+
+def get_unassigned_students(conn, instructor_id, cursor=None, search=None, limit=ROSTER_PAGE_SIZES["unassigned"]):
+    params = {
+        "instructor_id": instructor_id,
+        "after_id": _after_id(cursor),
+        "search": f"%{search}%" if search else None,
+        "limit": limit + 1,
+    }
+    students = conn.execute(queries.UNASSIGNED_STUDENTS_PAGE, params).mappings().all()
+
+    next_cursor = encode_cursor({"id": students[limit - 1]['id']}) if len(students) > limit else None
+    return students[:limit], next_cursor
+
+def get_roster_page(engine):
+    instructor_id = session['user_id']
+    section = request.args.get('section', 'teams')
+    cursor = request.args.get('cursor')
+
+    try:
+        with connect(engine) as conn:
+            if section == 'unassigned':
+                students, next_cursor = get_unassigned_students(conn, instructor_id, cursor, request.args.get('q', '').strip())
+                return jsonify({
+                    "students": [dict(student) for student in students],
+                    "html": "".join(render_template('partials/roster_student.html', student=student) for student in students),
+                    "next_cursor": next_cursor
+                })
+
+            teams, next_cursor = get_instructor_teams(conn, instructor_id, cursor)
+            projects = get_instructor_projects(conn, instructor_id)
+    except Exception as e:
+        print(f"Database error fetching roster: {e}")
+        return jsonify({"success": False, "message": "Could not load the roster."}), 500
+
+    return jsonify({
+        "teams": [{**team, 'members': [dict(member) for member in team['members']]} for team in teams],
+        "html": "".join(render_template('partials/roster_team.html', team=team, projects=projects) for team in teams),
+        "next_cursor": next_cursor
+    })
+
 def get_user_mgt_data(engine):
-    with engine.connect() as conn:
+    with connect(engine) as conn:
         instructor_id = session['user_id']
 
-        requests_query = text("""
-            SELECT r.id, u.email AS student_email
-            FROM instructor_requests r JOIN users u ON r.student_id = u.id
-            WHERE r.instructor_id = :instructor_id AND r.status = 0
-        """)
-        join_requests = conn.execute(requests_query, {"instructor_id": instructor_id}).all()
-
-        denied_query = text("""
-            SELECT r.id, u.email AS student_email
-            FROM instructor_requests r JOIN users u ON r.student_id = u.id
-            WHERE r.instructor_id = :instructor_id AND r.status = 2
-        """)
-        denied_requests = conn.execute(denied_query, {"instructor_id": instructor_id}).all()
-
-        projects_query = text("""
-            SELECT p.id, p.name 
-            FROM projects p
-            JOIN instructor_projects ip ON p.id = ip.project_id
-            WHERE p.status = 2 AND ip.instructor_id = :instructor_id
-            ORDER BY p.name
-        """)
-        projects = conn.execute(projects_query, {"instructor_id": instructor_id}).mappings().all()
-
-        students_query = text("SELECT id, name, email FROM users WHERE role = 3 AND instructor_id = :instructor_id")
-        all_students = conn.execute(students_query, {"instructor_id": instructor_id}).mappings().all()
-
-        teams_query = text("""
-            SELECT t.id, t.name, t.project_id, p.name AS project_name
-            FROM teams t LEFT JOIN projects p ON t.project_id = p.id
-            WHERE t.user_id = :user_id
-        """)
-        teams = conn.execute(teams_query, {"user_id": instructor_id}).mappings().all()
-
-        team_members_query = text("SELECT team_id, user_id FROM team_members")
-        team_members_result = conn.execute(team_members_query).mappings().all()
-        team_members_map = {}
-        for row in team_members_result:
-            if row['team_id'] not in team_members_map:
-                team_members_map[row['team_id']] = []
-            team_members_map[row['team_id']].append(row['user_id'])
-        
-        assigned_student_ids = {item for sublist in team_members_map.values() for item in sublist}
-        unassigned_students = [s for s in all_students if s['id'] not in assigned_student_ids]
+        join_requests = conn.execute(queries.INSTRUCTOR_PENDING_REQUESTS, {"instructor_id": instructor_id}).all()
+
+        denied_requests = conn.execute(queries.INSTRUCTOR_DENIED_REQUESTS, {"instructor_id": instructor_id}).all()
 
-        teams_with_members = []
-        for team in teams:
-            team_members_ids = team_members_map.get(team['id'], [])
-            members = [s for s in all_students if s['id'] in team_members_ids]
-            teams_with_members.append({**team, 'members': members})
+        projects = get_instructor_projects(conn, instructor_id)
+        unassigned_students, unassigned_cursor = get_unassigned_students(conn, instructor_id)
+        teams_with_members, teams_cursor = get_instructor_teams(conn, instructor_id)
 
     return render_template(
         'userMgt.html',
         projects=projects,
         unassigned_students=unassigned_students,
+        unassigned_cursor=unassigned_cursor,
         teams_with_members=teams_with_members,
+        teams_cursor=teams_cursor,
         join_requests=join_requests,
         denied_requests=denied_requests 
     )
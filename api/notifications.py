@@ -0,0 +1,118 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from markupsafe import escape
+from . import queries
+from .db import connect, write
+from .outbox import email_enabled, enqueue_email, notify_outbox
+
+# Comment notifications are coalesced per recipient and project. A comment
+# records one event per participant in its own transaction; the digest worker
+# waits until a (user, project) group has been quiet for NOTIFY_DIGEST_QUIET
+# seconds, or its oldest event is NOTIFY_DIGEST_MAX_DELAY old, and then turns
+# the whole group into one email in the outbox. A busy thread therefore sends
+# each participant one digest instead of an email per comment.
+NOTIFY_DIGEST_QUIET = float(os.getenv("NOTIFY_DIGEST_QUIET", "600"))
+NOTIFY_DIGEST_MAX_DELAY = float(os.getenv("NOTIFY_DIGEST_MAX_DELAY", "3600"))
+NOTIFY_DIGEST_INTERVAL = float(os.getenv("NOTIFY_DIGEST_INTERVAL", "60"))
+NOTIFY_DIGEST_BATCH = int(os.getenv("NOTIFY_DIGEST_BATCH", "100"))
+
+def record_comment_events(conn, comment_id, project_id, recipients, link):
+    now = datetime.utcnow()
+    for user_id in sorted(recipients):
+        conn.execute(queries.INSERT_NOTIFICATION_EVENT, {
+            "user_id": user_id,
+            "project_id": project_id,
+            "comment_id": comment_id,
+            "link": link,
+            "now": now
+        })
+
+def _digest(comments, link):
+    project_name = escape(comments[0]['project_name'])
+    if len(comments) == 1:
+        subject = f"New comment on project: {comments[0]['project_name']}"
+    else:
+        subject = f"{len(comments)} new comments on project: {comments[0]['project_name']}"
+
+    items = "".join(f"""
+            <p><strong>{escape(c['name'] or c['email'])}</strong> ({c['created_at'].strftime('%b %d, %I:%M %p')} UTC):</p>
+            <blockquote style="border-left: 2px solid #ccc; padding-left: 10px; margin-left: 5px; font-style: italic;">
+                {escape(c['comment'])}
+            </blockquote>""" for c in comments)
+
+    html_content = f"""
+            <p>Hello,</p>
+            <p>There {'is a new comment' if len(comments) == 1 else f'are {len(comments)} new comments'} on the project: <strong>{project_name}</strong>.</p>
+            {items}
+            <p>You can view the comments and reply here:</p>
+            <p><a href="{escape(link)}">{escape(link)}</a></p>
+            <p>Thank you,</p>
+            <p>The Project Portal</p>
+            """
+    return subject, html_content
+
+# Turns one due group into an outbox email. The events are deleted in the
+# same transaction, so a group is only ever sent once even with several
+# workers polling. Comments deleted in the meantime took their events with
+# them; a group with nothing left is dropped.
+def _flush_group(conn, user_id, project_id, last_event_id):
+    events = conn.execute(queries.TAKE_NOTIFICATION_EVENTS, {
+        "user_id": user_id,
+        "project_id": project_id,
+        "last_event_id": last_event_id
+    }).all()
+    if not events:
+        return False
+
+    comments = conn.execute(queries.DIGEST_COMMENTS, {"comment_ids": [e.comment_id for e in events]}).mappings().all()
+    recipient = conn.execute(queries.USER_NAME_EMAIL, {"user_id": user_id}).mappings().first()
+    if not comments or not recipient:
+        return False
+
+    subject, html_content = _digest(comments, events[-1].link)
+    enqueue_email(conn, f"digest-{user_id}-{project_id}-{last_event_id}", [recipient['email']], subject, html_content)
+    return True
+
+def flush_due_digests(engine, now=None):
+    now = now or datetime.utcnow()
+    params = {
+        "quiet_before": now - timedelta(seconds=NOTIFY_DIGEST_QUIET),
+        "oldest_before": now - timedelta(seconds=NOTIFY_DIGEST_MAX_DELAY),
+        "batch": NOTIFY_DIGEST_BATCH
+    }
+    with connect(engine) as conn:
+        groups = conn.execute(queries.DUE_NOTIFICATION_GROUPS, params).all()
+
+    sent = 0
+    for group in groups:
+        try:
+            if write(engine, lambda conn: _flush_group(conn, group.user_id, group.project_id, group.last_event_id)):
+                sent += 1
+        except Exception as e:
+            print(f"Digest for user {group.user_id} on project {group.project_id} failed: {e}")
+    if sent:
+        notify_outbox()
+    return len(groups), sent
+
+def start_digest_worker(engine):
+    if not email_enabled():
+        return None
+
+    def worker_loop():
+        while True:
+            try:
+                due, sent = flush_due_digests(engine)
+            except Exception as e:
+                print(f"Digest worker failed: {e}")
+                due, sent = 0, 0
+            # A full batch means more groups may be waiting, but only go
+            # straight back for them when this pass made progress; groups
+            # that keep failing would otherwise be retried in a busy loop.
+            if not sent or due < NOTIFY_DIGEST_BATCH:
+                time.sleep(NOTIFY_DIGEST_INTERVAL)
+
+    thread = threading.Thread(target=worker_loop, name="notification-digests", daemon=True)
+    thread.start()
+    return thread
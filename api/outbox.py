@@ -0,0 +1,168 @@
+import os
+import json
+import random
+import re
+import smtplib
+import threading
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+import resend
+from . import queries
+from .db import write
+
+# Email is never sent from a request. Callers queue it with enqueue_email() on
+# the connection, and so in the transaction, that records the comment or
+# token it is about. A worker thread per process claims due rows, hands them
+# to the configured transport and retries failures with exponential backoff.
+# The idempotency key is unique in the table, so one event is queued once,
+# and it is passed on to the provider so a send retried after a lost
+# response is not delivered twice.
+SENDGRID_KEY = os.environ.get('SENDGRID_KEY')
+SENDGRID_EMAIL = os.environ.get('SENDGRID_EMAIL')
+
+EMAIL_TRANSPORT = os.getenv("EMAIL_TRANSPORT") or ("resend" if SENDGRID_KEY else "")
+EMAIL_POLL_INTERVAL = float(os.getenv("EMAIL_POLL_INTERVAL", "5"))
+EMAIL_BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE", "20"))
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "8"))
+EMAIL_RETRY_BASE = float(os.getenv("EMAIL_RETRY_BASE", "30"))
+EMAIL_RETRY_MAX = 3600
+# How long a claimed email is left alone before another worker may retry it.
+EMAIL_SEND_LEASE = float(os.getenv("EMAIL_SEND_LEASE", "300"))
+
+class ResendTransport:
+    def send(self, message):
+        resend.api_key = SENDGRID_KEY
+        params = {
+            "from": SENDGRID_EMAIL,
+            "to": message['to'],
+            "subject": message['subject'],
+            "html": message['html']
+        }
+        if message['bcc']:
+            params["bcc"] = message['bcc']
+        resend.Emails.send(params, {"idempotency_key": message['idempotency_key']})
+
+# Any SMTP server, including a local sink such as MailHog or
+# `python -m aiosmtpd -n -l localhost:1025`.
+class SmtpTransport:
+    def __init__(self):
+        self.host = os.getenv("EMAIL_SMTP_HOST", "localhost")
+        self.port = int(os.getenv("EMAIL_SMTP_PORT", "1025"))
+        self.username = os.getenv("EMAIL_SMTP_USERNAME")
+        self.password = os.getenv("EMAIL_SMTP_PASSWORD")
+        self.starttls = os.getenv("EMAIL_SMTP_STARTTLS", "0") == "1"
+
+    def send(self, message):
+        email = EmailMessage()
+        email["From"] = SENDGRID_EMAIL or "noreply@localhost"
+        email["To"] = ", ".join(message['to'])
+        email["Subject"] = message['subject']
+        email["Message-ID"] = f"<{message['idempotency_key']}@{self.host}>"
+        email.set_content(message['html'], subtype="html")
+
+        with smtplib.SMTP(self.host, self.port, timeout=30) as smtp:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password or "")
+            smtp.send_message(email, to_addrs=message['to'] + message['bcc'])
+
+# Writes each email to EMAIL_OUTBOX_DIR as <idempotency key>.json, for
+# development and tests. A repeated send overwrites the same file.
+class FileTransport:
+    def __init__(self):
+        self.directory = os.getenv("EMAIL_OUTBOX_DIR", "mail")
+
+    def send(self, message):
+        os.makedirs(self.directory, exist_ok=True)
+        name = re.sub(r'[^A-Za-z0-9_.-]', '_', message['idempotency_key'])
+        path = os.path.join(self.directory, f"{name}.json")
+        with open(path + ".tmp", 'w') as f:
+            json.dump(message, f, indent=2)
+        os.replace(path + ".tmp", path)
+
+TRANSPORTS = {
+    "resend": ResendTransport,
+    "smtp": SmtpTransport,
+    "file": FileTransport,
+}
+
+def email_enabled():
+    return EMAIL_TRANSPORT in TRANSPORTS
+
+def get_transport():
+    return TRANSPORTS[EMAIL_TRANSPORT]()
+
+_wake = threading.Event()
+
+def enqueue_email(conn, idempotency_key, to, subject, html, bcc=()):
+    conn.execute(queries.INSERT_OUTBOX_EMAIL, {
+        "idempotency_key": idempotency_key,
+        "to_addresses": json.dumps(list(to)),
+        "bcc_addresses": json.dumps(sorted(bcc)),
+        "subject": subject,
+        "html": html,
+        "now": datetime.utcnow()
+    })
+
+# Call once the transaction that queued an email has committed, so this
+# process's worker picks it up now instead of at its next poll.
+def notify_outbox():
+    _wake.set()
+
+def _backoff(attempts):
+    delay = min(EMAIL_RETRY_BASE * 2 ** (attempts - 1), EMAIL_RETRY_MAX)
+    return delay * random.uniform(0.8, 1.2)
+
+def send_due_emails(engine, transport):
+    now = datetime.utcnow()
+    params = {"now": now, "lease_until": now + timedelta(seconds=EMAIL_SEND_LEASE), "batch": EMAIL_BATCH_SIZE}
+    claimed = write(engine, lambda conn: conn.execute(queries.CLAIM_OUTBOX_EMAILS, params).mappings().all())
+
+    sent = 0
+    for row in claimed:
+        message = {
+            "idempotency_key": row['idempotency_key'],
+            "to": json.loads(row['to_addresses']),
+            "bcc": json.loads(row['bcc_addresses']),
+            "subject": row['subject'],
+            "html": row['html']
+        }
+        try:
+            transport.send(message)
+        except Exception as e:
+            gave_up = row['attempts'] >= EMAIL_MAX_ATTEMPTS
+            retry = {
+                "id": row['id'],
+                "status": 2 if gave_up else 0,
+                "next_attempt_at": datetime.utcnow() + timedelta(seconds=_backoff(row['attempts'])),
+                "error": str(e)[:500]
+            }
+            write(engine, lambda conn: conn.execute(queries.MARK_OUTBOX_RETRY, retry))
+            print(f"Email {row['idempotency_key']} failed on attempt {row['attempts']}{', giving up' if gave_up else ''}: {e}")
+            continue
+
+        write(engine, lambda conn: conn.execute(queries.MARK_OUTBOX_SENT, {"id": row['id'], "now": datetime.utcnow()}))
+        sent += 1
+    return len(claimed), sent
+
+def start_email_worker(engine):
+    if not email_enabled():
+        return None
+
+    transport = get_transport()
+
+    def worker_loop():
+        while True:
+            _wake.clear()
+            try:
+                claimed, _ = send_due_emails(engine, transport)
+            except Exception as e:
+                print(f"Email worker failed: {e}")
+                claimed = 0
+            if claimed < EMAIL_BATCH_SIZE:
+                _wake.wait(EMAIL_POLL_INTERVAL)
+
+    thread = threading.Thread(target=worker_loop, name="email-outbox", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,20 @@
+import base64
+import json
+
+# Opaque keyset cursors. The client only ever echoes them back, so the payload
+# can change shape without breaking old pages; a cursor that does not decode
+# is treated as "start from the beginning".
+
+def encode_cursor(values):
+    payload = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+def decode_cursor(token):
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError):
+        return None
+    return values if isinstance(values, dict) else None
@@ -0,0 +1,96 @@
+import os
+import threading
+import time
+import bcrypt
+from werkzeug.exceptions import ServiceUnavailable
+
+try:
+    import greenlet
+    from eventlet import tpool
+except ImportError:
+    tpool = None
+
+# bcrypt takes a quarter of a second of CPU per call. Under eventlet every
+# request and socket on a worker shares one OS thread, so a direct call
+# stalls all of them; here the call runs on eventlet's native thread pool
+# (bcrypt releases the GIL) while the green thread that asked waits. At most
+# PASSWORD_POOL_SIZE hashes run at once and PASSWORD_QUEUE_MAX more may wait;
+# beyond that the request is turned away with a 503 straight away rather
+# than queueing behind a login rush. Outside eventlet (a threaded dev server)
+# the call runs on the request's own thread, with the same limit.
+PASSWORD_POOL_SIZE = int(os.getenv("PASSWORD_POOL_SIZE", "4"))
+PASSWORD_QUEUE_MAX = int(os.getenv("PASSWORD_QUEUE_MAX", "32"))
+PASSWORD_RETRY_AFTER = 2
+
+if tpool is not None:
+    tpool.set_num_threads(PASSWORD_POOL_SIZE)
+
+class PasswordPoolBusy(ServiceUnavailable):
+    description = "The server is busy signing people in. Please try again in a moment."
+
+    def __init__(self):
+        super().__init__(retry_after=PASSWORD_RETRY_AFTER)
+
+_lock = threading.Lock()
+_stats = {"in_flight": 0, "running": 0, "completed": 0, "rejected": 0,
+          "total_wait": 0.0, "max_wait": 0.0, "total_run": 0.0}
+
+# A request handled by eventlet runs in a green thread whose parent is the
+# hub; a plain OS thread is its own root greenlet.
+def _in_green_thread():
+    return tpool is not None and greenlet.getcurrent().parent is not None
+
+def _run(fn):
+    with _lock:
+        if _stats["in_flight"] >= PASSWORD_POOL_SIZE + PASSWORD_QUEUE_MAX:
+            _stats["rejected"] += 1
+            raise PasswordPoolBusy()
+        _stats["in_flight"] += 1
+    submitted = time.monotonic()
+
+    def timed():
+        started = time.monotonic()
+        with _lock:
+            _stats["running"] += 1
+        try:
+            return fn()
+        finally:
+            finished = time.monotonic()
+            with _lock:
+                _stats["running"] -= 1
+                _stats["completed"] += 1
+                _stats["total_wait"] += started - submitted
+                _stats["max_wait"] = max(_stats["max_wait"], started - submitted)
+                _stats["total_run"] += finished - started
+
+    try:
+        if _in_green_thread():
+            return tpool.execute(timed)
+        return timed()
+    finally:
+        with _lock:
+            _stats["in_flight"] -= 1
+
+def hash_password(password):
+    return _run(lambda: bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8'))
+
+def check_password(password, hashed):
+    return _run(lambda: bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8')))
+
+# Per worker process.
+def password_pool_stats():
+    with _lock:
+        stats = dict(_stats)
+    completed = stats["completed"]
+    return {
+        "pool_size": PASSWORD_POOL_SIZE,
+        "queue_max": PASSWORD_QUEUE_MAX,
+        "in_flight": stats["in_flight"],
+        "running": stats["running"],
+        "queued": stats["in_flight"] - stats["running"],
+        "completed": completed,
+        "rejected": stats["rejected"],
+        "mean_wait_ms": round(stats["total_wait"] * 1000 / completed, 3) if completed else 0,
+        "max_wait_ms": round(stats["max_wait"] * 1000, 3),
+        "mean_run_ms": round(stats["total_run"] * 1000 / completed, 3) if completed else 0,
+    }
@@ -1,92 +1,42 @@
 import os
-import shutil
-from sqlalchemy import text
-from flask import flash, redirect, url_for, session, request, render_template, current_app
+import json
+import mimetypes
+from datetime import datetime
+from flask import flash, redirect, url_for, session, request, render_template, jsonify
 from werkzeug.utils import secure_filename
-import resend
-
-SENDGRID_KEY = os.environ.get('SENDGRID_KEY')
-SENDGRID_EMAIL = os.environ.get('SENDGRID_EMAIL')
-
-def _check_and_get_unique_path(fs_save_path):
-    if not os.path.exists(fs_save_path):
-        return fs_save_path, os.path.basename(fs_save_path)
-    directory, filename = os.path.split(fs_save_path)
-    filename_base, extension = os.path.splitext(filename)
-    counter = 1
-    while True:
-        new_filename = f"{filename_base}({counter}){extension}"
-        new_fs_save_path = os.path.join(directory, new_filename)
-        if not os.path.exists(new_fs_save_path):
-            return new_fs_save_path, new_filename
-        counter += 1
-
-def _get_upload_paths(project_name, original_filename):
-    sanitized_project_name = secure_filename(str(project_name))[:50]
-    safe_filename = secure_filename(original_filename)
-    base_upload_dir = current_app.config['UPLOAD_DIR']
-    fs_upload_dir = os.path.join(base_upload_dir, sanitized_project_name)
-    os.makedirs(fs_upload_dir, exist_ok=True)
-    fs_save_path = os.path.join(fs_upload_dir, safe_filename)
-    final_fs_save_path, final_filename = _check_and_get_unique_path(fs_save_path)
-    url_path = f"/uploads/{sanitized_project_name}/{final_filename}"
-    return (final_fs_save_path, url_path)
-
-def _get_project_participants_emails(project_id, engine):
-    emails = set()
-    try:
-        with engine.connect() as conn:
-            query = text("""
-                SELECT u.email
-                FROM users u
-                JOIN projects p ON u.id = p.user_id
-                WHERE p.id = :project_id
-
-                UNION
-
-                SELECT u.email
-                FROM users u
-                JOIN team_members tm ON u.id = tm.user_id
-                JOIN teams t ON tm.team_id = t.id
-                WHERE t.project_id = :project_id
-
-                UNION
-
-                SELECT u.email
-                FROM users u
-                JOIN instructor_projects ip ON u.id = ip.instructor_id
-                WHERE ip.project_id = :project_id
-
-                UNION
-
-                SELECT i.email
-                FROM users i
-                JOIN users s ON i.id = s.instructor_id
-                JOIN team_members tm ON s.id = tm.user_id
-                JOIN teams t ON tm.team_id = t.id
-                WHERE t.project_id = :project_id
-            """)
-            result = conn.execute(query, {"project_id": project_id}).mappings().all()
-            for row in result:
-                emails.add(row['email'])
-    except Exception as e:
-        print(f"Error getting project participant emails: {e}")
-    
-    return emails
+from . import queries
+from .db import connect, write
+from .pagination import encode_cursor, decode_cursor
+from .search import fts_query, highlighted
+from .history import history_page
+from .outbox import email_enabled
+from .notifications import record_comment_events
+from .loaders import load_team_members, load_comment_attachments
+from .acl import project_access, project_participants, invalidate_project
+from .blobs import store_upload, rename_upload, release_uploads
+
+def _upload_folder(project_name):
+    return secure_filename(str(project_name))[:50]
+
+def _add_attachments(conn, owner_type, owner_id, project_id, paths):
+    now = datetime.utcnow()
+    for path in paths:
+        conn.execute(queries.INSERT_ATTACHMENT, {
+            "owner_type": owner_type,
+            "owner_id": owner_id,
+            "project_id": project_id,
+            "path": path,
+            "mime": mimetypes.guess_type(path)[0],
+            "now": now
+        })
+
+def _attachment_ids(values):
+    return [int(value) for value in values if value.isdigit()]
 
 def get_project_by_id(project_id, engine):
     try:
-        with engine.connect() as connection:
-            query = text("""
-                SELECT 
-                    p.id, p.name, p.description, p.status, 
-                    p.project_link, p.github_link, p.attachment_path,
-                    u.name as business_name, u.role, u.id as user_id
-                FROM projects p
-                JOIN users u ON p.user_id = u.id
-                WHERE p.id = :project_id
-            """)
-            result = connection.execute(query, {"project_id": project_id}).mappings().first()
+        with connect(engine) as connection:
+            result = connection.execute(queries.PROJECT_BY_ID, {"project_id": project_id}).mappings().first()
             return result
     except Exception as e:
         print(f"Database error fetching project by ID: {e}")
@@ -117,31 +67,26 @@ def create_project(request, engine):
     for file in files:
         if file and file.filename:
             try:
-                fs_save_path, url_path = _get_upload_paths(project_name, file.filename)
-                file.save(fs_save_path)
-                attachment_paths.append(url_path) 
+                attachment_paths.append(store_upload(engine, file, _upload_folder(project_name)))
             except Exception as e:
+                release_uploads(engine, attachment_paths)
                 flash(f"Error saving file {file.filename}: {e}", "danger")
                 return redirect(url_for('business_profile', user_id=session['user_id']))
 
-    attachment_path_str = ";".join(attachment_paths) if attachment_paths else None
-
     try:
-        with engine.connect() as connection:
-            insert_query = text(
-                "INSERT INTO projects (user_id, name, description, status, attachment_path) VALUES (:user_id, :name, :description, :status, :attachment_path)"
-            )
+        with connect(engine) as connection:
             params = {
                 "user_id": user_id,
                 "name": project_name,
                 "description": project_description,
-                "status": status,
-                "attachment_path": attachment_path_str 
+                "status": status
             }
-            connection.execute(insert_query, params)
+            project_id = connection.execute(queries.INSERT_PROJECT, params).scalar()
+            _add_attachments(connection, 'project', project_id, project_id, attachment_paths)
             connection.commit()
             flash("New project created successfully!", "success")
     except Exception as e:
+        release_uploads(engine, attachment_paths)
         flash(f"An error occurred while creating the project: {e}", "danger")
 
     return redirect(url_for('business_profile', user_id=session['user_id']))
@@ -164,65 +109,37 @@ def approve_project(project_id, engine):
         return redirect(url_for('project_page', project_id=project_id))
 
     try:
-        with engine.connect() as connection:
+        with connect(engine) as connection:
             with connection.begin():
                 if new_status == 2:
-                    clear_other_instructors_query = text("""
-                        DELETE FROM instructor_projects
-                        WHERE project_id = :project_id AND instructor_id != :instructor_id
-                    """)
-                    connection.execute(clear_other_instructors_query, {
+                    connection.execute(queries.CLEAR_OTHER_PROJECT_INSTRUCTORS, {
                         "project_id": project_id,
                         "instructor_id": instructor_id
                     })
 
-                    upsert_query = text("""
-                        INSERT INTO instructor_projects (instructor_id, project_id, status)
-                        VALUES (:instructor_id, :project_id, :status)
-                        ON CONFLICT(instructor_id, project_id) DO UPDATE SET status = :status
-                    """)
-                    connection.execute(upsert_query, {
+                    connection.execute(queries.UPSERT_INSTRUCTOR_PROJECT, {
                         "instructor_id": instructor_id,
                         "project_id": project_id,
                         "status": new_status
                     })
 
                 elif new_status == 1:
-                    upsert_query = text("""
-                        INSERT INTO instructor_projects (instructor_id, project_id, status)
-                        VALUES (:instructor_id, :project_id, :status)
-                        ON CONFLICT(instructor_id, project_id) DO UPDATE SET status = :status
-                    """)
-                    connection.execute(upsert_query, {
+                    connection.execute(queries.UPSERT_INSTRUCTOR_PROJECT, {
                         "instructor_id": instructor_id,
                         "project_id": project_id,
                         "status": new_status
                     })
                 elif new_status == 4:
-                    update_students_query = text("""
-                        UPDATE users 
-                        SET role = 2
-                        WHERE role = 3 AND id IN (
-                            SELECT tm.user_id 
-                            FROM team_members tm 
-                            JOIN teams t ON tm.team_id = t.id 
-                            WHERE t.project_id = :project_id
-                        )
-                    """)
-                    connection.execute(update_students_query, {"project_id": project_id})
+                    connection.execute(queries.GRADUATE_PROJECT_STUDENTS, {"project_id": project_id})
 
                 else:  
-                    delete_query = text("""
-                        DELETE FROM instructor_projects
-                        WHERE instructor_id = :instructor_id AND project_id = :project_id
-                    """)
-                    connection.execute(delete_query, {
+                    connection.execute(queries.DELETE_INSTRUCTOR_PROJECT, {
                         "instructor_id": instructor_id,
                         "project_id": project_id
                     })
 
-                update_project_query = text("UPDATE projects SET status = :status WHERE id = :project_id")
-                connection.execute(update_project_query, {"status": new_status, "project_id": project_id})
+                connection.execute(queries.UPDATE_PROJECT_STATUS, {"status": new_status, "project_id": project_id})
+            invalidate_project(project_id)
 
             status_messages = {
                 2: ("Project approved. You are now the sole approver.", "success"),
@@ -244,112 +161,91 @@ def get_projects_for_user(engine):
 
     user_id = session['user_id']
     try:
-        with engine.connect() as connection:
-            project_query = text("""
-                SELECT
-                    p.id, p.name, p.description, p.status,
-                    u.name, u.role,
-                    COUNT(t.id) AS team_count
-                FROM projects p
-                JOIN users u ON p.user_id = u.id
-                LEFT JOIN teams t ON p.id = t.project_id
-                WHERE p.user_id = :user_id
-                GROUP BY p.id
-                ORDER BY p.id DESC
-            """)
-            projects = connection.execute(project_query, {"user_id": user_id}).mappings().all()
+        with connect(engine) as connection:
+            projects = connection.execute(queries.USER_PROJECTS, {"user_id": user_id}).mappings().all()
             return projects
 
     except Exception as e:
         print(f"Database error fetching user projects: {e}")
         return []
 
-def get_all_projects(engine, session, page=1, per_page=12, search_query=None, status_filter=None, sort_order='desc'):
+def get_all_projects(engine, session, per_page=12, search_query=None, status_filter=None, sort_order='desc', cursor=None):
     try:
-        offset = (page - 1) * per_page
         user_role = session.get('role')
         user_id = session.get('user_id')
+        direction = "ASC" if sort_order == 'asc' else "DESC"
         
-        where_clauses = []
         params = {
-            "per_page": per_page,
-            "offset": offset
+            "limit": per_page + 1
         }
 
-        if search_query:
-            where_clauses.append("(p.name LIKE :search OR u.name LIKE :search)")
-            params["search"] = f"%{search_query}%"
+        search = fts_query(search_query)
+        if search:
+            params["search"] = search
 
+        has_status = False
         if status_filter is not None and status_filter != '':
             try:
-                status_val = int(status_filter)
-                where_clauses.append("p.status = :status_val")
-                params["status_val"] = status_val
+                params["status_val"] = int(status_filter)
+                has_status = True
             except ValueError:
                 pass 
 
-        direction = "ASC" if sort_order == 'asc' else "DESC"
-        order_by_clause = f"ORDER BY p.id {direction}"
-
-        if user_role == 3:
-            with engine.connect() as conn:
-                instructor_query = text("SELECT instructor_id FROM users WHERE id = :user_id")
-                result = conn.execute(instructor_query, {"user_id": user_id}).first()
+        student = user_role == 3
+        if student:
+            with connect(engine) as conn:
+                result = conn.execute(queries.USER_INSTRUCTOR, {"user_id": user_id}).first()
                 
                 if not result or not result.instructor_id:
-                    return []
+                    return [], None
                 
-                instructor_id = result.instructor_id
-                params["instructor_id"] = instructor_id
-
-            where_clauses.append("ip.instructor_id = :instructor_id")
-            where_clauses.append("ip.status = 2")
-
-            where_str = " AND ".join(where_clauses)
-            query_text = f"""
-                SELECT p.id, p.name, p.description, p.status, u.name AS business_name, u.role
-                FROM projects p
-                JOIN users u ON p.user_id = u.id
-                JOIN instructor_projects ip ON p.id = ip.project_id
-                WHERE {where_str}
-                {order_by_clause}
-                LIMIT :per_page OFFSET :offset
-            """
-        else:
-            if status_filter is not None and status_filter != '':
-                 pass 
-            else:
-                 where_clauses.append("p.status IN (0, 1)")
-
-            where_str = " AND ".join(where_clauses) if where_clauses else "1=1"
-            
-            query_text = f"""
-                SELECT p.id, p.name, p.description, p.status, u.name AS business_name, u.role
-                FROM projects p
-                JOIN users u ON p.user_id = u.id
-                WHERE {where_str}
-                {order_by_clause}
-                LIMIT :per_page OFFSET :offset
-            """
-
-        with engine.connect() as connection:
-            query = text(query_text)
+                params["instructor_id"] = result.instructor_id
+
+        position = decode_cursor(cursor)
+        after = False
+        if search:
+            if position and position.get("search") == search and isinstance(position.get("id"), int):
+                params["after_score"] = position.get("score")
+                params["after_id"] = position["id"]
+                after = True
+        elif position and position.get("sort") == direction and isinstance(position.get("id"), int):
+            params["after_id"] = position["id"]
+            after = True
+
+        query = queries.PROJECT_FEED[(bool(search), student, has_status, after, None if search else direction)]
+        with connect(engine) as connection:
             projects = connection.execute(query, params).mappings().all()
-            return projects
+
+        next_cursor = None
+        if len(projects) > per_page:
+            projects = projects[:per_page]
+            if search:
+                next_cursor = encode_cursor({"id": projects[-1]['id'], "score": projects[-1]['score'], "search": search})
+            else:
+                next_cursor = encode_cursor({"id": projects[-1]['id'], "sort": direction})
+        if search:
+            projects = [
+                dict(project, name_hit=highlighted(project['name_hit']), description_hit=highlighted(project['description_hit']))
+                for project in projects
+            ]
+        return projects, next_cursor
             
     except Exception as e:
         print(f"Database error fetching all projects: {e}")
-        return []
+        return [], None
 
 def load_projects_html(engine):
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor', None)
     search = request.args.get('search', None)
     status = request.args.get('status', None)
     sort = request.args.get('sort', 'desc')
     
     per_page = 12 
-    projects = get_all_projects(engine, session, page=page, per_page=per_page, search_query=search, status_filter=status, sort_order=sort)
-    return render_template('partials/projects_list.html', projects=projects)
+    projects, next_cursor = get_all_projects(engine, session, per_page=per_page, search_query=search, status_filter=status, sort_order=sort, cursor=cursor)
+    return jsonify({
+        "html": render_template('partials/projects_list.html', projects=projects),
+        "next_cursor": next_cursor
+    })
 
 def check_if_user_can_edit_links(user_id, project, engine):
     if not user_id:
@@ -358,15 +254,7 @@ def check_if_user_can_edit_links(user_id, project, engine):
     if user_id == project.user_id:
         return True
     
-    with engine.connect() as conn:
-        query = text("""
-            SELECT 1 FROM team_members tm
-            JOIN teams t ON tm.team_id = t.id
-            WHERE tm.user_id = :user_id AND t.project_id = :project_id
-            LIMIT 1
-        """)
-        result = conn.execute(query, {"user_id": user_id, "project_id": project.id}).first()
-        return result is not None
+    return project_access(user_id, project.id, engine)['member']
 
 
 def update_project_links(project_id, engine):
@@ -385,14 +273,12 @@ def update_project_links(project_id, engine):
     github_link = request.form.get('github_link', '')
 
     try:
-        with engine.connect() as conn:
-            query = text("UPDATE projects SET project_link = :project_link, github_link = :github_link WHERE id = :project_id")
-            conn.execute(query, {
-                "project_link": project_link,
-                "github_link": github_link,
-                "project_id": project_id
-            })
-            conn.commit()
+        params = {
+            "project_link": project_link,
+            "github_link": github_link,
+            "project_id": project_id
+        }
+        write(engine, lambda conn: conn.execute(queries.UPDATE_PROJECT_LINKS, params))
         flash("Project links updated successfully!", "success")
     except Exception as e:
         flash(f"An error occurred: {e}", "danger")
@@ -404,43 +290,14 @@ def get_projects_for_student(engine):
         return []
     user_id = session['user_id']
     try:
-        with engine.connect() as conn:
-            student_teams_query = text("""
-                SELECT p.id as project_id, p.name as project_name, p.description as project_description,
-                       t.id as team_id, t.name as team_name
-                FROM team_members tm
-                JOIN teams t ON tm.team_id = t.id
-                JOIN projects p ON t.project_id = p.id
-                WHERE tm.user_id = :user_id AND p.status IN (1, 2, 3, 4)
-            """)
-            student_project_info = conn.execute(student_teams_query, {"user_id": user_id}).mappings().all()
-            assignments = []
-            for info in student_project_info:
-                team_members_query = text("SELECT u.email FROM team_members tm JOIN users u ON tm.user_id = u.id WHERE tm.team_id = :team_id ORDER BY u.email")
-                members_result = conn.execute(team_members_query, {"team_id": info['team_id']}).mappings().all()
-                assignment_data = dict(info)
-                assignment_data['members'] = members_result
-                assignments.append(assignment_data)
-            return assignments
+        with connect(engine) as conn:
+            student_project_info = conn.execute(queries.STUDENT_PROJECT_TEAMS, {"user_id": user_id}).mappings().all()
+            members = load_team_members(conn, [info['team_id'] for info in student_project_info])
+            return [{**info, 'members': members[info['team_id']]} for info in student_project_info]
     except Exception as e:
         print(f"Database error fetching student projects: {e}")
         return []
 
-def get_teams_for_project(project_id, engine):
-    try:
-        with engine.connect() as conn:
-            teams_query = text("SELECT id, name FROM teams WHERE project_id = :project_id ORDER BY name")
-            teams_result = conn.execute(teams_query, {"project_id": project_id}).mappings().all()
-            teams_with_members = []
-            for team in teams_result:
-                members_query = text("SELECT u.name, u.email FROM team_members tm JOIN users u ON tm.user_id = u.id WHERE tm.team_id = :team_id ORDER BY u.email")
-                members_result = conn.execute(members_query, {"team_id": team['id']}).mappings().all()
-                teams_with_members.append({"name": team['name'], "members": members_result})
-            return teams_with_members
-    except Exception as e:
-        print(f"Database error fetching teams for project: {e}")
-        return []
-
 def update_project(project_id, request, engine):
     if 'user_id' not in session:
         flash("You must be logged in to update a project.", "warning")
@@ -458,27 +315,7 @@ def update_project(project_id, request, engine):
         flash("Project name and description cannot be empty.", "danger")
         return redirect(url_for('project_page', project_id=project_id))
 
-    files_to_delete = request.form.getlist('files_to_delete')
-    
-    current_paths = []
-    if project.attachment_path:
-        current_paths = project.attachment_path.split(';')
-
-    paths_to_keep = []
-    
-    if files_to_delete:
-        for path in current_paths:
-            if path in files_to_delete:
-                try:
-                    file_path = os.path.join('.', path.lstrip('/'))
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
-                except Exception as e:
-                    print(f"Error deleting old file {path}: {e}")
-            else:
-                paths_to_keep.append(path)
-    else:
-        paths_to_keep = current_paths
+    files_to_delete = _attachment_ids(request.form.getlist('files_to_delete'))
 
     new_files = request.files.getlist('attachment')
     new_paths = []
@@ -486,35 +323,33 @@ def update_project(project_id, request, engine):
         for file in new_files:
             if file and file.filename:
                 try:
-                    fs_save_path, url_path = _get_upload_paths(project.name, file.filename)
-                    file.save(fs_save_path)
-                    new_paths.append(url_path)
+                    new_paths.append(store_upload(engine, file, _upload_folder(project.name)))
                 except Exception as e:
+                    release_uploads(engine, new_paths)
                     flash(f"Error saving new file {file.filename}: {e}", "danger")
                     return redirect(url_for('project_page', project_id=project_id))
 
-    final_paths = paths_to_keep + new_paths
-    final_attachment_path_str = ";".join(final_paths) if final_paths else None
-    
-
     try:
-        with engine.connect() as connection:
-            update_query = text("""
-                UPDATE projects 
-                SET name = :name, description = :description, attachment_path = :attachment_path 
-                WHERE id = :project_id AND user_id = :user_id
-            """)
+        with connect(engine) as connection:
             params = {
                 "name": new_name, 
                 "description": new_description, 
-                "attachment_path": final_attachment_path_str,
                 "project_id": project_id, 
                 "user_id": session['user_id']
             }
-            connection.execute(update_query, params)
+            connection.execute(queries.UPDATE_PROJECT, params)
+            paths_to_delete = []
+            if files_to_delete:
+                paths_to_delete = connection.execute(queries.DELETE_PROJECT_ATTACHMENTS, {
+                    "project_id": project_id,
+                    "attachment_ids": files_to_delete
+                }).scalars().all()
+            _add_attachments(connection, 'project', project_id, project_id, new_paths)
             connection.commit()
-            flash("Project updated successfully!", "success")
+        release_uploads(engine, paths_to_delete)
+        flash("Project updated successfully!", "success")
     except Exception as e:
+        release_uploads(engine, new_paths)
         flash(f"An error occurred while updating the project: {e}", "danger")
         
     return redirect(url_for('project_page', project_id=project_id))
@@ -531,27 +366,12 @@ def delete_project(project_id, engine):
         return redirect(url_for('project_page', project_id=project_id))
         
     try:
-        project_name = project.name 
-
-        with engine.connect() as connection:
-            delete_query = text("DELETE FROM projects WHERE id = :project_id AND user_id = :user_id")
-            connection.execute(delete_query, {"project_id": project_id, "user_id": session['user_id']})
+        with connect(engine) as connection:
+            upload_paths = connection.execute(queries.PROJECT_UPLOAD_PATHS, {"project_id": project_id}).scalars().all()
+            connection.execute(queries.DELETE_PROJECT, {"project_id": project_id, "user_id": session['user_id']})
             connection.commit()
 
-        try:
-            sanitized_project_name = secure_filename(str(project_name))[:50]
-            fs_upload_dir = os.path.join('.', 'uploads', sanitized_project_name)
-            
-            if os.path.isdir(fs_upload_dir):
-                shutil.rmtree(fs_upload_dir)
-            else:
-                pass
-                
-        except Exception as file_e:
-            print(f"Error deleting project directory: {file_e}")
-            flash("Project deleted, but an error occurred while cleaning up associated files.", "warning")
-            return redirect(url_for('profile'))
-            
+        release_uploads(engine, upload_paths)
         flash("Project deleted successfully.", "success")
 
     except Exception as db_e:
@@ -564,30 +384,8 @@ def check_if_user_can_chat(user_id, project_id, engine):
     if not user_id:
         return False
 
-    with engine.connect() as conn:
-        owner_query = text("SELECT 1 FROM projects WHERE id = :project_id AND user_id = :user_id")
-        if conn.execute(owner_query, {"project_id": project_id, "user_id": user_id}).first():
-            return True
-
-        student_member_query = text("""
-            SELECT 1 FROM team_members tm
-            JOIN teams t ON tm.team_id = t.id
-            WHERE tm.user_id = :user_id AND t.project_id = :project_id
-        """)
-        if conn.execute(student_member_query, {"user_id": user_id, "project_id": project_id}).first():
-            return True
-
-        instructor_query = text("""
-            SELECT 1 FROM users AS instructor
-            JOIN users AS student ON instructor.id = student.instructor_id
-            JOIN team_members tm ON student.id = tm.user_id
-            JOIN teams t ON tm.team_id = t.id
-            WHERE instructor.id = :user_id AND t.project_id = :project_id
-        """)
-        if conn.execute(instructor_query, {"user_id": user_id, "project_id": project_id}).first():
-            return True
-
-    return False
+    access = project_access(user_id, project_id, engine)
+    return access['owner'] or access['member'] or access['instructor']
 
 def check_if_user_can_comment(user_id, project, engine):
     if not user_id:
@@ -599,112 +397,60 @@ def check_if_user_can_comment(user_id, project, engine):
     if session.get('role') == 0 and project.status in [1, 2, 3, 4]:
         return True
 
-    with engine.connect() as conn:
-        query = text("""
-            SELECT 1 FROM team_members tm
-            JOIN teams t ON tm.team_id = t.id
-            WHERE tm.user_id = :user_id AND t.project_id = :project_id
-            LIMIT 1
-        """)
-        result = conn.execute(query, {"user_id": user_id, "project_id": project.id}).first()
-        if result:
-            return True
+    return project_access(user_id, project.id, engine)['member']
 
-    return False
+PROJECT_FIELDS = (
+    "id", "name", "description", "status", "project_link", "github_link",
+    "business_name", "role", "user_id",
+)
 
-def get_comments_for_project(project_id, engine, session):
+# Everything the project page renders, read on one connection: the project,
+# the viewer's permissions and the teams with their members in one statement
+# (members aggregated as JSON), the project's files and their total size,
+# then the comments the viewer may see with their files and, for people in
+# the room, the newest page of the chat.
+def load_project_page(project_id, engine, session):
     user_id = session.get('user_id')
-    user_role = session.get('role')
-
-    if not user_id:
-        return [] 
+    role = session.get('role')
+    params = {"project_id": project_id, "user_id": user_id, "role": role}
 
     try:
-        with engine.connect() as conn:
-            owner_id_query = text("SELECT user_id FROM projects WHERE id = :project_id")
-            project_owner_id = conn.execute(owner_id_query, {"project_id": project_id}).scalar()
-
-            if not project_owner_id:
-                print(f"Error: Project {project_id} not found for fetching comments.")
-                return []
-
-            query_base = """
-                SELECT c.id, c.comment, c.created_at, c.attachment_path,
-                       u.name, u.email, u.role, c.user_id
-                FROM comments c
-                JOIN users u ON c.user_id = u.id
-                WHERE c.project_id = :project_id
-            """
-            
-            if user_id == project_owner_id:
-                query_sql = f"{query_base} ORDER BY c.created_at ASC"
-                params = {"project_id": project_id}
-
-            elif user_role == 0:
-                query_sql = f"""
-                    {query_base}
-                    AND (
-                        c.user_id = :project_owner_id  
-                        OR c.user_id = :current_user_id 
-                        OR (u.role = 3 AND c.user_id IN ( 
-                            SELECT tm.user_id
-                            FROM team_members tm
-                            JOIN teams t ON tm.team_id = t.id
-                            WHERE t.project_id = :project_id
-                        ))
-                    )
-                    ORDER BY c.created_at ASC
-                """
-                params = {
-                    "project_id": project_id,
-                    "project_owner_id": project_owner_id,
-                    "current_user_id": user_id
-                }
-
-            elif user_role == 3:
-                team_id_query = text("""
-                    SELECT tm.team_id
-                    FROM team_members tm
-                    JOIN teams t ON tm.team_id = t.id
-                    WHERE tm.user_id = :current_user_id AND t.project_id = :project_id
-                    LIMIT 1
-                """)
-                team_id = conn.execute(team_id_query, {"current_user_id": user_id, "project_id": project_id}).scalar()
-
-                instructor_id_query = text("SELECT instructor_id FROM users WHERE id = :current_user_id")
-                instructor_id = conn.execute(instructor_id_query, {"current_user_id": user_id}).scalar()
-
-                query_conditions = ["c.user_id = :project_owner_id"]
-                params = {"project_id": project_id, "project_owner_id": project_owner_id, "current_user_id": user_id}
-
-                if instructor_id:
-                    query_conditions.append("c.user_id = :instructor_id")
-                    params["instructor_id"] = instructor_id
-                
-                if team_id:
-                    query_conditions.append("c.user_id IN (SELECT user_id FROM team_members WHERE team_id = :team_id)")
-                    params["team_id"] = team_id
-                else:
-                    query_conditions.append("c.user_id = :current_user_id")
-
-                query_sql = f"""
-                    {query_base}
-                    AND (
-                        {' OR '.join(query_conditions)}
-                    )
-                    ORDER BY c.created_at ASC
-                """
-
-            else:
-                return [] 
-
-            result = conn.execute(text(query_sql), params).mappings().all()
-            return result
-            
+        with connect(engine) as conn:
+            row = conn.execute(queries.PROJECT_PAGE, params).mappings().first()
+            if not row:
+                return None
+
+            is_owner = user_id == row['user_id']
+            is_member = bool(row['is_member'])
+            can_chat = is_owner or is_member or bool(row['is_instructor'])
+
+            attachments = conn.execute(queries.PROJECT_ATTACHMENTS, params).mappings().all()
+            storage = conn.execute(queries.PROJECT_STORAGE, params).mappings().first()
+            comments = conn.execute(queries.PROJECT_PAGE_COMMENTS, params).mappings().all() if user_id else []
+            comment_attachments = load_comment_attachments(conn, [comment['id'] for comment in comments])
+            chat_history, chat_has_more = history_page(conn, 'project', project_id) if can_chat else ([], False)
     except Exception as e:
-        print(f"Database error fetching comments: {e}")
-        return []
+        print(f"Database error loading project page: {e}")
+        return None
 
+    teams = sorted(json.loads(row['teams']), key=lambda team: team['name'])
+    for team in teams:
+        team['members'].sort(key=lambda member: member['email'])
+
+    project = {field: row[field] for field in PROJECT_FIELDS}
+    project['attachments'] = attachments
+    project['storage'] = storage
+    return {
+        "project": project,
+        "teams": teams,
+        "comments": [dict(comment, attachments=comment_attachments[comment['id']]) for comment in comments],
+        "chat_history": chat_history,
+        "chat_has_more": chat_has_more,
+        "can_chat": can_chat,
+        "can_edit_links": is_owner or is_member,
+        "can_comment": is_owner or is_member or (role == 0 and project['status'] in [1, 2, 3, 4]),
+        "is_pending_by_current_instructor": role == 0 and bool(row['is_pending']),
+    }
 
 def add_comment_to_project(project_id, request, engine):
     user_id = session.get('user_id')
@@ -732,79 +478,43 @@ def add_comment_to_project(project_id, request, engine):
     for file in files:
         if file and file.filename:
             try:
-                fs_save_path, url_path = _get_upload_paths(project.name, file.filename)
-                file.save(fs_save_path)
-                attachment_paths.append(url_path)
+                attachment_paths.append(store_upload(engine, file, _upload_folder(project.name)))
             except Exception as e:
+                release_uploads(engine, attachment_paths)
                 flash(f"Error saving file {file.filename}: {e}", "danger")
                 return redirect(url_for('project_page', project_id=project_id))
 
-    attachment_path_str = ";".join(attachment_paths) if attachment_paths else None
+    # Participants other than the commenter get the comment in their next
+    # digest for this project (see api/notifications.py), recorded in the
+    # same transaction as the comment.
+    recipients = set()
+    if email_enabled():
+        try:
+            recipients = project_participants(project_id, engine) - {user_id}
+            project_url = url_for('project_page', project_id=project_id, _external=True)
+        except Exception as e:
+            print(f"Comment notification could not be prepared: {e}")
+            recipients = set()
+
+    def insert_comment(conn):
+        comment_id = conn.execute(queries.INSERT_COMMENT, params).scalar()
+        _add_attachments(conn, 'comment', comment_id, project_id, attachment_paths)
+        if recipients:
+            record_comment_events(conn, comment_id, project_id, recipients, project_url)
 
     try:
-        with engine.connect() as conn:
-            query = text("""
-                INSERT INTO comments (user_id, project_id, comment, attachment_path)
-                VALUES (:user_id, :project_id, :comment, :attachment_path)
-            """)
-            conn.execute(query, {
-                "user_id": user_id,
-                "project_id": project_id,
-                "comment": comment_text,
-                "attachment_path": attachment_path_str
-            })
-            conn.commit()
-            flash("Comment added successfully.", "success")
+        params = {
+            "user_id": user_id,
+            "project_id": project_id,
+            "comment": comment_text
+        }
+        write(engine, insert_comment)
+        flash("Comment added successfully.", "success")
     except Exception as e:
+        release_uploads(engine, attachment_paths)
         flash(f"An error occurred while posting your comment: {e}", "danger")
         return redirect(url_for('project_page', project_id=project_id))
 
-    try:
-        if not SENDGRID_KEY:
-            return redirect(url_for('project_page', project_id=project_id))
-        
-        commenter_name = ""
-        commenter_email = ""
-        with engine.connect() as conn:
-            commenter_query = text("SELECT name, email FROM users WHERE id = :user_id")
-            commenter = conn.execute(commenter_query, {"user_id": user_id}).mappings().first()
-            if commenter:
-                commenter_name = commenter.name if commenter.name else commenter.email
-                commenter_email = commenter.email
-
-        recipients = _get_project_participants_emails(project_id, engine)
-        
-        recipients.discard(commenter_email)
-
-        if recipients:
-            project_url = url_for('project_page', project_id=project_id, _external=True)
-            project_name = project.name
-            subject = f"New comment on project: {project_name}"
-            
-            html_content = f"""
-            <p>Hello,</p>
-            <p><strong>{commenter_name}</strong> just posted a new comment on the project: <strong>{project_name}</strong>.</p>
-            <p><strong>Comment:</strong></p>
-            <blockquote style="border-left: 2px solid #ccc; padding-left: 10px; margin-left: 5px; font-style: italic;">
-                {comment_text}
-            </blockquote>
-            <p>You can view the comment and reply here:</p>
-            <p><a href="{project_url}">{project_url}</a></p>
-            <p>Thank you,</p>
-            <p>The Project Portal</p>
-            """
-            
-            resend.api_key = SENDGRID_KEY
-            r = resend.Emails.send({
-                "from": SENDGRID_EMAIL,
-                "to": SENDGRID_EMAIL, 
-                "bcc": list(recipients), 
-                "subject": subject,
-                "html": html_content
-            })
-        
-    except Exception as e:
-        print(f"CRITICAL: Comment saved but email notification failed: {e}")
     return redirect(url_for('project_page', project_id=project_id))
 
 def delete_comment_on_project(project_id, comment_id, engine):
@@ -813,57 +523,39 @@ def delete_comment_on_project(project_id, comment_id, engine):
         flash("You must be logged in to delete a comment.", "warning")
         return redirect(url_for('project_page', project_id=project_id))
 
+    is_instructor = (session.get('role') == 0)
+
+    # Returns (attachment paths, None) once deleted, or (None, the reason
+    # the comment was not deleted).
+    def delete_comment(conn):
+        comment = conn.execute(queries.COMMENT_FOR_DELETE, {
+            "comment_id": comment_id, 
+            "project_id": project_id
+        }).mappings().first()
+
+        if not comment:
+            return None, "Comment not found."
+
+        is_my_comment = (comment.comment_owner_id == user_id)
+        is_student_comment = (comment.comment_role == 3)
+        is_owner_comment = (comment.comment_role == 1) 
+
+        if not is_my_comment and not (is_instructor and (is_student_comment or is_owner_comment)):
+            return None, "You do not have permission to delete this comment."
+        
+        paths = conn.execute(queries.DELETE_COMMENT_ATTACHMENTS, {"comment_id": comment_id}).scalars().all()
+        conn.execute(queries.DELETE_COMMENT, {"comment_id": comment_id})
+        return paths, None
+
     try:
-        with engine.connect() as conn:
-            with conn.begin(): 
-                
-                query_details = text("""
-                    SELECT 
-                        c.user_id AS comment_owner_id, 
-                        c.attachment_path, 
-                        u.role AS comment_role,
-                        p.user_id AS project_owner_id
-                    FROM comments c
-                    JOIN users u ON c.user_id = u.id
-                    JOIN projects p ON c.project_id = p.id
-                    WHERE c.id = :comment_id AND c.project_id = :project_id
-                """)
-                comment = conn.execute(query_details, {
-                    "comment_id": comment_id, 
-                    "project_id": project_id
-                }).mappings().first()
-
-                if not comment:
-                    flash("Comment not found.", "danger")
-                    return redirect(url_for('project_page', project_id=project_id))
+        paths, error = write(engine, delete_comment)
+        if error:
+            flash(error, "danger")
+            return redirect(url_for('project_page', project_id=project_id))
 
-                is_my_comment = (comment.comment_owner_id == user_id)
-                is_instructor = (session.get('role') == 0)
-                is_student_comment = (comment.comment_role == 3)
-                is_owner_comment = (comment.comment_role == 1) 
+        release_uploads(engine, paths)
+        flash("Comment deleted successfully.", "success")
 
-                if not is_my_comment and not (is_instructor and (is_student_comment or is_owner_comment)):
-                    flash("You do not have permission to delete this comment.", "danger")
-                    return redirect(url_for('project_page', project_id=project_id))
-                
-                if comment.attachment_path:
-                    paths_to_delete = comment.attachment_path.split(';')
-                    for path in paths_to_delete:
-                        if not path: continue
-                        try:
-                            file_path = os.path.join('.', path.lstrip('/'))
-                            if os.path.exists(file_path):
-                                os.remove(file_path)
-                            else:
-                                print(f"Warning: File not found, cannot delete: {file_path}")
-                        except Exception as e:
-                            print(f"Error deleting file {path}: {e}")
-
-                delete_query = text("DELETE FROM comments WHERE id = :comment_id")
-                conn.execute(delete_query, {"comment_id": comment_id})
-                
-                flash("Comment deleted successfully.", "success")
-                
     except Exception as e:
         flash(f"An error occurred while deleting the comment: {e}", "danger")
 
@@ -884,27 +576,7 @@ def instructor_manage_files(project_id, request, engine):
         return redirect(url_for('project_page', project_id=project_id))
 
     try:
-        files_to_delete = request.form.getlist('files_to_delete')
-        
-        current_paths = []
-        if project.attachment_path:
-            current_paths = project.attachment_path.split(';')
-
-        paths_to_keep = []
-        
-        if files_to_delete:
-            for path in current_paths:
-                if path in files_to_delete:
-                    try:
-                        file_path = os.path.join('.', path.lstrip('/'))
-                        if os.path.exists(file_path):
-                            os.remove(file_path)
-                    except Exception as e:
-                        print(f"Error deleting old file {path}: {e}")
-                else:
-                    paths_to_keep.append(path)
-        else:
-            paths_to_keep = current_paths
+        files_to_delete = _attachment_ids(request.form.getlist('files_to_delete'))
 
         new_files = request.files.getlist('attachment')
         new_paths = []
@@ -912,25 +584,24 @@ def instructor_manage_files(project_id, request, engine):
             for file in new_files:
                 if file and file.filename:
                     try:
-                        fs_save_path, url_path = _get_upload_paths(project.name, file.filename)
-                        file.save(fs_save_path)
-                        new_paths.append(url_path)
+                        new_paths.append(store_upload(engine, file, _upload_folder(project.name)))
                     except Exception as e:
+                        release_uploads(engine, new_paths)
                         flash(f"Error saving new file {file.filename}: {e}", "danger")
                         return redirect(url_for('project_page', project_id=project_id))
 
-        final_paths = paths_to_keep + new_paths
-        final_attachment_path_str = ";".join(final_paths) if final_paths else None
+        def update_files(connection):
+            paths_to_delete = []
+            if files_to_delete:
+                paths_to_delete = connection.execute(queries.DELETE_PROJECT_ATTACHMENTS, {
+                    "project_id": project_id,
+                    "attachment_ids": files_to_delete
+                }).scalars().all()
+            _add_attachments(connection, 'project', project_id, project_id, new_paths)
+            return paths_to_delete
 
-        with engine.connect() as connection:
-            update_query = text("UPDATE projects SET attachment_path = :attachment_path WHERE id = :project_id")
-            params = {
-                "attachment_path": final_attachment_path_str,
-                "project_id": project_id
-            }
-            connection.execute(update_query, params)
-            connection.commit()
-            flash("Project files updated successfully!", "success")
+        release_uploads(engine, write(engine, update_files))
+        flash("Project files updated successfully!", "success")
 
     except Exception as e:
         flash(f"An error occurred while updating files: {e}", "danger")
@@ -944,6 +615,9 @@ def rename_project_attachment(project_id, request, engine):
     
     user_id = session.get('user_id')
     project = get_project_by_id(project_id, engine)
+    if not project:
+        flash("Project not found.", "danger")
+        return redirect(url_for('index'))
 
     is_owner = (project.user_id == user_id)
     is_instructor = (session.get('role') == 0)
@@ -968,29 +642,34 @@ def rename_project_attachment(project_id, request, engine):
             flash("Invalid new filename.", "danger")
             return redirect(url_for('project_page', project_id=project_id))
 
-        sanitized_project_name = secure_filename(str(project.name))[:50]
-        upload_dir = os.path.join('.', 'uploads', sanitized_project_name)
-        old_fs_path = os.path.join('.', old_path.lstrip('/'))
-        
-        new_fs_path_base = os.path.join(upload_dir, safe_new_filename)
-        final_fs_path, final_filename = _check_and_get_unique_path(new_fs_path_base)
-        new_url_path = f"/uploads/{sanitized_project_name}/{final_filename}"
-        
-        if os.path.exists(old_fs_path):
-            os.rename(old_fs_path, final_fs_path)
-        else:
+        with connect(engine) as conn:
+            attachment_id = conn.execute(queries.PROJECT_ATTACHMENT_BY_PATH, {"project_id": project_id, "path": old_path}).scalar()
+        if not attachment_id:
             flash("File not found. Cannot rename.", "danger")
             return redirect(url_for('project_page', project_id=project_id))
-            
-        with engine.connect() as conn:
-            current_paths = project.attachment_path.split(';')
-            new_paths_list = [new_url_path if p == old_path else p for p in current_paths]
-            new_paths_string = ";".join(new_paths_list)
-            
-            update_query = text("UPDATE projects SET attachment_path = :attachment_path WHERE id = :project_id")
-            conn.execute(update_query, {"attachment_path": new_paths_string, "project_id": project_id})
-            conn.commit()
-            
+
+        new_url_path = rename_upload(engine, old_path, _upload_folder(project.name), safe_new_filename)
+        if not new_url_path:
+            flash("File not found. Cannot rename.", "danger")
+            return redirect(url_for('project_page', project_id=project_id))
+        final_filename = new_url_path.split('/')[-1]
+
+        params = {
+            "attachment_id": attachment_id,
+            "old_path": old_path,
+            "new_path": new_url_path,
+            "mime": mimetypes.guess_type(new_url_path)[0]
+        }
+        renamed = write(engine, lambda conn: conn.execute(queries.RENAME_ATTACHMENT, params).first())
+        # rename_upload added a reference to the new name; the old one is
+        # dropped once the row points away from it (or, if the row changed in
+        # the meantime, the new one is).
+        if not renamed:
+            release_uploads(engine, [new_url_path])
+            flash("File not found. Cannot rename.", "danger")
+            return redirect(url_for('project_page', project_id=project_id))
+        release_uploads(engine, [old_path])
+
         flash(f"File renamed to {final_filename} successfully!", "success")
     
     except Exception as e:
@@ -0,0 +1,800 @@
+import os
+import threading
+import time
+from sqlalchemy import DateTime, bindparam, event, text
+
+# Every SQL statement the app runs, declared once and compiled at import.
+# Each one has a stable name ("<module>.<purpose>") carried as the
+# statement_name execution option, which instrument() uses to keep per-
+# statement call counts and latency. The SQL strings never change at run
+# time, so SQLite's prepared-statement cache (sized from the registry, see
+# statement_cache_size) keeps every one of them prepared. Queries with
+# optional filters are declared as a fixed set of variants instead of being
+# assembled per call.
+STATEMENTS = {}
+
+def statement(name, sql, *binds, **columns):
+    if name in STATEMENTS:
+        raise ValueError(f"Statement {name} is declared twice")
+    compiled = text(sql)
+    if binds:
+        compiled = compiled.bindparams(*binds)
+    if columns:
+        compiled = compiled.columns(**columns)
+    compiled = compiled.execution_options(statement_name=name)
+    STATEMENTS[name] = compiled
+    return compiled
+
+def statement_cache_size():
+    size = os.getenv("DB_STATEMENT_CACHE")
+    if size:
+        return int(size)
+    return max(128, len(STATEMENTS) + 32)
+
+# Timing. QUERY_SLOW_MS > 0 also prints every execution slower than that.
+QUERY_SLOW_MS = float(os.getenv("QUERY_SLOW_MS", "0"))
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+def _record(name, elapsed):
+    with _stats_lock:
+        entry = _stats.get(name)
+        if entry is None:
+            entry = _stats[name] = [0, 0.0, 0.0]
+        entry[0] += 1
+        entry[1] += elapsed
+        entry[2] = max(entry[2], elapsed)
+    if QUERY_SLOW_MS and elapsed * 1000 >= QUERY_SLOW_MS:
+        print(f"Slow query {name}: {elapsed * 1000:.1f} ms")
+
+def instrument(engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_timer(conn, cursor, sql, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def stop_timer(conn, cursor, sql, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        name = context.execution_options.get("statement_name") if context is not None else None
+        _record(name or "(unnamed)", time.perf_counter() - started)
+
+    @event.listens_for(engine, "handle_error")
+    def drop_timer(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_started"):
+            conn.info["query_started"].pop()
+
+def statement_stats():
+    with _stats_lock:
+        rows = [
+            {"name": name, "calls": calls, "total_ms": round(total * 1000, 3),
+             "mean_ms": round(total * 1000 / calls, 3), "max_ms": round(longest * 1000, 3)}
+            for name, (calls, total, longest) in _stats.items()
+        ]
+    return sorted(rows, key=lambda row: row["total_ms"], reverse=True)
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+# api/auth.py
+
+USER_EMAIL_EXISTS = statement("auth.user_email_exists", "SELECT email FROM users WHERE email = :email")
+INSERT_USER = statement("auth.insert_user", "INSERT INTO users (email, password, role, permission) VALUES (:email, :password, :role, :permission)")
+USER_BY_EMAIL = statement("auth.user_by_email", "SELECT id, email, password, role, permission FROM users WHERE email = :email")
+USER_ID_BY_EMAIL = statement("auth.user_id_by_email", "SELECT id FROM users WHERE email = :email")
+DELETE_USER_RESET_TOKENS = statement("auth.delete_user_reset_tokens", "DELETE FROM password_reset_tokens WHERE user_id = :user_id")
+INSERT_RESET_TOKEN = statement("auth.insert_reset_token", """
+    INSERT INTO password_reset_tokens (user_id, token, expires_at)
+    VALUES (:user_id, :token, :expires_at)
+    RETURNING id
+""")
+RESET_TOKEN = statement("auth.reset_token", """
+    SELECT user_id, expires_at FROM password_reset_tokens
+    WHERE token = :token
+""", expires_at=DateTime)
+DELETE_RESET_TOKEN = statement("auth.delete_reset_token", "DELETE FROM password_reset_tokens WHERE token = :token")
+UPDATE_USER_PASSWORD = statement("auth.update_user_password", "UPDATE users SET password = :password WHERE id = :user_id")
+BUSINESS_USER = statement("auth.business_user", """
+    SELECT id, name, bio
+    FROM users
+    WHERE id = :user_id AND role = 1
+""")
+BUSINESS_PROJECTS = statement("auth.business_projects", """
+    SELECT p.id, p.name, p.description, p.status, u.name AS business_name
+    FROM projects p
+    JOIN users u ON p.user_id = u.id
+    WHERE p.user_id = :user_id
+    ORDER BY p.id DESC
+""")
+UPDATE_USER_NAME = statement("auth.update_user_name", "UPDATE users SET name = :name WHERE id = :user_id")
+UPDATE_USER_BIO = statement("auth.update_user_bio", "UPDATE users SET bio = :bio WHERE id = :user_id")
+UPDATE_USER_GRADUATION = statement("auth.update_user_graduation", "UPDATE users SET graduation = :graduation WHERE id = :user_id")
+PROFILE_USER = statement("auth.profile_user", "SELECT name, bio FROM users WHERE id = :user_id")
+PROFILE_STUDENT = statement("auth.profile_student", """
+    SELECT s.instructor_id, i.name AS instructor_email, s.graduation
+    FROM users s LEFT JOIN users i ON s.instructor_id = i.id
+    WHERE s.id = :student_id
+""")
+PROFILE_PENDING_REQUESTS = statement("auth.profile_pending_requests", """
+    SELECT r.id, u.email AS instructor_email
+    FROM instructor_requests r JOIN users u ON r.instructor_id = u.id
+    WHERE r.student_id = :student_id AND r.status = 0
+""")
+INSTRUCTORS = statement("auth.instructors", "SELECT id, email FROM users WHERE role = 0 ORDER BY email")
+PROFILE_INSTRUCTOR_PROJECTS = statement("auth.profile_instructor_projects", """
+    SELECT p.id, p.name, p.description, p.status, u.name
+    FROM instructor_projects ip
+    JOIN projects p ON ip.project_id = p.id
+    JOIN users u ON p.user_id = u.id
+    WHERE ip.instructor_id = :instructor_id
+    ORDER BY p.id DESC
+""")
+INSERT_ADMIN_MESSAGE = statement("auth.insert_admin_message", "INSERT INTO admin_messages (user_id, message) VALUES (:user_id, :message)")
+
+# api/adminjobs.py
+
+UPDATE_JOB_STATUS = statement("adminjobs.update_job_status", "UPDATE jobs SET status = :status WHERE id = :job_id")
+ADMIN_DELETE_JOB = statement("adminjobs.admin_delete_job", "DELETE FROM jobs WHERE id = :job_id")
+
+# api/adminmessages.py
+
+ADMIN_MESSAGES = statement("adminmessages.admin_messages", """
+    SELECT id, user_id, message, timestamp
+    FROM admin_messages
+    ORDER BY timestamp DESC, id DESC
+""")
+
+# api/acl.py
+
+PROJECT_ACCESS = statement("acl.project_access", """
+    SELECT
+        EXISTS (SELECT 1 FROM projects WHERE id = :project_id AND user_id = :user_id) AS owner,
+        EXISTS (
+            SELECT 1 FROM team_members tm
+            JOIN teams t ON tm.team_id = t.id
+            WHERE tm.user_id = :user_id AND t.project_id = :project_id
+        ) AS member,
+        EXISTS (
+            SELECT 1 FROM teams t
+            JOIN team_members tm ON tm.team_id = t.id
+            JOIN users student ON student.id = tm.user_id
+            WHERE t.project_id = :project_id AND student.instructor_id = :user_id
+        ) AS instructor
+""")
+APPLICATION_ACCESS = statement("acl.application_access", """
+    SELECT 1
+    FROM job_applications a
+    JOIN jobs j ON a.job_id = j.id
+    WHERE a.id = :application_id AND (a.user_id = :user_id OR j.user_id = :user_id)
+""")
+
+PROJECT_PARTICIPANTS = statement("acl.project_participants", """
+    SELECT user_id FROM projects WHERE id = :project_id
+    UNION
+    SELECT tm.user_id FROM team_members tm JOIN teams t ON tm.team_id = t.id WHERE t.project_id = :project_id
+    UNION
+    SELECT instructor_id FROM instructor_projects WHERE project_id = :project_id
+    UNION
+    SELECT s.instructor_id
+    FROM team_members tm
+    JOIN teams t ON tm.team_id = t.id
+    JOIN users s ON s.id = tm.user_id
+    WHERE t.project_id = :project_id AND s.instructor_id IS NOT NULL
+""")
+
+# api/blobs.py
+
+INSERT_BLOB = statement("blobs.insert_blob", """
+    INSERT INTO blobs (hash, size, refcount, created_at) VALUES (:hash, :size, 0, :now)
+    ON CONFLICT (hash) DO NOTHING
+""", bindparam("now", type_=DateTime))
+ADD_BLOB_NAME_REF = statement("blobs.add_name_ref", """
+    INSERT INTO blob_names (path, hash, refs, created_at) VALUES (:path, :hash, 1, :now)
+    ON CONFLICT (path) DO UPDATE SET refs = refs + 1
+    RETURNING hash, refs
+""", bindparam("now", type_=DateTime))
+DROP_BLOB_NAME_REF = statement("blobs.drop_name_ref", "UPDATE blob_names SET refs = refs - 1 WHERE path = :path RETURNING hash, refs")
+DELETE_BLOB_NAME = statement("blobs.delete_name", "DELETE FROM blob_names WHERE path = :path")
+ADD_BLOB_REF = statement("blobs.add_ref", "UPDATE blobs SET refcount = refcount + 1 WHERE hash = :hash")
+DROP_BLOB_REF = statement("blobs.drop_ref", "UPDATE blobs SET refcount = refcount - 1 WHERE hash = :hash RETURNING refcount")
+DELETE_BLOB = statement("blobs.delete_blob", "DELETE FROM blobs WHERE hash = :hash")
+BLOB_EXISTS = statement("blobs.exists", "SELECT 1 FROM blobs WHERE hash = :hash")
+BLOB_NAME = statement("blobs.name", "SELECT hash FROM blob_names WHERE path = :path")
+
+# api/chat.py
+
+INSERT_CHAT_MESSAGE = statement("chat.insert_chat_message", """
+    INSERT INTO chat_messages (project_id, user_id, message_text, attachment_path)
+    VALUES (:project_id, :user_id, :message_text, :attachment_path)
+    RETURNING id, timestamp
+""", timestamp=DateTime)
+CHAT_MESSAGE = statement("chat.chat_message", "SELECT user_id, project_id, attachment_path FROM chat_messages WHERE id = :id")
+DELETE_CHAT_MESSAGE = statement("chat.delete_chat_message", "DELETE FROM chat_messages WHERE id = :id")
+APPLICATION_JOB_ID = statement("chat.application_job_id", "SELECT job_id FROM job_applications WHERE id = :id")
+INSERT_APPLICATION_MESSAGE = statement("chat.insert_application_message", """
+    INSERT INTO application_messages (application_id, user_id, message_text, attachment_path)
+    VALUES (:application_id, :user_id, :message_text, :attachment_path)
+    RETURNING id, timestamp
+""", timestamp=DateTime)
+APPLICATION_MESSAGE = statement("chat.application_message", "SELECT user_id, application_id, attachment_path FROM application_messages WHERE id = :id")
+DELETE_APPLICATION_MESSAGE = statement("chat.delete_application_message", "DELETE FROM application_messages WHERE id = :id")
+
+# api/history.py
+
+PROJECT_CHAT_LATEST = statement("history.project_chat_latest", """
+    SELECT c.id AS message_id, u.email, c.message_text, c.timestamp, c.attachment_path
+    FROM chat_messages c JOIN users u ON c.user_id = u.id
+    WHERE c.project_id = :room_id
+    ORDER BY c.id DESC LIMIT :limit
+""", timestamp=DateTime)
+PROJECT_CHAT_BEFORE = statement("history.project_chat_before", """
+    SELECT c.id AS message_id, u.email, c.message_text, c.timestamp, c.attachment_path
+    FROM chat_messages c JOIN users u ON c.user_id = u.id
+    WHERE c.project_id = :room_id AND c.id < :before
+    ORDER BY c.id DESC LIMIT :limit
+""", timestamp=DateTime)
+APPLICATION_CHAT_LATEST = statement("history.application_chat_latest", """
+    SELECT m.id AS message_id, u.email, m.message_text, m.timestamp, m.attachment_path
+    FROM application_messages m JOIN users u ON m.user_id = u.id
+    WHERE m.application_id = :room_id
+    ORDER BY m.id DESC LIMIT :limit
+""", timestamp=DateTime)
+APPLICATION_CHAT_BEFORE = statement("history.application_chat_before", """
+    SELECT m.id AS message_id, u.email, m.message_text, m.timestamp, m.attachment_path
+    FROM application_messages m JOIN users u ON m.user_id = u.id
+    WHERE m.application_id = :room_id AND m.id < :before
+    ORDER BY m.id DESC LIMIT :limit
+""", timestamp=DateTime)
+
+# api/invite.py
+
+STUDENT_INSTRUCTOR = statement("invite.student_instructor", "SELECT instructor_id FROM users WHERE id = :student_id")
+PENDING_INSTRUCTOR_REQUEST = statement("invite.pending_instructor_request", "SELECT id FROM instructor_requests WHERE student_id = :student_id AND status = 0")
+INSERT_INSTRUCTOR_REQUEST = statement("invite.insert_instructor_request", "INSERT INTO instructor_requests (student_id, instructor_id) VALUES (:student_id, :instructor_id)")
+CANCEL_INSTRUCTOR_REQUEST = statement("invite.cancel_instructor_request", "DELETE FROM instructor_requests WHERE student_id = :student_id AND status = 0")
+OPEN_INSTRUCTOR_REQUEST = statement("invite.open_instructor_request", """
+    SELECT student_id FROM instructor_requests
+    WHERE id = :request_id
+    AND instructor_id = :instructor_id
+    AND status IN (0, 2)
+""")
+UPDATE_STUDENT_INSTRUCTOR = statement("invite.update_student_instructor", "UPDATE users SET instructor_id = :instructor_id WHERE id = :student_id")
+ACCEPT_INSTRUCTOR_REQUEST = statement("invite.accept_instructor_request", "UPDATE instructor_requests SET status = 1 WHERE id = :request_id")
+DENY_INSTRUCTOR_REQUEST = statement("invite.deny_instructor_request", "UPDATE instructor_requests SET status = 2 WHERE id = :request_id")
+DISMISS_DENIED_REQUEST = statement("invite.dismiss_denied_request", """
+    DELETE FROM instructor_requests
+    WHERE id = :request_id
+    AND instructor_id = :instructor_id
+    AND status = 2
+""")
+
+# api/job.py
+
+INSERT_JOB = statement("job.insert_job", "INSERT INTO jobs (user_id, title, description, link, status) VALUES (:user_id, :title, :description, :link, :status)")
+JOB_BY_ID = statement("job.job_by_id", """
+    SELECT
+        j.id, j.title, j.description, j.link, j.status, j.user_id,
+        u.name AS user_name, u.email
+    FROM jobs j
+    JOIN users u ON j.user_id = u.id
+    WHERE j.id = :job_id
+""")
+UPDATE_JOB = statement("job.update_job", "UPDATE jobs SET title = :title, description = :description, link = :link, status = :status WHERE id = :job_id")
+DELETE_JOB = statement("job.delete_job", "DELETE FROM jobs WHERE id = :job_id AND user_id = :user_id")
+# Upload paths held by the rows a job's delete cascades to: its
+# applications' resumes and cover letters and their chat attachments. One
+# row per reference, so a path listed twice is released twice.
+JOB_UPLOAD_PATHS = statement("job.job_upload_paths", """
+    SELECT resume_path FROM job_applications WHERE job_id = :job_id AND resume_path IS NOT NULL
+    UNION ALL
+    SELECT cover_letter_path FROM job_applications WHERE job_id = :job_id AND cover_letter_path IS NOT NULL
+    UNION ALL
+    SELECT m.attachment_path FROM application_messages m
+    JOIN job_applications a ON m.application_id = a.id
+    WHERE a.job_id = :job_id AND m.attachment_path IS NOT NULL
+""")
+OPEN_JOBS = statement("job.open_jobs", """
+    SELECT
+        j.id, j.title, j.description, j.status, j.user_id,
+        u.name AS user_name
+    FROM jobs j
+    JOIN users u ON j.user_id = u.id
+    WHERE j.status = 1
+    ORDER BY j.created_at DESC
+""")
+BUSINESS_JOBS = statement("job.business_jobs", """
+    SELECT j.id, j.title, j.description, j.status, j.user_id, u.name AS user_name
+    FROM jobs j
+    JOIN users u ON j.user_id = u.id
+    WHERE j.user_id = :user_id
+    ORDER BY j.created_at DESC
+""")
+INSERT_JOB_APPLICATION = statement("job.insert_job_application", """
+    INSERT INTO job_applications (job_id, user_id, resume_path, cover_letter_path)
+    VALUES (:job_id, :user_id, :resume_path, :cover_letter_path)
+""")
+JOB_APPLICATIONS = statement("job.job_applications", """
+    SELECT a.id, a.user_id, a.resume_path, a.cover_letter_path, u.name, u.email
+    FROM job_applications a
+    JOIN users u ON a.user_id = u.id
+    WHERE a.job_id = :job_id
+""")
+MY_APPLICATIONS = statement("job.my_applications", """
+    SELECT a.id, a.job_id, j.title, u.name as business_name
+    FROM job_applications a
+    JOIN jobs j ON a.job_id = j.id
+    JOIN users u ON j.user_id = u.id
+    WHERE a.user_id = :user_id
+    ORDER BY a.created_at DESC
+""")
+APPLICATION_BY_ID = statement("job.application_by_id", """
+    SELECT
+        a.id, a.job_id, a.user_id AS applicant_id,
+        a.resume_path, a.cover_letter_path,
+        j.user_id AS job_owner_id, j.title AS job_title,
+        u_app.name AS applicant_name, u_app.email AS applicant_email,
+        u_biz.name AS business_name
+    FROM job_applications a
+    JOIN jobs j ON a.job_id = j.id
+    JOIN users u_app ON a.user_id = u_app.id
+    JOIN users u_biz ON j.user_id = u_biz.id
+    WHERE a.id = :application_id
+""")
+
+# api/listing.py
+
+DELETE_STATUS_COUNTS = statement("listing.delete_status_counts", "DELETE FROM status_counts WHERE table_name = :table_name")
+INSERT_STATUS_COUNTS = statement("listing.insert_status_counts", "INSERT INTO status_counts (table_name, value, count) VALUES (:table_name, :value, :count)")
+
+# api/loaders.py
+
+TEAM_MEMBERS = statement("loaders.team_members", """
+    SELECT tm.team_id, u.id, u.name, u.email
+    FROM team_members tm
+    JOIN users u ON tm.user_id = u.id
+    WHERE tm.team_id IN :team_ids
+    ORDER BY tm.team_id, u.email
+""", bindparam("team_ids", expanding=True))
+
+# api/mgt.py
+
+INSERT_STUDENT = statement("mgt.insert_student", "INSERT INTO users (email, password, role, instructor_id) VALUES (:email, :password, 3, :instructor_id)")
+EXISTING_USER_EMAILS = statement("mgt.existing_user_emails", "SELECT email FROM users WHERE email IN :emails",
+                                 bindparam("emails", expanding=True))
+INSERT_STUDENT_RESET_TOKEN = statement("mgt.insert_student_reset_token", """
+    INSERT INTO password_reset_tokens (user_id, token, expires_at)
+    SELECT id, :token, :expires_at FROM users WHERE email = :email
+""", bindparam("expires_at", type_=DateTime))
+INSERT_TEAM = statement("mgt.insert_team", "INSERT INTO teams (name, user_id) VALUES (:name, :user_id)")
+TEAM_PROJECT_ID = statement("mgt.team_project_id", "SELECT project_id FROM teams WHERE id = :team_id")
+RELEASE_PROJECT = statement("mgt.release_project", "UPDATE projects SET status = 2 WHERE id = :project_id")
+UPDATE_TEAM_PROJECT = statement("mgt.update_team_project", "UPDATE teams SET project_id = :project_id WHERE id = :team_id")
+TAKE_PROJECT = statement("mgt.take_project", "UPDATE projects SET status = 3 WHERE id = :project_id")
+INSTRUCTOR_STUDENT = statement("mgt.instructor_student", "SELECT id, name, email FROM users WHERE id = :user_id AND role = 3 AND instructor_id = :instructor_id")
+INSTRUCTOR_TEAM_PROJECT = statement("mgt.instructor_team_project", "SELECT project_id FROM teams WHERE id = :team_id AND user_id = :instructor_id")
+DELETE_USER_MEMBERSHIPS = statement("mgt.delete_user_memberships", "DELETE FROM team_members WHERE user_id = :user_id")
+INSERT_TEAM_MEMBER = statement("mgt.insert_team_member", "INSERT INTO team_members (team_id, user_id) VALUES (:team_id, :user_id)")
+DELETE_STUDENT = statement("mgt.delete_student", "DELETE FROM users WHERE id = :user_id AND role = 3")
+# Upload paths held by every row a user's delete cascades to: their projects
+# (with those projects' comments and chat), their comments and the replies
+# under them, their chat messages, their jobs' and their own applications
+# with those applications' chat. Rows reached twice are counted once, since
+# each holds one reference.
+USER_UPLOAD_PATHS = statement("mgt.user_upload_paths", """
+    WITH RECURSIVE
+    removed_projects AS (SELECT id FROM projects WHERE user_id = :user_id),
+    removed_comments(id) AS (
+        SELECT id FROM comments WHERE user_id = :user_id
+        UNION
+        SELECT c.id FROM comments c JOIN removed_comments r ON c.parent_comment_id = r.id
+    ),
+    removed_applications AS (
+        SELECT id FROM job_applications WHERE user_id = :user_id
+        UNION
+        SELECT a.id FROM job_applications a JOIN jobs j ON a.job_id = j.id WHERE j.user_id = :user_id
+    ),
+    files(source, id, path) AS (
+        SELECT 'attachment', id, path FROM attachments WHERE project_id IN removed_projects
+        UNION
+        SELECT 'attachment', id, path FROM attachments WHERE owner_type = 'comment' AND owner_id IN removed_comments
+        UNION
+        SELECT 'chat', id, attachment_path FROM chat_messages
+        WHERE (project_id IN removed_projects OR user_id = :user_id) AND attachment_path IS NOT NULL
+        UNION
+        SELECT 'resume', id, resume_path FROM job_applications WHERE id IN removed_applications AND resume_path IS NOT NULL
+        UNION
+        SELECT 'cover_letter', id, cover_letter_path FROM job_applications WHERE id IN removed_applications AND cover_letter_path IS NOT NULL
+        UNION
+        SELECT 'application_chat', id, attachment_path FROM application_messages
+        WHERE (application_id IN removed_applications OR user_id = :user_id) AND attachment_path IS NOT NULL
+    )
+    SELECT path FROM files
+""")
+DELETE_TEAM = statement("mgt.delete_team", "DELETE FROM teams WHERE id = :team_id")
+PROJECT_TEAM_COUNT = statement("mgt.project_team_count", "SELECT COUNT(id) as team_count FROM teams WHERE project_id = :project_id")
+UPDATE_TEAM_NAME = statement("mgt.update_team_name", "UPDATE teams SET name = :name WHERE id = :team_id")
+INSTRUCTOR_APPROVED_PROJECTS = statement("mgt.instructor_approved_projects", """
+    SELECT p.id, p.name
+    FROM projects p
+    JOIN instructor_projects ip ON p.id = ip.project_id
+    WHERE p.status = 2 AND ip.instructor_id = :instructor_id
+    ORDER BY p.name
+""")
+INSTRUCTOR_TEAMS_PAGE = statement("mgt.instructor_teams_page", """
+    SELECT t.id, t.name, t.project_id, p.name AS project_name
+    FROM teams t LEFT JOIN projects p ON t.project_id = p.id
+    WHERE t.user_id = :user_id AND t.id > :after_id
+    ORDER BY t.id
+    LIMIT :limit
+""")
+UNASSIGNED_STUDENTS_PAGE = statement("mgt.unassigned_students_page", """
+    SELECT u.id, u.name, u.email
+    FROM users u
+    WHERE u.role = 3 AND u.instructor_id = :instructor_id AND u.id > :after_id
+      AND NOT EXISTS (SELECT 1 FROM team_members tm WHERE tm.user_id = u.id)
+      AND (:search IS NULL OR u.email LIKE :search OR u.name LIKE :search)
+    ORDER BY u.id
+    LIMIT :limit
+""")
+INSTRUCTOR_PENDING_REQUESTS = statement("mgt.instructor_pending_requests", """
+    SELECT r.id, u.email AS student_email
+    FROM instructor_requests r JOIN users u ON r.student_id = u.id
+    WHERE r.instructor_id = :instructor_id AND r.status = 0
+""")
+INSTRUCTOR_DENIED_REQUESTS = statement("mgt.instructor_denied_requests", """
+    SELECT r.id, u.email AS student_email
+    FROM instructor_requests r JOIN users u ON r.student_id = u.id
+    WHERE r.instructor_id = :instructor_id AND r.status = 2
+""")
+
+# api/projects.py
+
+PROJECT_BY_ID = statement("projects.project_by_id", """
+    SELECT
+        p.id, p.name, p.description, p.status,
+        p.project_link, p.github_link,
+        u.name as business_name, u.role, u.id as user_id
+    FROM projects p
+    JOIN users u ON p.user_id = u.id
+    WHERE p.id = :project_id
+""")
+INSERT_PROJECT = statement("projects.insert_project", "INSERT INTO projects (user_id, name, description, status) VALUES (:user_id, :name, :description, :status) RETURNING id")
+CLEAR_OTHER_PROJECT_INSTRUCTORS = statement("projects.clear_other_project_instructors", """
+    DELETE FROM instructor_projects
+    WHERE project_id = :project_id AND instructor_id != :instructor_id
+""")
+UPSERT_INSTRUCTOR_PROJECT = statement("projects.upsert_instructor_project", """
+    INSERT INTO instructor_projects (instructor_id, project_id, status)
+    VALUES (:instructor_id, :project_id, :status)
+    ON CONFLICT(instructor_id, project_id) DO UPDATE SET status = :status
+""")
+GRADUATE_PROJECT_STUDENTS = statement("projects.graduate_project_students", """
+    UPDATE users
+    SET role = 2
+    WHERE role = 3 AND id IN (
+        SELECT tm.user_id
+        FROM team_members tm
+        JOIN teams t ON tm.team_id = t.id
+        WHERE t.project_id = :project_id
+    )
+""")
+DELETE_INSTRUCTOR_PROJECT = statement("projects.delete_instructor_project", """
+    DELETE FROM instructor_projects
+    WHERE instructor_id = :instructor_id AND project_id = :project_id
+""")
+UPDATE_PROJECT_STATUS = statement("projects.update_project_status", "UPDATE projects SET status = :status WHERE id = :project_id")
+USER_PROJECTS = statement("projects.user_projects", """
+    SELECT
+        p.id, p.name, p.description, p.status,
+        u.name, u.role,
+        COUNT(t.id) AS team_count
+    FROM projects p
+    JOIN users u ON p.user_id = u.id
+    LEFT JOIN teams t ON p.id = t.project_id
+    WHERE p.user_id = :user_id
+    GROUP BY p.id
+    ORDER BY p.id DESC
+""")
+USER_INSTRUCTOR = statement("projects.user_instructor", "SELECT instructor_id FROM users WHERE id = :user_id")
+UPDATE_PROJECT_LINKS = statement("projects.update_project_links", "UPDATE projects SET project_link = :project_link, github_link = :github_link WHERE id = :project_id")
+STUDENT_PROJECT_TEAMS = statement("projects.student_project_teams", """
+    SELECT p.id as project_id, p.name as project_name, p.description as project_description,
+           t.id as team_id, t.name as team_name
+    FROM team_members tm
+    JOIN teams t ON tm.team_id = t.id
+    JOIN projects p ON t.project_id = p.id
+    WHERE tm.user_id = :user_id AND p.status IN (1, 2, 3, 4)
+""")
+UPDATE_PROJECT = statement("projects.update_project", """
+    UPDATE projects
+    SET name = :name, description = :description
+    WHERE id = :project_id AND user_id = :user_id
+""")
+DELETE_PROJECT = statement("projects.delete_project", "DELETE FROM projects WHERE id = :project_id AND user_id = :user_id")
+PROJECT_UPLOAD_PATHS = statement("projects.project_upload_paths", """
+    SELECT path FROM attachments WHERE project_id = :project_id
+    UNION ALL
+    SELECT attachment_path FROM chat_messages WHERE project_id = :project_id AND attachment_path IS NOT NULL
+""")
+INSERT_COMMENT = statement("projects.insert_comment", """
+    INSERT INTO comments (user_id, project_id, comment)
+    VALUES (:user_id, :project_id, :comment)
+    RETURNING id
+""")
+USER_NAME_EMAIL = statement("projects.user_name_email", "SELECT name, email FROM users WHERE id = :user_id")
+COMMENT_FOR_DELETE = statement("projects.comment_for_delete", """
+    SELECT
+        c.user_id AS comment_owner_id,
+        u.role AS comment_role,
+        p.user_id AS project_owner_id
+    FROM comments c
+    JOIN users u ON c.user_id = u.id
+    JOIN projects p ON c.project_id = p.id
+    WHERE c.id = :comment_id AND c.project_id = :project_id
+""")
+DELETE_COMMENT = statement("projects.delete_comment", "DELETE FROM comments WHERE id = :comment_id")
+
+# One row per file (see schema.ATTACHMENTS_SQL). size is copied from the blob
+# the path names when the row is written.
+INSERT_ATTACHMENT = statement("projects.insert_attachment", """
+    INSERT INTO attachments (owner_type, owner_id, project_id, path, size, mime, created_at)
+    VALUES (
+        :owner_type, :owner_id, :project_id, :path,
+        (SELECT b.size FROM blob_names n JOIN blobs b ON b.hash = n.hash WHERE n.path = :path),
+        :mime, :now
+    )
+""", bindparam("now", type_=DateTime))
+PROJECT_ATTACHMENTS = statement("projects.project_attachments", """
+    SELECT id, path, size, mime FROM attachments
+    WHERE owner_type = 'project' AND owner_id = :project_id
+    ORDER BY id
+""")
+COMMENT_ATTACHMENTS = statement("projects.comment_attachments", """
+    SELECT id, owner_id AS comment_id, path, size, mime FROM attachments
+    WHERE owner_type = 'comment' AND owner_id IN :comment_ids
+    ORDER BY id
+""", bindparam("comment_ids", expanding=True))
+PROJECT_ATTACHMENT_BY_PATH = statement("projects.project_attachment_by_path", """
+    SELECT id FROM attachments
+    WHERE owner_type = 'project' AND owner_id = :project_id AND path = :path
+""")
+RENAME_ATTACHMENT = statement("projects.rename_attachment", """
+    UPDATE attachments SET path = :new_path, mime = :mime
+    WHERE id = :attachment_id AND path = :old_path
+    RETURNING id
+""")
+DELETE_PROJECT_ATTACHMENTS = statement("projects.delete_project_attachments", """
+    DELETE FROM attachments
+    WHERE owner_type = 'project' AND owner_id = :project_id AND id IN :attachment_ids
+    RETURNING path
+""", bindparam("attachment_ids", expanding=True))
+DELETE_COMMENT_ATTACHMENTS = statement("projects.delete_comment_attachments", """
+    DELETE FROM attachments WHERE owner_type = 'comment' AND owner_id = :comment_id
+    RETURNING path
+""")
+PROJECT_STORAGE = statement("projects.project_storage", """
+    SELECT COUNT(*) AS files, COALESCE(SUM(size), 0) AS bytes
+    FROM attachments WHERE project_id = :project_id
+""")
+
+
+# get_all_projects: one variant per combination of full-text search, student
+# scope (the instructor's approved projects), status filter, cursor and sort
+# direction. Searches are ordered by relevance (bm25, lower is better) and
+# paged on (score, id) whatever the requested sort.
+def _project_feed_sql(search, student, status, after, direction):
+    where = []
+    if status:
+        where.append("p.status = :status_val")
+    if student:
+        # Keyed on ip.project_id so the instructor_projects primary key
+        # serves both the range and the ordering.
+        key_column = "ip.project_id"
+        where += ["ip.instructor_id = :instructor_id", "ip.status = 2"]
+    else:
+        key_column = "p.id"
+        if not status:
+            # Unary + keeps the planner walking the rowid in key order
+            # (and stopping at LIMIT) instead of sorting every open project.
+            where.append("+p.status IN (0, 1)")
+    join = "JOIN instructor_projects ip ON p.id = ip.project_id" if student else ""
+
+    if search:
+        if after:
+            where.append("(h.score > :after_score OR (h.score = :after_score AND p.id > :after_id))")
+        return f"""
+            WITH hits AS (
+                SELECT rowid AS id,
+                       bm25(projects_fts, 10.0, 1.0, 5.0) AS score,
+                       highlight(projects_fts, 0, char(2), char(3)) AS name_hit,
+                       snippet(projects_fts, 1, char(2), char(3), '…', 24) AS description_hit
+                FROM projects_fts
+                WHERE projects_fts MATCH :search
+            )
+            SELECT p.id, p.name, p.description, p.status, u.name AS business_name, u.role,
+                   h.score, h.name_hit, h.description_hit
+            FROM hits h
+            JOIN projects p ON p.id = h.id
+            JOIN users u ON p.user_id = u.id
+            {join}
+            WHERE {" AND ".join(where)}
+            ORDER BY h.score, p.id
+            LIMIT :limit
+        """
+
+    if after:
+        where.append(f"{key_column} {'>' if direction == 'ASC' else '<'} :after_id")
+    return f"""
+        SELECT p.id, p.name, p.description, p.status, u.name AS business_name, u.role
+        FROM projects p
+        JOIN users u ON p.user_id = u.id
+        {join}
+        WHERE {" AND ".join(where)}
+        ORDER BY {key_column} {direction}
+        LIMIT :limit
+    """
+
+def _project_feed():
+    variants = {}
+    for search in (False, True):
+        for student in (False, True):
+            for status in (False, True):
+                for after in (False, True):
+                    for direction in ((None,) if search else ("ASC", "DESC")):
+                        flags = [label for flag, label in (
+                            (search, "search"), (student, "student"), (status, "status"), (after, "after"),
+                        ) if flag]
+                        name = ".".join(["projects.feed", *flags, *([direction.lower()] if direction else [])])
+                        variants[(search, student, status, after, direction)] = statement(
+                            name, _project_feed_sql(search, student, status, after, direction)
+                        )
+    return variants
+
+PROJECT_FEED = _project_feed()
+
+# load_project_page: the project, the viewer's flags and the teams with their
+# members aggregated as JSON.
+PROJECT_PAGE = statement("projects.project_page", """
+    WITH members AS (
+        SELECT tm.team_id, u.id, u.name, u.email, u.instructor_id
+        FROM teams t
+        JOIN team_members tm ON tm.team_id = t.id
+        JOIN users u ON tm.user_id = u.id
+        WHERE t.project_id = :project_id
+    )
+    SELECT
+        p.id, p.name, p.description, p.status,
+        p.project_link, p.github_link,
+        u.name AS business_name, u.role, u.id AS user_id,
+        EXISTS (SELECT 1 FROM members WHERE id = :user_id) AS is_member,
+        EXISTS (SELECT 1 FROM members WHERE instructor_id = :user_id) AS is_instructor,
+        EXISTS (
+            SELECT 1 FROM instructor_projects
+            WHERE instructor_id = :user_id AND project_id = p.id AND status = 1
+        ) AS is_pending,
+        (
+            SELECT json_group_array(json_object(
+                'name', t.name,
+                'members', json((
+                    SELECT json_group_array(json_object('id', m.id, 'name', m.name, 'email', m.email))
+                    FROM members m WHERE m.team_id = t.id
+                ))
+            ))
+            FROM teams t WHERE t.project_id = p.id
+        ) AS teams
+    FROM projects p
+    JOIN users u ON p.user_id = u.id
+    WHERE p.id = :project_id
+""")
+
+# The owner sees every comment. An instructor sees the owner's, their own and
+# those of students on the project's teams. A student sees the owner's, their
+# instructor's and their team's (or only their own when not on a team).
+PROJECT_PAGE_COMMENTS = statement("projects.project_page_comments", """
+    WITH viewer_team AS (
+        SELECT tm.team_id FROM team_members tm
+        JOIN teams t ON tm.team_id = t.id
+        WHERE tm.user_id = :user_id AND t.project_id = :project_id
+        LIMIT 1
+    )
+    SELECT c.id, c.comment, c.created_at,
+           u.name, u.email, u.role, c.user_id
+    FROM comments c
+    JOIN users u ON c.user_id = u.id
+    JOIN projects p ON c.project_id = p.id
+    WHERE c.project_id = :project_id
+      AND (
+        p.user_id = :user_id
+        OR (:role = 0 AND (
+            c.user_id = p.user_id
+            OR c.user_id = :user_id
+            OR (u.role = 3 AND c.user_id IN (
+                SELECT tm.user_id FROM team_members tm
+                JOIN teams t ON tm.team_id = t.id
+                WHERE t.project_id = :project_id
+            ))
+        ))
+        OR (:role = 3 AND (
+            c.user_id = p.user_id
+            OR c.user_id = (SELECT instructor_id FROM users WHERE id = :user_id)
+            OR c.user_id IN (
+                SELECT user_id FROM team_members
+                WHERE team_id = (SELECT team_id FROM viewer_team)
+            )
+            OR (c.user_id = :user_id AND NOT EXISTS (SELECT 1 FROM viewer_team))
+        ))
+      )
+    ORDER BY c.created_at ASC
+""")
+
+# api/notifications.py
+
+INSERT_NOTIFICATION_EVENT = statement("notifications.insert_event", """
+    INSERT INTO notification_events (user_id, project_id, comment_id, link, created_at)
+    VALUES (:user_id, :project_id, :comment_id, :link, :now)
+""", bindparam("now", type_=DateTime))
+# A group is due once it has been quiet for the quiet window, or once its
+# oldest event has waited the maximum delay even if comments keep coming.
+DUE_NOTIFICATION_GROUPS = statement("notifications.due_groups", """
+    SELECT user_id, project_id, MAX(id) AS last_event_id
+    FROM notification_events
+    GROUP BY user_id, project_id
+    HAVING MAX(created_at) <= :quiet_before OR MIN(created_at) <= :oldest_before
+    LIMIT :batch
+""", bindparam("quiet_before", type_=DateTime), bindparam("oldest_before", type_=DateTime))
+TAKE_NOTIFICATION_EVENTS = statement("notifications.take_events", """
+    DELETE FROM notification_events
+    WHERE user_id = :user_id AND project_id = :project_id AND id <= :last_event_id
+    RETURNING comment_id, link
+""")
+DIGEST_COMMENTS = statement("notifications.digest_comments", """
+    SELECT c.id, c.comment, c.created_at, u.name, u.email, p.name AS project_name
+    FROM comments c
+    JOIN users u ON u.id = c.user_id
+    JOIN projects p ON p.id = c.project_id
+    WHERE c.id IN :comment_ids
+    ORDER BY c.id
+""", bindparam("comment_ids", expanding=True), created_at=DateTime)
+
+# api/outbox.py
+
+INSERT_OUTBOX_EMAIL = statement("outbox.insert_email", """
+    INSERT INTO email_outbox (idempotency_key, to_addresses, bcc_addresses, subject, html, next_attempt_at)
+    VALUES (:idempotency_key, :to_addresses, :bcc_addresses, :subject, :html, :now)
+    ON CONFLICT (idempotency_key) DO NOTHING
+""", bindparam("now", type_=DateTime))
+CLAIM_OUTBOX_EMAILS = statement("outbox.claim_emails", """
+    UPDATE email_outbox
+    SET attempts = attempts + 1, next_attempt_at = :lease_until
+    WHERE id IN (
+        SELECT id FROM email_outbox
+        WHERE status = 0 AND next_attempt_at <= :now
+        ORDER BY next_attempt_at
+        LIMIT :batch
+    )
+    RETURNING id, idempotency_key, to_addresses, bcc_addresses, subject, html, attempts
+""", bindparam("now", type_=DateTime), bindparam("lease_until", type_=DateTime))
+MARK_OUTBOX_SENT = statement("outbox.mark_sent", """
+    UPDATE email_outbox SET status = 1, sent_at = :now, last_error = NULL WHERE id = :id
+""", bindparam("now", type_=DateTime))
+MARK_OUTBOX_RETRY = statement("outbox.mark_retry", """
+    UPDATE email_outbox SET status = :status, next_attempt_at = :next_attempt_at, last_error = :error WHERE id = :id
+""", bindparam("next_attempt_at", type_=DateTime))
+
+# api/uploads.py
+
+INSERT_CHAT_UPLOAD = statement("uploads.insert_chat_upload", """
+    INSERT INTO chat_uploads (id, user_id, kind, room_id, filename, size)
+    VALUES (:id, :user_id, :kind, :room_id, :filename, :size)
+""")
+CHAT_UPLOAD = statement("uploads.chat_upload", "SELECT id, user_id, kind, room_id, filename, size FROM chat_uploads WHERE id = :id")
+CLAIM_CHAT_UPLOAD = statement("uploads.claim_chat_upload", "DELETE FROM chat_uploads WHERE id = :id RETURNING id")
+DELETE_CHAT_UPLOAD = statement("uploads.delete_chat_upload", "DELETE FROM chat_uploads WHERE id = :id AND user_id = :user_id RETURNING id")
+EXPIRED_CHAT_UPLOADS = statement("uploads.expired_chat_uploads", "DELETE FROM chat_uploads WHERE created_at < :cutoff RETURNING id",
+                                 bindparam("cutoff", type_=DateTime))
+
+# app.py
+
+USER_JOB_APPLICATION = statement("app.user_job_application", "SELECT * FROM job_applications WHERE job_id = :job_id AND user_id = :user_id")
@@ -0,0 +1,14 @@
+import os
+from flask_socketio import SocketIO
+
+# Socket.IO rooms live in the memory of the worker a client is connected to.
+# With SOCKETIO_MESSAGE_QUEUE set (a redis:// URL), every emit is published on
+# the queue and each worker delivers it to its own clients, so a project room
+# spans all workers and emits from HTTP routes reach everyone. Without it the app runs as a single process, as before.
+MESSAGE_QUEUE = os.getenv("SOCKETIO_MESSAGE_QUEUE") or None
+CHANNEL = os.getenv("SOCKETIO_CHANNEL", "flask-socketio")
+
+def create_socketio(app):
+    if MESSAGE_QUEUE:
+        print(f"Socket.IO emits go through the message queue on channel {CHANNEL}")
+    return SocketIO(app, message_queue=MESSAGE_QUEUE, channel=CHANNEL)
@@ -0,0 +1,23 @@
+import re
+from markupsafe import Markup, escape
+
+# Helpers for the FTS5 indexes in schema.SEARCH_SQL. snippet()/highlight()
+# wrap hits in these control characters instead of HTML, so the stored text
+# can be escaped before the <mark> tags are put in.
+HIT_START = "\x02"
+HIT_END = "\x03"
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Turns free text into an FTS5 query: every word must match, as a prefix, and
+# quoting each token keeps FTS5 syntax (AND, NEAR, column:, *) out of user input.
+def fts_query(search):
+    tokens = TOKEN_RE.findall(search or "")
+    if not tokens:
+        return None
+    return " ".join(f'"{token}"*' for token in tokens)
+
+def highlighted(value):
+    if not value:
+        return value
+    return Markup(str(escape(value)).replace(HIT_START, "<mark>").replace(HIT_END, "</mark>"))
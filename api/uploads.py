@@ -0,0 +1,168 @@
+import os
+import re
+import secrets
+from datetime import datetime, timedelta
+from flask import jsonify, session, current_app
+from werkzeug.utils import secure_filename
+from . import queries
+from .db import connect, write
+from .acl import chat_access
+
+# Resumable chat attachments. The client creates an upload, then PATCHes the
+# file in chunks, each one sent with the offset it starts at. Chunks are
+# streamed straight to a partial file whose length is the server's offset, so
+# a client that lost its connection asks for the offset and carries on from
+# there, and a re-sent chunk simply overwrites the same bytes. The finished
+# upload is referenced by id from the chat message, which moves the file into
+# place and deletes the row so it can be used only once.
+CHAT_UPLOAD_MAX_BYTES = int(os.getenv("CHAT_UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+CHAT_UPLOAD_CHUNK_BYTES = int(os.getenv("CHAT_UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+CHAT_UPLOAD_TTL = int(os.getenv("CHAT_UPLOAD_TTL", "86400"))
+
+STREAM_BLOCK_BYTES = 64 * 1024
+UPLOAD_ID_RE = re.compile(r'[A-Za-z0-9_-]{16,64}')
+
+def _partial_path(upload_id):
+    return os.path.join(current_app.config['UPLOAD_TMP_DIR'], upload_id)
+
+def _received(upload_id):
+    try:
+        return os.path.getsize(_partial_path(upload_id))
+    except OSError:
+        return 0
+
+def _remove_partial(upload_id):
+    try:
+        os.remove(_partial_path(upload_id))
+    except OSError:
+        pass
+
+def _get_upload(upload_id, engine):
+    if not upload_id or not UPLOAD_ID_RE.fullmatch(upload_id):
+        return None
+    with connect(engine) as conn:
+        return conn.execute(queries.CHAT_UPLOAD, {"id": upload_id}).mappings().first()
+
+def _upload_state(upload):
+    offset = _received(upload['id'])
+    return {"upload_id": upload['id'], "offset": offset, "size": upload['size'], "complete": offset == upload['size']}
+
+def purge_expired_uploads(engine):
+    cutoff = datetime.utcnow() - timedelta(seconds=CHAT_UPLOAD_TTL)
+    expired = write(engine, lambda conn: conn.execute(queries.EXPIRED_CHAT_UPLOADS, {"cutoff": cutoff}).all())
+    for row in expired:
+        _remove_partial(row.id)
+    return len(expired)
+
+def create_chat_upload(request, engine):
+    user_id = session.get('user_id')
+    data = request.get_json(silent=True) or {}
+    kind = data.get('kind')
+    room_id = data.get('room_id')
+    filename = secure_filename(str(data.get('filename') or ''))
+    size = data.get('size')
+
+    if not user_id or not chat_access(kind, user_id, room_id, engine):
+        return jsonify({"error": "Unauthorized"}), 403
+    if not filename or not isinstance(size, int) or size < 0:
+        return jsonify({"error": "A file name and size are required."}), 400
+    if size > CHAT_UPLOAD_MAX_BYTES:
+        return jsonify({"error": f"Files are limited to {CHAT_UPLOAD_MAX_BYTES // (1024 * 1024)} MB."}), 413
+
+    try:
+        purge_expired_uploads(engine)
+        upload_id = secrets.token_urlsafe(24)
+        os.makedirs(current_app.config['UPLOAD_TMP_DIR'], exist_ok=True)
+        open(_partial_path(upload_id), 'wb').close()
+        params = {
+            "id": upload_id,
+            "user_id": user_id,
+            "kind": kind,
+            "room_id": int(room_id),
+            "filename": filename,
+            "size": size
+        }
+        write(engine, lambda conn: conn.execute(queries.INSERT_CHAT_UPLOAD, params))
+    except Exception as e:
+        print(f"Error creating chat upload: {e}")
+        return jsonify({"error": "Could not start the upload."}), 500
+
+    return jsonify({"upload_id": upload_id, "offset": 0, "size": size, "chunk_size": CHAT_UPLOAD_CHUNK_BYTES}), 201
+
+def chat_upload_status(upload_id, engine):
+    upload = _get_upload(upload_id, engine)
+    if not upload or upload['user_id'] != session.get('user_id'):
+        return jsonify({"error": "Upload not found"}), 404
+    return jsonify(_upload_state(upload))
+
+def append_chat_upload(upload_id, request, engine):
+    upload = _get_upload(upload_id, engine)
+    if not upload or upload['user_id'] != session.get('user_id'):
+        return jsonify({"error": "Upload not found"}), 404
+
+    offset = _received(upload_id)
+    client_offset = request.headers.get('Upload-Offset', type=int)
+    if client_offset is None or client_offset > offset:
+        return jsonify({"error": "Offset mismatch", "offset": offset}), 409
+    # Resuming behind the server's offset re-sends bytes it already has;
+    # they are written again over the same range.
+    offset = client_offset
+
+    remaining = upload['size'] - offset
+    if request.content_length is not None and request.content_length > remaining:
+        return jsonify({"error": "Chunk runs past the end of the file", "offset": offset}), 413
+
+    written = 0
+    try:
+        with open(_partial_path(upload_id), 'r+b') as f:
+            f.seek(offset)
+            while True:
+                block = request.stream.read(STREAM_BLOCK_BYTES)
+                if not block:
+                    break
+                written += len(block)
+                if written > remaining:
+                    f.truncate(offset)
+                    return jsonify({"error": "Chunk runs past the end of the file", "offset": offset}), 413
+                f.write(block)
+    except OSError as e:
+        print(f"Error writing chat upload {upload_id}: {e}")
+        return jsonify({"error": "Could not store the chunk.", "offset": _received(upload_id)}), 500
+
+    return jsonify(_upload_state(upload))
+
+def cancel_chat_upload(upload_id, engine):
+    user_id = session.get('user_id')
+    if not user_id or not upload_id or not UPLOAD_ID_RE.fullmatch(upload_id):
+        return jsonify({"error": "Upload not found"}), 404
+    deleted = write(engine, lambda conn: conn.execute(queries.DELETE_CHAT_UPLOAD, {"id": upload_id, "user_id": user_id}).first())
+    if not deleted:
+        return jsonify({"error": "Upload not found"}), 404
+    _remove_partial(upload_id)
+    return jsonify({"ok": True})
+
+# Hands a finished upload to a chat message: checks it belongs to this user
+# and room and is complete, then claims it so no other message can reuse it.
+# Returns (partial file path, file name), or None.
+def claim_chat_upload(upload_id, user_id, kind, room_id, engine):
+    upload = _get_upload(upload_id, engine)
+    if not upload:
+        return None
+    if upload['user_id'] != user_id or upload['kind'] != kind or str(upload['room_id']) != str(room_id):
+        return None
+    if _received(upload_id) != upload['size']:
+        return None
+    if not write(engine, lambda conn: conn.execute(queries.CLAIM_CHAT_UPLOAD, {"id": upload_id}).first()):
+        return None
+    return _partial_path(upload_id), upload['filename']
+
+# Removes the partial file of an upload whose claim went through but which
+# could not be stored. Its row is gone, so the expiry purge would never find
+# the file.
+def discard_claimed_upload(claimed):
+    if not claimed:
+        return
+    try:
+        os.remove(claimed[0])
+    except OSError:
+        pass
@@ -1,8 +1,6 @@
 import os
 import sqlalchemy
-from sqlalchemy import text, event
-from flask import Flask, render_template, request, redirect, url_for, flash, session, send_from_directory, jsonify
-from flask_socketio import SocketIO
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
 from api.auth import (
     register_user, login_user, handle_forgot_password, handle_reset_password, 
     get_profile_data, update_profile, create_admin_message, get_business_profile_data
@@ -10,97 +8,127 @@ from api.auth import (
 from api.projects import (
     create_project, update_project, delete_project, approve_project, 
     update_project_links, get_projects_for_student, get_all_projects, 
-    load_projects_html, get_project_by_id, check_if_user_can_chat, 
-    check_if_user_can_edit_links, check_if_user_can_comment, 
-    get_teams_for_project, get_comments_for_project, add_comment_to_project, 
+    load_projects_html, load_project_page, add_comment_to_project, 
     delete_comment_on_project, instructor_manage_files, rename_project_attachment
 )
 from api.mgt import (
-    create_user_by_instructor, create_group, assign_user_to_team, 
+    create_user_by_instructor, import_students_by_instructor, create_group, assign_user_to_team, 
     assign_project_to_group, delete_user, delete_group, update_group, 
-    get_user_mgt_data
+    get_user_mgt_data, get_roster_page
 )
 from api.invite import (
     send_instructor_request, cancel_instructor_request, 
     handle_instructor_request, dismiss_denied_request
 )
-from api.chat import init_chat, init_application_chat
+from api.chat import init_chat, init_application_chat, get_chat_history
+from api.realtime import create_socketio
+from api.uploads import create_chat_upload, chat_upload_status, append_chat_upload, cancel_chat_upload
 from api.admin import (
-    register_admin, login_admin, get_projects_paginated, get_users_paginated
+    register_admin, login_admin, get_projects_paginated
 )
 from api.adminjobs import (
     get_jobs_paginated, admin_update_job_status, admin_delete_job
 )
+from api.adminusers import get_users_paginated
+from api.listing import reconcile_counts
 from api.adminmessages import get_admin_messages
 from api.job import (
     get_open_jobs, create_job, get_job_by_id, get_job_applications, 
     update_job, delete_job, apply_to_job, get_business_jobs_data, 
     get_application_by_id, get_application_chat_history
 )
-from schema.schema import CREATE_SCHEMA_SQL
+from api import queries
+from api.db import configure_sqlite, start_maintenance, connect, init_request_connections
+from api.outbox import start_email_worker, send_due_emails, email_enabled, get_transport
+from api.notifications import start_digest_worker, flush_due_digests
+from api.passwords import password_pool_stats
+from api.blobs import send_upload
+from api.assets import asset_url, send_asset
+from schema.migrations import migrate
 # from schema.dummydata import seed_data # Creates dummydata
 
 app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "dev_secret_key")
 UPLOAD_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'uploads')
 app.config['UPLOAD_DIR'] = UPLOAD_DIR
+# Chat uploads in progress; kept outside UPLOAD_DIR so they are never served.
+app.config['UPLOAD_TMP_DIR'] = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'uploads_tmp')
+# Content-addressed store behind the /uploads/ URLs (see api/blobs.py).
+app.config['BLOB_DIR'] = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'blobs')
 app.debug = os.getenv("FLASK_DEBUG", "0") == "1"
+# Fingerprinted, precompressed static files (see api/assets.py).
+app.jinja_env.globals['asset_url'] = asset_url
+init_request_connections(app)
 db_url = os.getenv("DB_URL")
 engine = None
 
 try:
-    engine = sqlalchemy.create_engine(db_url, pool_pre_ping=True)
-    @event.listens_for(engine, "connect")
-    def set_sqlite_pragma(dbapi_connection, connection_record):
-        cursor = dbapi_connection.cursor()
-        cursor.execute("PRAGMA foreign_keys=ON")
-        cursor.close()
+    # Room for every registered statement in sqlite3's per-connection
+    # prepared-statement cache.
+    connect_args = {"cached_statements": queries.statement_cache_size()} if db_url.startswith("sqlite") else {}
+    engine = sqlalchemy.create_engine(db_url, pool_pre_ping=True, connect_args=connect_args)
+    configure_sqlite(engine)
+    queries.instrument(engine)
     print(f"Successfully connected to SQLite database at {db_url}")
 except Exception as e:
     print(f"An error occurred while connecting to the database: {e}")
     raise
 
-def execute_raw_sql(db_engine, sql_script):
-    statements = [stmt.strip() for stmt in sql_script.split(';') if stmt.strip()]
-    if not statements:
-        return
-    try:
-        with db_engine.connect() as connection:
-            connection.execute(text("PRAGMA foreign_keys = OFF;"))
-            for statement in statements:
-                connection.execute(text(statement))
-            connection.execute(text("PRAGMA foreign_keys = ON;"))
-            connection.commit()
-    except Exception as e:
-        print(f"Could not execute SQL batch. Error: {e}")
-        raise
-
 def manage_database_on_startup():
     if not engine:
         return
     if app.debug and os.environ.get("WERKZEUG_RUN_MAIN") != "true":
         return
-    if app.debug:
-        try:
-            execute_raw_sql(engine, CREATE_SCHEMA_SQL)
-            # seed_data(engine)  # Creates dummydata
-        except Exception as e:
-            print(f"Database reset failed: {e}")
-    else:
-        try:
-            execute_raw_sql(engine, CREATE_SCHEMA_SQL)
-        except Exception as e:
-            print(f"Could not execute CREATE_SCHEMA_SQL: {e}")
+    try:
+        applied = migrate(engine)
+        if applied:
+            print(f"Applied database migrations: {applied}")
+        # seed_data(engine)  # Creates dummydata
+    except Exception as e:
+        print(f"Database migration failed: {e}")
 
 manage_database_on_startup() 
-socketio = SocketIO(app)
+
+@app.cli.command('reconcile-counts')
+def reconcile_counts_command():
+    drift = reconcile_counts(engine)
+    for table_name, value, stored, actual in drift:
+        print(f"{table_name} status {value}: counter had {stored}, table has {actual}")
+    print(f"Rebuilt status counters, {len(drift)} drifted." if drift else "Status counters match the tables.")
+
+@app.cli.command('send-emails')
+def send_emails_command():
+    if not email_enabled():
+        print("No email transport configured.")
+        return
+    _, digests = flush_due_digests(engine)
+    if digests:
+        print(f"Queued {digests} notification digests.")
+    transport = get_transport()
+    total_claimed = total_sent = 0
+    while True:
+        claimed, sent = send_due_emails(engine, transport)
+        total_claimed += claimed
+        total_sent += sent
+        if not claimed:
+            break
+    print(f"Sent {total_sent} of {total_claimed} due emails.")
+
+if not (app.debug and os.environ.get("WERKZEUG_RUN_MAIN") != "true"):
+    start_maintenance(engine)
+    start_email_worker(engine)
+    start_digest_worker(engine)
+socketio = create_socketio(app)
 init_chat(socketio, engine)
 init_application_chat(socketio, engine) 
 
+@app.route('/assets/<path:file_name>')
+def serve_asset(file_name):
+    return send_asset(file_name)
+
 @app.route('/uploads/<path:project_name>/<path:filename>')
 def serve_upload(project_name, filename):
-    project_dir = os.path.join(app.config['UPLOAD_DIR'], project_name)
-    return send_from_directory(project_dir, filename)
+    return send_upload(engine, f"/uploads/{project_name}/{filename}")
 
 @app.route('/admin')
 def admin_index():
@@ -108,12 +136,8 @@ def admin_index():
         flash("Access denied. You must be an admin to view this page.", "danger")
         return redirect(url_for('admin_login'))
 
-    page = request.args.get('page', default=1, type=int) or 1
-    per_page = 6
-    projects, total, total_pages, pending_count, approved_count, taken_count = get_projects_paginated(engine, page=page, per_page=per_page)
-    if page > total_pages:
-        page = total_pages
-    return render_template('/admin/admin.html', projects=projects, page=page, per_page=per_page, total=total, total_pages=total_pages, pending_count=pending_count, approved_count=approved_count, taken_count=taken_count)
+    listing = get_projects_paginated(engine, per_page=6, cursor=request.args.get('cursor'), q=request.args.get('q'), status=request.args.get('status'))
+    return render_template('/admin/admin.html', projects=listing['rows'], **listing)
 
 @app.route('/admin/register', methods=['POST', 'GET'])
 def admin_register():
@@ -133,12 +157,8 @@ def admin_jobs_index():
         flash("You must be logged in as an admin to access admin jobs.", "warning")
         return redirect(url_for('admin_login'))
 
-    page = request.args.get('page', default=1, type=int) or 1
-    per_page = 6
-    jobs, total, total_pages, pending_count, approved_count, taken_count = get_jobs_paginated(engine, page=page, per_page=per_page)
-    if page > total_pages:
-        page = total_pages
-    return render_template('/admin/adminjobs.html', jobs=jobs, page=page, per_page=per_page, total=total, total_pages=total_pages, pending_count=pending_count, approved_count=approved_count, taken_count=taken_count)
+    listing = get_jobs_paginated(engine, per_page=6, cursor=request.args.get('cursor'), q=request.args.get('q'), status=request.args.get('status'))
+    return render_template('/admin/adminjobs.html', jobs=listing['rows'], **listing)
 
 @app.route('/admin/users', endpoint='adminusers')
 def admin_users_index():
@@ -146,10 +166,8 @@ def admin_users_index():
         flash("Access denied. Admins only.", "danger")
         return redirect(url_for('admin_login'))
 
-    page = request.args.get('page', default=1, type=int) or 1
-    per_page = 6
-    users, total, total_pages, pending_count, approved_count, taken_count = get_users_paginated(engine, page=page, per_page=per_page)
-    return render_template('/admin/adminusers.html', users=users, page=page, per_page=per_page, total=total, total_pages=total_pages, pending_count=pending_count, approved_count=approved_count, taken_count=taken_count)
+    listing = get_users_paginated(engine, per_page=6, cursor=request.args.get('cursor'), q=request.args.get('q'), role=request.args.get('status'))
+    return render_template('/admin/adminusers.html', users=listing['rows'], **listing)
 
 @app.route('/admin/messages', endpoint='adminmessages')
 def admin_messages_index():
@@ -160,6 +178,23 @@ def admin_messages_index():
     messages = get_admin_messages(engine)
     return render_template('/admin/adminmessages.html', admin_messages=messages)
 
+@app.route('/admin/query-stats', methods=['GET', 'POST'])
+def admin_query_stats():
+    if 'user_id' not in session or session.get('role') != 10:
+        return jsonify({"error": "Unauthorized"}), 403
+
+    # Counts are per worker process; POST clears them.
+    if request.method == 'POST':
+        queries.reset_stats()
+    return jsonify({"pid": os.getpid(), "statements": queries.statement_stats()})
+
+@app.route('/admin/password-pool')
+def admin_password_pool():
+    if 'user_id' not in session or session.get('role') != 10:
+        return jsonify({"error": "Unauthorized"}), 403
+
+    return jsonify({"pid": os.getpid(), **password_pool_stats()})
+
 @app.route('/admin/jobs/<int:job_id>/update', methods=['POST'])
 def admin_job_update(job_id):
     if 'user_id' not in session or session.get('role') != 10:
@@ -203,8 +238,8 @@ def index():
         status_filter = request.args.get('status', None)
         sort = request.args.get('sort', 'desc')
         
-        projects = get_all_projects(engine, session, page=1, per_page=12, search_query=search, status_filter=status_filter, sort_order=sort)
-        return render_template('index.html', projects=projects)
+        projects, next_cursor = get_all_projects(engine, session, per_page=12, search_query=search, status_filter=status_filter, sort_order=sort)
+        return render_template('index.html', projects=projects, next_cursor=next_cursor)
     else:
         return render_template('landing_page.html')
 
@@ -218,58 +253,33 @@ def project_page(project_id):
         flash("You need to be logged in to view this page.", "warning")
         return redirect(url_for('login'))
       
-    project = get_project_by_id(project_id, engine)
-    if project:
-        user_id = session.get('user_id')
-          
-        can_chat = check_if_user_can_chat(user_id, project_id, engine)
-        can_edit_links = check_if_user_can_edit_links(user_id, project, engine)
-        can_comment = check_if_user_can_comment(user_id, project, engine)
-
-        teams = get_teams_for_project(project_id, engine)
-        comments = get_comments_for_project(project_id, engine, session)
-        chat_history = []
-          
-        if can_chat:
-            with engine.connect() as conn:
-                history_query = text("""
-                    SELECT c.id AS message_id, u.email, c.message_text, c.timestamp, c.attachment_path
-                    FROM chat_messages c JOIN users u ON c.user_id = u.id
-                    WHERE c.project_id = :project_id ORDER BY c.timestamp ASC
-                """)
-                chat_history = conn.execute(history_query, {"project_id": project_id}).all()
-
-        is_pending_by_current_instructor = False
-        if session.get('role') == 0:
-            with engine.connect() as conn:
-                query = text("""
-                    SELECT 1 FROM instructor_projects
-                    WHERE instructor_id = :instructor_id 
-                      AND project_id = :project_id 
-                      AND status = 1
-                """)
-                result = conn.execute(query, {
-                    "instructor_id": session['user_id'],
-                    "project_id": project_id
-                }).first()
-                if result:
-                    is_pending_by_current_instructor = True
-          
-        return render_template(
-            'project.html', 
-            project=project, 
-            teams=teams, 
-            can_edit_links=can_edit_links, 
-            can_chat=can_chat, 
-            chat_history=chat_history,
-            is_pending_by_current_instructor=is_pending_by_current_instructor,
-            can_comment=can_comment,
-            comments=comments
-        )
+    page = load_project_page(project_id, engine, session)
+    if page:
+        return render_template('project.html', **page)
     else:
         flash("Project not found.", "danger")
         return redirect(url_for('index'))
 
+@app.route('/project/<int:project_id>/chat/history')
+def project_chat_history(project_id):
+    history = get_chat_history('project', project_id, session.get('user_id'),
+                               request.args.get('before'), request.args.get('limit'), engine)
+    if history is None:
+        return jsonify({"error": "Unauthorized"}), 403
+    return jsonify(history)
+
+@app.route('/chat/uploads', methods=['POST'])
+def chat_upload_create():
+    return create_chat_upload(request, engine)
+
+@app.route('/chat/uploads/<upload_id>', methods=['GET', 'PATCH', 'DELETE'])
+def chat_upload(upload_id):
+    if request.method == 'PATCH':
+        return append_chat_upload(upload_id, request, engine)
+    if request.method == 'DELETE':
+        return cancel_chat_upload(upload_id, engine)
+    return chat_upload_status(upload_id, engine)
+
 @app.route('/project/create', methods=['POST'])
 def project_create_route():
     return create_project(request, engine)
@@ -322,9 +332,8 @@ def job_page(job_id):
             applications = get_job_applications(job_id, engine)
           
         elif session.get('role') in [2, 3]:
-            with engine.connect() as conn:
-                query = text("SELECT * FROM job_applications WHERE job_id = :job_id AND user_id = :user_id")
-                my_application = conn.execute(query, {"job_id": job_id, "user_id": session.get('user_id')}).mappings().first()
+            with connect(engine) as conn:
+                my_application = conn.execute(queries.USER_JOB_APPLICATION, {"job_id": job_id, "user_id": session.get('user_id')}).mappings().first()
                   
         return render_template('job.html', job=job, applications=applications, my_application=my_application)
     else:
@@ -371,14 +380,23 @@ def view_application(application_id):
         flash("Application not found or you do not have permission to view it.", "danger")
         return redirect(url_for('index'))
           
-    chat_history = get_application_chat_history(application_id, engine)
+    chat_history, chat_has_more = get_application_chat_history(application_id, engine)
       
     return render_template(
         'application.html',
         application=app_data,
-        chat_history=chat_history
+        chat_history=chat_history,
+        chat_has_more=chat_has_more
     )
 
+@app.route('/application/<int:application_id>/chat/history')
+def application_chat_history(application_id):
+    history = get_chat_history('application', application_id, session.get('user_id'),
+                               request.args.get('before'), request.args.get('limit'), engine)
+    if history is None:
+        return jsonify({"error": "Unauthorized"}), 403
+    return jsonify(history)
+
 @app.route('/profile')
 def profile():
     if 'user_id' not in session:
@@ -415,6 +433,12 @@ def user_mgt():
         return redirect(url_for('profile'))
     return get_user_mgt_data(engine)
 
+@app.route('/classroom/roster', methods=['GET'])
+def user_mgt_roster():
+    if 'user_id' not in session or session.get('role') != 0:
+        return jsonify({"success": False, "message": "Permission denied."}), 403
+    return get_roster_page(engine)
+
 @app.route('/register', methods=['POST', 'GET'])
 def register():
     if request.method == 'POST':
@@ -445,6 +469,10 @@ def logout():
 def create_user_route():
     return create_user_by_instructor(engine)
 
+@app.route('/user/import', methods=['POST'])
+def import_users_route():
+    return import_students_by_instructor(engine)
+
 @app.route('/group/create', methods=['POST'])
 def create_group_route():
     return create_group(engine)
@@ -0,0 +1,186 @@
+import os
+import hashlib
+import inspect
+import mimetypes
+import sqlite3
+
+from schema.schema import CREATE_SCHEMA_SQL, STATUS_COUNTS_SQL, SEARCH_SQL, CHAT_HISTORY_SQL, CHAT_UPLOADS_SQL, EMAIL_OUTBOX_SQL, NOTIFICATION_EVENTS_SQL, BLOBS_SQL, ATTACHMENTS_SQL
+
+UPLOAD_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'uploads')
+
+def split_statements(script):
+    statements = []
+    current = ""
+    for piece in script.split(";"):
+        current += piece + ";"
+        if sqlite3.complete_statement(current):
+            if current.strip(" \t\r\n;"):
+                statements.append(current.strip())
+            current = ""
+    return statements
+
+def _attachment_size(dbapi_connection, path):
+    row = dbapi_connection.execute(
+        "SELECT b.size FROM blob_names n JOIN blobs b ON b.hash = n.hash WHERE n.path = ?", (path,)
+    ).fetchone()
+    if row:
+        return row[0]
+    if path.startswith('/uploads/'):
+        try:
+            return os.path.getsize(os.path.join(UPLOAD_DIR, path[len('/uploads/'):]))
+        except OSError:
+            pass
+    return None
+
+# Moves the semicolon-joined attachment_path strings of projects and comments
+# into one attachments row per file, then drops the old columns.
+def normalize_attachments(dbapi_connection):
+    for statement in split_statements(ATTACHMENTS_SQL):
+        dbapi_connection.execute(statement)
+
+    owners = dbapi_connection.execute("""
+        SELECT 'project', id, id, attachment_path, created_at FROM projects WHERE attachment_path IS NOT NULL
+        UNION ALL
+        SELECT 'comment', id, project_id, attachment_path, created_at FROM comments WHERE attachment_path IS NOT NULL
+    """).fetchall()
+    for owner_type, owner_id, project_id, joined, created_at in owners:
+        for path in joined.split(';'):
+            if not path:
+                continue
+            dbapi_connection.execute(
+                "INSERT INTO attachments (owner_type, owner_id, project_id, path, size, mime, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (owner_type, owner_id, project_id, path, _attachment_size(dbapi_connection, path),
+                 mimetypes.guess_type(path)[0], created_at or "1970-01-01 00:00:00")
+            )
+
+    dbapi_connection.execute("ALTER TABLE projects DROP COLUMN attachment_path")
+    dbapi_connection.execute("ALTER TABLE comments DROP COLUMN attachment_path")
+
+# Numbered forward migrations. Each entry is (version, name, step) where step
+# is either an SQL script or a callable taking the DB-API connection. Never
+# edit a migration that has shipped; append a new one instead.
+MIGRATIONS = [
+    (1, "baseline schema", CREATE_SCHEMA_SQL),
+    (2, "status counters", STATUS_COUNTS_SQL),
+    (3, "full-text search", SEARCH_SQL),
+    (4, "chat history indexes", CHAT_HISTORY_SQL),
+    (5, "chat uploads", CHAT_UPLOADS_SQL),
+    (6, "email outbox", EMAIL_OUTBOX_SQL),
+    (7, "notification digests", NOTIFICATION_EVENTS_SQL),
+    (8, "blob store", BLOBS_SQL),
+    (9, "attachments table", normalize_attachments),
+]
+
+SCHEMA_VERSION_SQL = """
+CREATE TABLE IF NOT EXISTS schema_version (
+	version INTEGER PRIMARY KEY,
+	name TEXT NOT NULL,
+	fingerprint TEXT NOT NULL,
+	applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+# A callable step is fingerprinted by its source, so editing its body after
+# it shipped is caught like editing an SQL step. by_name gives the fingerprint
+# databases recorded before that, when only the callable's name was hashed.
+def _step_source(step, by_name=False):
+    if callable(step):
+        if by_name:
+            return f"{step.__module__}.{step.__qualname__}"
+        return inspect.getsource(step)
+    return "\n".join(split_statements(step))
+
+def fingerprints(by_name=False):
+    result = {}
+    digest = hashlib.sha256()
+    for version, name, step in MIGRATIONS:
+        digest.update(f"{version}:{name}:{_step_source(step, by_name)}".encode("utf-8"))
+        result[version] = digest.hexdigest()
+    return result
+
+def head():
+    version = MIGRATIONS[-1][0]
+    return version, fingerprints()[version]
+
+def current_version(dbapi_connection):
+    try:
+        row = dbapi_connection.execute(
+            "SELECT version, fingerprint FROM schema_version ORDER BY version DESC LIMIT 1"
+        ).fetchone()
+    except sqlite3.OperationalError:
+        return 0, None
+    return (row[0], row[1]) if row else (0, None)
+
+def _apply(dbapi_connection, step):
+    if callable(step):
+        step(dbapi_connection)
+        return
+    for statement in split_statements(step):
+        dbapi_connection.execute(statement)
+
+def apply_migrations(dbapi_connection):
+    head_version, head_fingerprint = head()
+    if current_version(dbapi_connection) == (head_version, head_fingerprint):
+        return []
+
+    expected = fingerprints()
+    applied = []
+    isolation_level = dbapi_connection.isolation_level
+    dbapi_connection.isolation_level = None
+    try:
+        dbapi_connection.execute("PRAGMA foreign_keys = OFF")
+        # BEGIN IMMEDIATE takes the write lock, so when several workers boot at
+        # once only one migrates and the rest wait, then find nothing to do.
+        dbapi_connection.execute("BEGIN IMMEDIATE")
+        try:
+            dbapi_connection.execute(SCHEMA_VERSION_SQL)
+            version, fingerprint = current_version(dbapi_connection)
+            if version > head_version:
+                raise RuntimeError(f"Database schema version {version} is newer than this build ({head_version})")
+            if version and fingerprint != expected.get(version) and fingerprint == fingerprints(by_name=True).get(version):
+                for migration_version, migration_fingerprint in expected.items():
+                    dbapi_connection.execute(
+                        "UPDATE schema_version SET fingerprint = ? WHERE version = ?",
+                        (migration_fingerprint, migration_version)
+                    )
+                fingerprint = expected[version]
+            if version and fingerprint != expected.get(version):
+                raise RuntimeError(f"schema_version {version} does not match migration {version} in this build")
+
+            for migration_version, name, step in MIGRATIONS:
+                if migration_version <= version:
+                    continue
+                _apply(dbapi_connection, step)
+                dbapi_connection.execute(
+                    "INSERT INTO schema_version (version, name, fingerprint) VALUES (?, ?, ?)",
+                    (migration_version, name, expected[migration_version])
+                )
+                applied.append(migration_version)
+
+            violations = dbapi_connection.execute("PRAGMA foreign_key_check").fetchall()
+            if violations:
+                raise RuntimeError(f"Migration left {len(violations)} foreign key violations")
+            dbapi_connection.execute("COMMIT")
+        except Exception:
+            dbapi_connection.execute("ROLLBACK")
+            raise
+    finally:
+        dbapi_connection.execute("PRAGMA foreign_keys = ON")
+        dbapi_connection.isolation_level = isolation_level
+    return applied
+
+def migrate(engine):
+    raw_connection = engine.raw_connection()
+    try:
+        return apply_migrations(raw_connection.driver_connection)
+    finally:
+        raw_connection.close()
+
+if __name__ == '__main__':
+    import os
+    import sqlalchemy
+
+    engine = sqlalchemy.create_engine(os.getenv("DB_URL", "sqlite:///sqlite.db"))
+    applied = migrate(engine)
+    version, fingerprint = head()
+    print(f"Applied migrations: {applied or 'none'}. Schema is at version {version} ({fingerprint[:12]}).")
@@ -0,0 +1,135 @@
+import argparse
+import ast
+import glob
+import os
+import re
+import sqlite3
+import sys
+
+from api.listing import LISTINGS
+from api.queries import STATEMENTS
+from schema.migrations import apply_migrations
+
+# Usage: python -m schema.queryplan [--db sqlite.db] [--min-rows 1000]
+#
+# Runs EXPLAIN QUERY PLAN on every statement in the api/queries.py registry
+# (which includes every admin listing variant) and fails when a statement
+# full-scans a table, or when api/*.py builds SQL inline with text() instead
+# of declaring it in the registry. Without --db the plans are taken against
+# an empty copy of the schema and every table counts as large.
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Statements that are allowed to scan a table, keyed by statement name. The
+# listing recount walks the status index, the unfiltered first/last pages
+# walk the rowid and stop at LIMIT, and ?q= search is either a LIKE scan or
+# an FTS5 lookup joined back to the table. The unfiltered project feed walks
+# the rowid in key order and stops at LIMIT as well.
+ALLOWED_SCANS = {
+    **{listing.statement_name(kind, has_q, has_status): {listing.table}
+       for listing in LISTINGS.values()
+       for kind, has_q, has_status in listing.variants()
+       if has_q or (kind in ('recount', 'first', 'last') and not has_status)},
+    'adminmessages.admin_messages': {'admin_messages'},
+    # Holds pending events only; flushed groups are deleted.
+    'notifications.due_groups': {'notification_events'},
+    'projects.feed.asc': {'projects'},
+    'projects.feed.desc': {'projects'},
+}
+
+# Expanding binds (text("... IN :ids").bindparams(bindparam("ids", expanding=True)))
+# are planned as a one-element list.
+EXPANDING_RE = re.compile(r"\bIN\s+:(\w+)", re.IGNORECASE)
+PARAM_RE = re.compile(r"(?<![:\w]):(\w+)")
+TABLE_RE = re.compile(r"\b(?:FROM|JOIN|UPDATE|INTO)\s+(\w+)(?:\s+(?:AS\s+)?(?!ON\b|WHERE\b|JOIN\b|LEFT\b|INNER\b|SET\b|ORDER\b|GROUP\b|LIMIT\b|VALUES\b)(\w+))?", re.IGNORECASE)
+# "SCAN CONSTANT ROW" is a SELECT with no FROM (e.g. a row of EXISTS checks).
+SCAN_RE = re.compile(r"^SCAN (?:TABLE )?(?!CONSTANT ROW)(\w+)")
+# FTS5 reports a MATCH lookup as "SCAN x VIRTUAL TABLE INDEX 0:M..."; only a
+# virtual table scan without the M constraint reads the whole index.
+FTS_MATCH_RE = re.compile(r"VIRTUAL TABLE INDEX \d+:\S*M")
+
+def _inline_statements(paths):
+    inline = []
+    for path in paths:
+        module = os.path.relpath(path, ROOT)
+        tree = ast.parse(open(path, encoding='utf-8').read(), filename=path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == 'text':
+                inline.append(f"{module}:{node.lineno}")
+    return inline
+
+def _sql(statement):
+    # .columns() wraps the TextClause in a TextualSelect.
+    return getattr(statement, 'element', statement).text
+
+def _table_aliases(sql):
+    aliases = {}
+    for table, alias in TABLE_RE.findall(sql):
+        aliases[table.lower()] = table.lower()
+        if alias:
+            aliases[alias.lower()] = table.lower()
+    return aliases
+
+def _open_database(db_path):
+    if db_path:
+        return sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    conn = sqlite3.connect(':memory:')
+    apply_migrations(conn)
+    return conn
+
+def _table_sizes(conn):
+    sizes = {}
+    tables = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'").fetchall()
+    for (name,) in tables:
+        sizes[name.lower()] = conn.execute(f'SELECT COUNT(*) FROM "{name}"').fetchone()[0]
+    return sizes
+
+def check(db_path=None, min_rows=0, paths=None):
+    paths = paths or sorted(path for path in glob.glob(os.path.join(ROOT, 'api', '*.py')) if not path.endswith('queries.py'))
+    failures = [f"{location}: inline text() SQL; declare it in api/queries.py" for location in _inline_statements(paths)]
+    conn = _open_database(db_path)
+    sizes = _table_sizes(conn)
+
+    for name, statement in sorted(STATEMENTS.items()):
+        sql = EXPANDING_RE.sub(r"IN (:\1)", _sql(statement))
+        params = {param: None for param in PARAM_RE.findall(sql)}
+        try:
+            plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+        except sqlite3.Error as e:
+            failures.append(f"{name}: cannot explain ({e})")
+            continue
+
+        aliases = _table_aliases(sql)
+        allowed = ALLOWED_SCANS.get(name, set())
+        for row in plan:
+            match = SCAN_RE.match(row[-1])
+            if not match or FTS_MATCH_RE.search(row[-1]):
+                continue
+            table = aliases.get(match.group(1).lower(), match.group(1).lower())
+            # CTEs and subqueries are planned on their own rows of the plan.
+            if table in allowed or table not in sizes:
+                continue
+            if db_path and sizes[table] < min_rows:
+                continue
+            failures.append(f"{name}: {row[-1]}")
+
+    conn.close()
+    return STATEMENTS, failures
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fail on full table scans in the api/queries.py statements.")
+    parser.add_argument('--db', help="SQLite database file to plan against (defaults to an empty schema).")
+    parser.add_argument('--min-rows', type=int, default=1000, help="Ignore scans of tables smaller than this when --db is given.")
+    args = parser.parse_args(argv)
+
+    statements, failures = check(args.db, args.min_rows)
+    print(f"Checked {len(statements)} statements.")
+    if failures:
+        print("Problems found:")
+        for failure in failures:
+            print(f"  {failure}")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -149,4 +149,241 @@ CREATE TABLE IF NOT EXISTS admin_messages (
 	timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
 	FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 );
+
+CREATE INDEX IF NOT EXISTS idx_users_instructor_role ON users (instructor_id, role);
+CREATE INDEX IF NOT EXISTS idx_users_role_email ON users (role, email);
+CREATE INDEX IF NOT EXISTS idx_password_reset_tokens_user ON password_reset_tokens (user_id);
+CREATE INDEX IF NOT EXISTS idx_instructor_requests_instructor_status ON instructor_requests (instructor_id, status, student_id);
+CREATE INDEX IF NOT EXISTS idx_instructor_requests_student_status ON instructor_requests (student_id, status);
+CREATE INDEX IF NOT EXISTS idx_projects_user ON projects (user_id);
+CREATE INDEX IF NOT EXISTS idx_projects_status ON projects (status);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_open_created ON jobs (created_at) WHERE status = 1;
+CREATE INDEX IF NOT EXISTS idx_jobs_user_created ON jobs (user_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_job_applications_user_created ON job_applications (user_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_application_messages_application_ts ON application_messages (application_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_application_messages_user ON application_messages (user_id);
+CREATE INDEX IF NOT EXISTS idx_comments_project_created ON comments (project_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_comments_user ON comments (user_id);
+CREATE INDEX IF NOT EXISTS idx_comments_parent ON comments (parent_comment_id) WHERE parent_comment_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_instructor_projects_project_status ON instructor_projects (project_id, status);
+CREATE INDEX IF NOT EXISTS idx_teams_project ON teams (project_id, name);
+CREATE INDEX IF NOT EXISTS idx_teams_user ON teams (user_id);
+CREATE INDEX IF NOT EXISTS idx_team_members_user ON team_members (user_id, team_id);
+CREATE INDEX IF NOT EXISTS idx_project_requests_team ON project_requests (team_id);
+CREATE INDEX IF NOT EXISTS idx_project_requests_project ON project_requests (project_id);
+CREATE INDEX IF NOT EXISTS idx_chat_messages_project_ts ON chat_messages (project_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_chat_messages_user ON chat_messages (user_id);
+CREATE INDEX IF NOT EXISTS idx_admin_messages_ts ON admin_messages (timestamp);
+CREATE INDEX IF NOT EXISTS idx_admin_messages_user ON admin_messages (user_id);
+"""
+
+# Row counts per status (per role for users), kept in step by triggers so the
+# admin dashboards read a handful of primary-key rows instead of aggregating
+# the whole table. NULL statuses are counted under -1.
+STATUS_COUNTS_SQL = """
+CREATE TABLE IF NOT EXISTS status_counts (
+	table_name TEXT NOT NULL,
+	value INTEGER NOT NULL,
+	count INTEGER NOT NULL DEFAULT 0,
+	PRIMARY KEY (table_name, value)
+) WITHOUT ROWID;
+
+DELETE FROM status_counts;
+INSERT INTO status_counts (table_name, value, count) SELECT 'projects', IFNULL(status, -1), COUNT(*) FROM projects GROUP BY 1, 2;
+INSERT INTO status_counts (table_name, value, count) SELECT 'jobs', IFNULL(status, -1), COUNT(*) FROM jobs GROUP BY 1, 2;
+INSERT INTO status_counts (table_name, value, count) SELECT 'users', IFNULL(role, -1), COUNT(*) FROM users GROUP BY 1, 2;
+
+CREATE TRIGGER IF NOT EXISTS projects_status_counts_insert AFTER INSERT ON projects BEGIN
+	INSERT INTO status_counts (table_name, value, count) VALUES ('projects', IFNULL(NEW.status, -1), 1)
+	ON CONFLICT (table_name, value) DO UPDATE SET count = count + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS projects_status_counts_delete AFTER DELETE ON projects BEGIN
+	UPDATE status_counts SET count = count - 1 WHERE table_name = 'projects' AND value = IFNULL(OLD.status, -1);
+END;
+CREATE TRIGGER IF NOT EXISTS projects_status_counts_update AFTER UPDATE OF status ON projects WHEN IFNULL(OLD.status, -1) IS NOT IFNULL(NEW.status, -1) BEGIN
+	UPDATE status_counts SET count = count - 1 WHERE table_name = 'projects' AND value = IFNULL(OLD.status, -1);
+	INSERT INTO status_counts (table_name, value, count) VALUES ('projects', IFNULL(NEW.status, -1), 1)
+	ON CONFLICT (table_name, value) DO UPDATE SET count = count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS jobs_status_counts_insert AFTER INSERT ON jobs BEGIN
+	INSERT INTO status_counts (table_name, value, count) VALUES ('jobs', IFNULL(NEW.status, -1), 1)
+	ON CONFLICT (table_name, value) DO UPDATE SET count = count + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS jobs_status_counts_delete AFTER DELETE ON jobs BEGIN
+	UPDATE status_counts SET count = count - 1 WHERE table_name = 'jobs' AND value = IFNULL(OLD.status, -1);
+END;
+CREATE TRIGGER IF NOT EXISTS jobs_status_counts_update AFTER UPDATE OF status ON jobs WHEN IFNULL(OLD.status, -1) IS NOT IFNULL(NEW.status, -1) BEGIN
+	UPDATE status_counts SET count = count - 1 WHERE table_name = 'jobs' AND value = IFNULL(OLD.status, -1);
+	INSERT INTO status_counts (table_name, value, count) VALUES ('jobs', IFNULL(NEW.status, -1), 1)
+	ON CONFLICT (table_name, value) DO UPDATE SET count = count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS users_status_counts_insert AFTER INSERT ON users BEGIN
+	INSERT INTO status_counts (table_name, value, count) VALUES ('users', IFNULL(NEW.role, -1), 1)
+	ON CONFLICT (table_name, value) DO UPDATE SET count = count + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS users_status_counts_delete AFTER DELETE ON users BEGIN
+	UPDATE status_counts SET count = count - 1 WHERE table_name = 'users' AND value = IFNULL(OLD.role, -1);
+END;
+CREATE TRIGGER IF NOT EXISTS users_status_counts_update AFTER UPDATE OF role ON users WHEN IFNULL(OLD.role, -1) IS NOT IFNULL(NEW.role, -1) BEGIN
+	UPDATE status_counts SET count = count - 1 WHERE table_name = 'users' AND value = IFNULL(OLD.role, -1);
+	INSERT INTO status_counts (table_name, value, count) VALUES ('users', IFNULL(NEW.role, -1), 1)
+	ON CONFLICT (table_name, value) DO UPDATE SET count = count + 1;
+END;
+"""
+
+# Full-text indexes. rowid is the projects/jobs id; triggers keep them in step
+# with the source rows, including a business renaming itself.
+SEARCH_SQL = """
+CREATE VIRTUAL TABLE IF NOT EXISTS projects_fts USING fts5(name, description, business_name, tokenize = 'unicode61 remove_diacritics 2');
+CREATE VIRTUAL TABLE IF NOT EXISTS jobs_fts USING fts5(title, description, tokenize = 'unicode61 remove_diacritics 2');
+
+DELETE FROM projects_fts;
+INSERT INTO projects_fts (rowid, name, description, business_name)
+SELECT p.id, p.name, p.description, u.name FROM projects p LEFT JOIN users u ON u.id = p.user_id;
+DELETE FROM jobs_fts;
+INSERT INTO jobs_fts (rowid, title, description) SELECT id, title, description FROM jobs;
+
+CREATE TRIGGER IF NOT EXISTS projects_fts_insert AFTER INSERT ON projects BEGIN
+	INSERT INTO projects_fts (rowid, name, description, business_name)
+	VALUES (NEW.id, NEW.name, NEW.description, (SELECT name FROM users WHERE id = NEW.user_id));
+END;
+CREATE TRIGGER IF NOT EXISTS projects_fts_delete AFTER DELETE ON projects BEGIN
+	DELETE FROM projects_fts WHERE rowid = OLD.id;
+END;
+CREATE TRIGGER IF NOT EXISTS projects_fts_update AFTER UPDATE OF name, description, user_id ON projects BEGIN
+	UPDATE projects_fts SET name = NEW.name, description = NEW.description,
+		business_name = (SELECT name FROM users WHERE id = NEW.user_id)
+	WHERE rowid = NEW.id;
+END;
+CREATE TRIGGER IF NOT EXISTS users_projects_fts_update AFTER UPDATE OF name ON users WHEN OLD.name IS NOT NEW.name BEGIN
+	UPDATE projects_fts SET business_name = NEW.name WHERE rowid IN (SELECT id FROM projects WHERE user_id = NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS jobs_fts_insert AFTER INSERT ON jobs BEGIN
+	INSERT INTO jobs_fts (rowid, title, description) VALUES (NEW.id, NEW.title, NEW.description);
+END;
+CREATE TRIGGER IF NOT EXISTS jobs_fts_delete AFTER DELETE ON jobs BEGIN
+	DELETE FROM jobs_fts WHERE rowid = OLD.id;
+END;
+CREATE TRIGGER IF NOT EXISTS jobs_fts_update AFTER UPDATE OF title, description ON jobs BEGIN
+	UPDATE jobs_fts SET title = NEW.title, description = NEW.description WHERE rowid = NEW.id;
+END;
+"""
+
+# Chat history is read newest-first in pages keyed on the message id, so the
+# rooms are indexed by (room, id) instead of (room, timestamp).
+CHAT_HISTORY_SQL = """
+CREATE INDEX IF NOT EXISTS idx_chat_messages_project_id ON chat_messages (project_id, id);
+CREATE INDEX IF NOT EXISTS idx_application_messages_application_id ON application_messages (application_id, id);
+DROP INDEX IF EXISTS idx_chat_messages_project_ts;
+DROP INDEX IF EXISTS idx_application_messages_application_ts;
+"""
+
+# Chat attachments in flight. The bytes go to a partial file named after the
+# upload id; its length is the resume offset, so chunks never touch the
+# database. A chat message claims (deletes) the row once the file is whole.
+CHAT_UPLOADS_SQL = """
+CREATE TABLE IF NOT EXISTS chat_uploads (
+	id TEXT PRIMARY KEY,
+	user_id INTEGER NOT NULL,
+	kind TEXT NOT NULL,
+	room_id INTEGER NOT NULL,
+	filename TEXT NOT NULL,
+	size INTEGER NOT NULL,
+	created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+	FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS idx_chat_uploads_created ON chat_uploads (created_at);
+CREATE INDEX IF NOT EXISTS idx_chat_uploads_user ON chat_uploads (user_id);
+"""
+
+# Outgoing email, written in the same transaction as whatever caused it and
+# sent by a background worker. status: 0 pending, 1 sent, 2 gave up. A
+# pending row is due at next_attempt_at; claiming it pushes that forward by
+# a lease, so a worker that dies mid-send leaves it to be retried.
+EMAIL_OUTBOX_SQL = """
+CREATE TABLE IF NOT EXISTS email_outbox (
+	id INTEGER PRIMARY KEY AUTOINCREMENT,
+	idempotency_key TEXT NOT NULL UNIQUE,
+	to_addresses TEXT NOT NULL,
+	bcc_addresses TEXT NOT NULL DEFAULT '[]',
+	subject TEXT NOT NULL,
+	html TEXT NOT NULL,
+	status INTEGER NOT NULL DEFAULT 0,
+	attempts INTEGER NOT NULL DEFAULT 0,
+	next_attempt_at DATETIME NOT NULL,
+	last_error TEXT NULL,
+	created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+	sent_at DATETIME NULL
+);
+CREATE INDEX IF NOT EXISTS idx_email_outbox_due ON email_outbox (next_attempt_at) WHERE status = 0;
+"""
+
+# Comment notifications waiting to go out as a digest, one row per recipient
+# per comment. The digest worker deletes a (user, project) group when it
+# enqueues its email, so the table only ever holds pending events. link is
+# the project URL, built in the request because the worker has none.
+NOTIFICATION_EVENTS_SQL = """
+CREATE TABLE IF NOT EXISTS notification_events (
+	id INTEGER PRIMARY KEY AUTOINCREMENT,
+	user_id INTEGER NOT NULL,
+	project_id INTEGER NOT NULL,
+	comment_id INTEGER NOT NULL,
+	link TEXT NOT NULL,
+	created_at DATETIME NOT NULL,
+	FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+	FOREIGN KEY (project_id) REFERENCES projects(id) ON DELETE CASCADE,
+	FOREIGN KEY (comment_id) REFERENCES comments(id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS idx_notification_events_recipient ON notification_events (user_id, project_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_notification_events_project ON notification_events (project_id);
+CREATE INDEX IF NOT EXISTS idx_notification_events_comment ON notification_events (comment_id);
+"""
+
+# Content-addressed upload store (see api/blobs.py). A blob is one file on
+# disk, named by its sha256; blob_names maps each public /uploads/ URL to a
+# blob. refs counts the rows that list a URL, refcount the names of a blob.
+BLOBS_SQL = """
+CREATE TABLE IF NOT EXISTS blobs (
+	hash TEXT PRIMARY KEY,
+	size INTEGER NOT NULL,
+	refcount INTEGER NOT NULL DEFAULT 0,
+	created_at DATETIME NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blob_names (
+	path TEXT PRIMARY KEY,
+	hash TEXT NOT NULL,
+	refs INTEGER NOT NULL DEFAULT 1,
+	created_at DATETIME NOT NULL,
+	FOREIGN KEY (hash) REFERENCES blobs(hash)
+);
+CREATE INDEX IF NOT EXISTS idx_blob_names_hash ON blob_names (hash);
+"""
+
+# Project files and comment attachments, one row per file. owner_type is
+# 'project' (owner_id is the project) or 'comment'; project_id is kept on
+# every row so a project's listing and storage total are one index range.
+# size is the stored file's size, NULL when the file could not be found.
+# Replaces the semicolon-joined projects.attachment_path and
+# comments.attachment_path (see normalize_attachments in migrations.py).
+ATTACHMENTS_SQL = """
+CREATE TABLE IF NOT EXISTS attachments (
+	id INTEGER PRIMARY KEY AUTOINCREMENT,
+	owner_type TEXT NOT NULL CHECK (owner_type IN ('project', 'comment')),
+	owner_id INTEGER NOT NULL,
+	project_id INTEGER NOT NULL,
+	path TEXT NOT NULL,
+	size INTEGER NULL,
+	mime TEXT NULL,
+	created_at DATETIME NOT NULL,
+	FOREIGN KEY (project_id) REFERENCES projects(id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS idx_attachments_owner ON attachments (owner_type, owner_id, path);
+CREATE INDEX IF NOT EXISTS idx_attachments_project ON attachments (project_id, size);
+CREATE TRIGGER IF NOT EXISTS comments_attachments_delete AFTER DELETE ON comments BEGIN
+	DELETE FROM attachments WHERE owner_type = 'comment' AND owner_id = OLD.id;
+END;
 """
@@ -0,0 +1,47 @@
+// Chat attachments are sent over HTTP in chunks instead of as one base64
+// socket event. Each chunk carries the offset it starts at; after a network
+// or server error the upload asks the server how much it has and resumes
+// from there.
+// Resolves with the upload id to send along with the chat message.
+async function uploadChatFile(file, kind, roomId, onProgress) {
+  const created = await fetch("/chat/uploads", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ kind: kind, room_id: roomId, filename: file.name, size: file.size }),
+  });
+  const upload = await created.json();
+  if (!created.ok) throw new Error(upload.error || "Upload failed.");
+
+  const url = `/chat/uploads/${upload.upload_id}`;
+  let offset = upload.offset;
+  let failures = 0;
+
+  while (offset < file.size) {
+    let response;
+    try {
+      response = await fetch(url, {
+        method: "PATCH",
+        headers: { "Content-Type": "application/octet-stream", "Upload-Offset": String(offset) },
+        body: file.slice(offset, offset + upload.chunk_size),
+      });
+      if (response.status >= 500) throw new Error("Server error.");
+    } catch (err) {
+      if (++failures > 5) throw new Error("Upload interrupted.");
+      await new Promise((resolve) => setTimeout(resolve, 1000 * failures));
+      const status = await fetch(url).catch(() => null);
+      if (status && status.ok) offset = (await status.json()).offset;
+      continue;
+    }
+
+    const state = await response.json();
+    if (response.status === 409) {
+      offset = state.offset;
+      continue;
+    }
+    if (!response.ok) throw new Error(state.error || "Upload failed.");
+    offset = state.offset;
+    failures = 0;
+    if (onProgress) onProgress(offset, file.size);
+  }
+  return upload.upload_id;
+}